@@ -0,0 +1,55 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Helpers shared by the benchmark scripts."""
+
+import time
+
+import numpy as np
+
+
+def measure_latencies_ms(fn, iterations, warmup = 5):
+  """Calls fn repeatedly and returns the latency of each call.
+
+  Args:
+    fn: A function without arguments to measure.
+    iterations: Number of measured calls.
+    warmup: Number of calls to make before measuring.
+
+  Returns:
+    A numpy array of per-call latencies in milliseconds.
+  """
+  for _ in range(warmup):
+    fn()
+  latencies = []
+  for _ in range(iterations):
+    start = time.perf_counter()
+    fn()
+    latencies.append((time.perf_counter() - start) * 1000)
+  return np.asarray(latencies)
+
+
+def format_latencies(name, latencies_ms):
+  """Formats p50/p99 latencies of a benchmark run as a single line."""
+  return '%-24s p50=%8.3fms  p99=%8.3fms  mean=%8.3fms' % (
+      name, np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 99),
+      np.mean(latencies_ms))
+
+
+def format_percentiles(name, latencies_ms, percentiles = (50, 90, 99, 99.9)):
+  """Formats the given latency percentiles of a benchmark run as one line."""
+  return '%-24s %s  max=%8.3fms' % (name, '  '.join(
+      'p%s=%8.3fms' % (('%g' % p), np.percentile(latencies_ms, p))
+      for p in percentiles), np.max(latencies_ms))
@@ -0,0 +1,65 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares explain latency with and without a pooled transport.
+
+Run from the repository root:
+
+  python -m benchmarks.connection_pool_benchmark --iterations 500
+"""
+
+import argparse
+import os
+
+from benchmarks import benchmark_utils
+from benchmarks import stand_in_server
+from explainable_ai_sdk.model import http_utils
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--iterations', type=int, default=300)
+  parser.add_argument('--batch_size', type=int, default=4)
+  args = parser.parse_args()
+
+  credentials = stand_in_server.StaticCredentials()
+  request_body = {'instances': [{'data': [0.1, 0.2]}] * args.batch_size}
+  uri_params = stand_in_server.MODEL_ENDPOINT + ':explain'
+
+  with stand_in_server.StandInServer() as server:
+    os.environ['CLOUDSDK_API_ENDPOINT_OVERRIDES_ML'] = server.endpoint
+
+    def explain_unpooled():
+      http_utils.make_post_request_to_ai_platform(
+          uri_params, request_body, credentials)
+
+    transport = http_utils.AIPlatformTransport()
+
+    def explain_pooled():
+      http_utils.make_post_request_to_ai_platform(
+          uri_params, request_body, credentials, transport=transport)
+
+    print(benchmark_utils.format_latencies(
+        'per-call connection',
+        benchmark_utils.measure_latencies_ms(explain_unpooled,
+                                             args.iterations)))
+    print(benchmark_utils.format_latencies(
+        'pooled transport',
+        benchmark_utils.measure_latencies_ms(explain_pooled, args.iterations)))
+    transport.close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,109 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures decode time and peak memory of large explain responses.
+
+Each run decodes a synthetic explain response body (image-sized attributions)
+with one of the JSON backends, converts its attributions to numpy as the
+transports do, and builds the LabelIndexToAttribution objects the SDK
+returns. The baseline is a plain json.loads, which is what requests'
+response.json() does, with the conversion left to the Attribution objects.
+Run from the repository root:
+
+  python -m benchmarks.explain_decode_benchmark --image_size 224
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from explainable_ai_sdk.common import attribution
+from explainable_ai_sdk.model import json_utils
+
+
+def make_explain_response(instance_count, image_size, label_count):
+  """Returns the bytes of an explain response with image attributions."""
+  rng = np.random.RandomState(0)
+  explanations = []
+  for _ in range(instance_count):
+    explanations.append({
+        'attributions_by_label': [{
+            'attributions': {
+                'image': rng.rand(image_size, image_size, 3).round(6).tolist()
+            },
+            'baseline_score': 0.01,
+            'example_score': float(rng.rand()),
+            'label_index': label,
+            'output_name': 'probability'
+        } for label in range(label_count)]
+    })
+  return json.dumps({'explanations': explanations}).encode('utf-8')
+
+
+def decode(content, decoder, convert):
+  response = decoder(content)
+  if convert:
+    json_utils.convert_explain_response(response)
+  return [
+      attribution.LabelIndexToAttribution.from_list(
+          explanation_dict['attributions_by_label'])
+      for explanation_dict in response['explanations']
+  ]
+
+
+def measure(content, decoder, convert, iterations):
+  """Returns the best decode time in ms and the peak traced memory in MB."""
+  times = []
+  for _ in range(iterations):
+    start = time.perf_counter()
+    decode(content, decoder, convert)
+    times.append((time.perf_counter() - start) * 1000)
+  tracemalloc.start()
+  decode(content, decoder, convert)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return min(times), peak / 2**20
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--instances', type=int, default=4)
+  parser.add_argument('--image_size', type=int, default=224)
+  parser.add_argument('--labels', type=int, default=1)
+  parser.add_argument('--iterations', type=int, default=5)
+  args = parser.parse_args()
+
+  content = make_explain_response(args.instances, args.image_size,
+                                  args.labels)
+  print('Response size: %.1f MB' % (len(content) / 2**20))
+  decoders = [('baseline', json.loads, False),
+              (json_utils.STDLIB, json_utils.get_decoder(json_utils.STDLIB),
+               True)]
+  if json_utils.ujson is not None:
+    decoders.append(
+        (json_utils.UJSON, json_utils.get_decoder(json_utils.UJSON), True))
+  if json_utils.orjson is not None:
+    decoders.append(
+        (json_utils.ORJSON, json_utils.get_decoder(json_utils.ORJSON), True))
+  for name, decoder, convert in decoders:
+    best_ms, peak_mb = measure(content, decoder, convert, args.iterations)
+    print('%-8s decode=%9.1fms  peak=%8.1fMB' % (name, best_ms, peak_mb))
+
+
+if __name__ == '__main__':
+  main()
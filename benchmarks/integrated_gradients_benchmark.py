@@ -0,0 +1,142 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures local Integrated Gradients throughput on CPU.
+
+Compares evaluating every path point of every instance in a separate model
+call with the batched engine, which evaluates all of them in sub-batches that
+fit the memory budget, for several step counts and batch sizes. The model is
+a small MLP saved as a TF2 SavedModel. Run from the repository root:
+
+  python -m benchmarks.integrated_gradients_benchmark --step_counts 10,50
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from explainable_ai_sdk.common import explain_metadata
+from explainable_ai_sdk.model import integrated_gradients
+from explainable_ai_sdk.model import local_model
+
+
+class _Mlp(tf.Module):
+  """A two layer MLP with softmax outputs."""
+
+  def __init__(self, feature_count, hidden_units, class_count):
+    super(_Mlp, self).__init__()
+    rng = np.random.RandomState(0)
+    self._w1 = tf.constant(
+        rng.randn(feature_count, hidden_units).astype(np.float32) * 0.1)
+    self._w2 = tf.constant(
+        rng.randn(hidden_units, class_count).astype(np.float32) * 0.1)
+    self.serve = tf.function(
+        self._serve,
+        input_signature=[tf.TensorSpec([None, feature_count], tf.float32)])
+
+  def _serve(self, x):
+    hidden = tf.nn.relu(tf.matmul(x, self._w1))
+    return {'probabilities': tf.nn.softmax(tf.matmul(hidden, self._w2))}
+
+
+def load_model_fn(path, feature_count, hidden_units, class_count):
+  module = _Mlp(feature_count, hidden_units, class_count)
+  tf.saved_model.save(module, path, signatures={'serving_default': module.serve})
+  explain_md = explain_metadata.ExplainMetadata(
+      inputs=[explain_metadata.InputMetadata('x', 'x')],
+      outputs=[explain_metadata.OutputMetadata('probabilities',
+                                               'probabilities')],
+      framework='tensorflow2')
+  return local_model.ModelFunction(
+      tf.saved_model.load(path).signatures['serving_default'], explain_md)
+
+
+def attribute_per_step(model_fn, inputs, baselines, label_indices,
+                       step_count):
+  """Evaluates each path point of each instance in its own model call."""
+  alphas, weights = integrated_gradients.get_path_weights(step_count)
+  x = inputs['x']
+  for i in range(len(x)):
+    for baseline in baselines:
+      for j in range(label_indices.shape[1]):
+        integral = np.zeros(x.shape[1:])
+        for alpha, weight in zip(alphas, weights):
+          point = baseline['x'] + alpha * (x[i] - baseline['x'])
+          _, gradients = model_fn.gradients(
+              {'x': point[np.newaxis].astype(np.float32)},
+              label_indices[i, j:j + 1], ['x'])
+          integral += weight * gradients['x'][0]
+
+
+def time_secs(fn, repeats):
+  fn()  # Traces the model function for the batch shapes used.
+  start = time.perf_counter()
+  for _ in range(repeats):
+    fn()
+  return (time.perf_counter() - start) / repeats
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--step_counts', default='10,50,200')
+  parser.add_argument('--batch_sizes', default='1,8,32')
+  parser.add_argument('--feature_count', type=int, default=64)
+  parser.add_argument('--hidden_units', type=int, default=256)
+  parser.add_argument('--class_count', type=int, default=10)
+  parser.add_argument('--max_batch_mb', type=float, default=64)
+  parser.add_argument('--max_step_count', type=int, default=None,
+                      help='Adapt the step count of the batched engine to '
+                      'each instance, starting from each step count.')
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--skip_per_step', action='store_true',
+                      help='Only measure the batched engine.')
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    model_fn = load_model_fn(tmp_dir, args.feature_count, args.hidden_units,
+                             args.class_count)
+    rng = np.random.RandomState(0)
+    baselines = [{'x': np.zeros(args.feature_count, dtype=np.float32)}]
+    print('%-10s %-6s %16s %16s' % ('steps', 'batch', 'per-step inst/s',
+                                    'batched inst/s'))
+    for step_count in [int(s) for s in args.step_counts.split(',')]:
+      explainer = integrated_gradients.IntegratedGradients(
+          step_count,
+          max_batch_bytes=int(args.max_batch_mb * 1024 * 1024),
+          max_step_count=args.max_step_count)
+      for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        inputs = {
+            'x': rng.rand(batch_size, args.feature_count).astype(np.float32)
+        }
+        label_indices = np.argmax(model_fn.scores(inputs), axis=1)[:,
+                                                                    np.newaxis]
+        per_step = float('nan')
+        if not args.skip_per_step:
+          per_step = batch_size / time_secs(
+              lambda: attribute_per_step(model_fn, inputs, baselines,  # pylint: disable=cell-var-from-loop
+                                         label_indices, step_count),
+              1)
+        batched = batch_size / time_secs(
+            lambda: explainer.attribute(model_fn, inputs, baselines,  # pylint: disable=cell-var-from-loop
+                                        label_indices),
+            args.repeats)
+        print('%-10d %-6d %16.1f %16.1f' % (step_count, batch_size, per_step,
+                                            batched))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,179 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures throughput and latency of AIPlatformModel under concurrent load.
+
+Worker threads call predict or explain of one AIPlatformModel in a loop
+against the stand-in server, which simulates the latency, error rate and
+response size of the service. The model's explanation metadata is read from
+a local file, so no GCS access is needed. Run from the repository root:
+
+  python -m benchmarks.load_benchmark --threads 16 --explain_latency_ms 50 \
+      --error_rate 0.01
+"""
+
+import argparse
+from concurrent import futures
+import json
+import os
+import tempfile
+import threading
+import time
+
+from absl import logging
+import numpy as np
+
+from benchmarks import benchmark_utils
+from benchmarks import stand_in_server
+from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import metadata_cache
+
+
+def write_metadata(directory, input_names):
+  """Writes an explanation_metadata.json for the inputs and returns its path."""
+  path = os.path.join(directory, 'explanation_metadata.json')
+  with open(path, 'w') as f:
+    json.dump({
+        'inputs': {name: {'input_tensor_name': name + ':0'}
+                   for name in input_names},
+        'outputs': {'probability': {'output_tensor_name': 'probability:0'}},
+        'framework': 'tensorflow2'
+    }, f)
+  return path
+
+
+def make_instances(batch_size, input_names, feature_size):
+  rng = np.random.RandomState(0)
+  return [{name: rng.rand(feature_size).round(4).tolist()
+           for name in input_names} for _ in range(batch_size)]
+
+
+def run_load(call_fn, threads, duration_secs):
+  """Calls call_fn from several threads for a while.
+
+  Args:
+    call_fn: Function without arguments to call in a loop.
+    threads: Number of threads calling it concurrently.
+    duration_secs: Seconds after which threads stop starting new calls.
+
+  Returns:
+    A tuple of a numpy array with the latencies of successful calls in
+    milliseconds, the number of failed calls and the elapsed seconds.
+  """
+  latencies = []
+  errors = [0]
+  lock = threading.Lock()
+  stop_at = time.monotonic() + duration_secs
+
+  def worker():
+    while time.monotonic() < stop_at:
+      start = time.perf_counter()
+      try:
+        call_fn()
+      except ValueError:
+        with lock:
+          errors[0] += 1
+        continue
+      latency_ms = (time.perf_counter() - start) * 1000
+      with lock:
+        latencies.append(latency_ms)
+
+  start = time.monotonic()
+  with futures.ThreadPoolExecutor(threads) as executor:
+    for future in [executor.submit(worker) for _ in range(threads)]:
+      future.result()
+  return np.asarray(latencies), errors[0], time.monotonic() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--method', choices=('explain', 'predict'),
+                      default='explain')
+  parser.add_argument('--threads', type=int, default=8)
+  parser.add_argument('--duration_secs', type=float, default=10)
+  parser.add_argument('--batch_size', type=int, default=1,
+                      help='Instances per call.')
+  parser.add_argument('--num_inputs', type=int, default=1)
+  parser.add_argument('--feature_size', type=int, default=16)
+  parser.add_argument('--max_instances_per_request', type=int, default=None)
+  parser.add_argument('--predict_latency_ms', type=float, default=5)
+  parser.add_argument('--explain_latency_ms', type=float, default=20)
+  parser.add_argument('--latency_per_instance_ms', type=float, default=0)
+  parser.add_argument('--tail_fraction', type=float, default=0)
+  parser.add_argument('--tail_latency_ms', type=float, default=0)
+  parser.add_argument('--error_rate', type=float, default=0)
+  parser.add_argument('--error_status', type=int, default=503)
+  parser.add_argument('--attribution_size', type=int, default=None,
+                      help='Attribution values per input. Defaults to '
+                      '--feature_size.')
+  parser.add_argument('--num_labels', type=int, default=1)
+  args = parser.parse_args()
+  # Retries of simulated errors are expected; don't log each of them.
+  logging.set_verbosity(logging.ERROR)
+
+  config = stand_in_server.ServerConfig(
+      predict_latency_ms=args.predict_latency_ms,
+      explain_latency_ms=args.explain_latency_ms,
+      latency_per_instance_ms=args.latency_per_instance_ms,
+      tail_fraction=args.tail_fraction,
+      tail_latency_ms=args.tail_latency_ms,
+      error_rate=args.error_rate,
+      error_status=args.error_status,
+      attribution_size=args.attribution_size or args.feature_size,
+      num_labels=args.num_labels)
+  input_names = ['input_%d' % i for i in range(args.num_inputs)]
+  instances = make_instances(args.batch_size, input_names, args.feature_size)
+
+  with tempfile.TemporaryDirectory() as tmp_dir, \
+      stand_in_server.StandInServer(config=config) as server:
+    os.environ['CLOUDSDK_API_ENDPOINT_OVERRIDES_ML'] = server.endpoint
+    # Seed the cache with the local metadata file; the model then skips the
+    # lookup of the deploymentUri, which points at GCS.
+    metadata_path = write_metadata(tmp_dir, input_names)
+    cache = metadata_cache.MetadataCache()
+    cache.get(stand_in_server.MODEL_ENDPOINT, lambda: metadata_path)
+
+    transport = http_utils.AIPlatformTransport(
+        pool_maxsize=max(args.threads, 10))
+    model = ai_platform_model.AIPlatformModel(
+        stand_in_server.MODEL_ENDPOINT,
+        credentials=stand_in_server.StaticCredentials(),
+        transport=transport,
+        max_instances_per_request=args.max_instances_per_request,
+        metadata_cache=cache)
+    call_fn = lambda: getattr(model, args.method)(instances)
+
+    # Warm up the connection pool before measuring.
+    run_load(call_fn, args.threads, 0.5)
+    requests_before = server.stats.requests
+    errors_before = server.stats.errors
+    latencies, errors, elapsed_secs = run_load(
+        call_fn, args.threads, args.duration_secs)
+    transport.close()
+
+  calls = len(latencies)
+  print('%s, %d threads, %d instances per call, %.1fs:' % (
+      args.method, args.threads, args.batch_size, elapsed_secs))
+  print('  throughput: %.1f calls/s, %.1f instances/s' % (
+      calls / elapsed_secs, calls * args.batch_size / elapsed_secs))
+  print('  requests sent: %d, simulated errors: %d, failed calls: %d' % (
+      server.stats.requests - requests_before,
+      server.stats.errors - errors_before, errors))
+  if calls:
+    print('  ' + benchmark_utils.format_percentiles('latency', latencies))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,90 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures bytes on wire and latency of compressed explain requests.
+
+The stand-in server simulates a limited upload link so that the time saved by
+sending fewer bytes is weighed against the time spent compressing. Run from
+the repository root:
+
+  python -m benchmarks.request_compression_benchmark --bandwidth_mbps 50
+"""
+
+import argparse
+import base64
+import os
+
+import numpy as np
+
+from benchmarks import benchmark_utils
+from benchmarks import stand_in_server
+from explainable_ai_sdk.model import http_utils
+
+
+def make_instances(kind, batch_size):
+  """Returns a batch of synthetic instances of the given kind."""
+  rng = np.random.RandomState(0)
+  if kind == 'b64_image':
+    # Photos are already compressed, so base64 text is close to random bytes.
+    return [{'image': {'b64': base64.b64encode(
+        rng.bytes(150 * 1024)).decode('ascii')}} for _ in range(batch_size)]
+  return [{'image': rng.rand(64, 64, 3).round(4).tolist()}
+          for _ in range(batch_size)]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--iterations', type=int, default=30)
+  parser.add_argument('--batch_size', type=int, default=8)
+  parser.add_argument('--bandwidth_mbps', type=float, default=50)
+  args = parser.parse_args()
+
+  credentials = stand_in_server.StaticCredentials()
+  uri_params = stand_in_server.MODEL_ENDPOINT + ':explain'
+  configs = [
+      ('uncompressed', None),
+      ('gzip level 1', http_utils.RequestCompression(level=1)),
+      ('gzip level 6', http_utils.RequestCompression(level=6)),
+  ]
+
+  with stand_in_server.StandInServer(
+      upload_bandwidth_mbps=args.bandwidth_mbps) as server:
+    os.environ['CLOUDSDK_API_ENDPOINT_OVERRIDES_ML'] = server.endpoint
+    for kind in ('b64_image', 'float_tensor'):
+      request_body = {'instances': make_instances(kind, args.batch_size)}
+      print('%s instances, %d per request:' % (kind, args.batch_size))
+      for name, compression in configs:
+        transport = http_utils.AIPlatformTransport(
+            request_compression=compression)
+        bytes_before = server.stats.bytes_received
+        requests_before = server.stats.requests
+
+        def explain(transport=transport, request_body=request_body):
+          http_utils.make_post_request_to_ai_platform(
+              uri_params, request_body, credentials, transport=transport)
+
+        latencies = benchmark_utils.measure_latencies_ms(
+            explain, args.iterations, warmup=1)
+        bytes_per_request = (
+            (server.stats.bytes_received - bytes_before) /
+            (server.stats.requests - requests_before))
+        print('  %s  %8.1fKB/request' % (
+            benchmark_utils.format_latencies(name, latencies),
+            bytes_per_request / 1024))
+        transport.close()
+
+
+if __name__ == '__main__':
+  main()
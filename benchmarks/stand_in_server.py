@@ -0,0 +1,272 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""A local stand-in for the AI Platform prediction service.
+
+The server answers the routes the SDK talks to so that the remote code paths
+can be benchmarked without a live service. It keeps HTTP/1.1 connections alive
+like the real frontend does, which is what makes connection reuse measurable.
+Latency, error rate and response size are configurable with a ServerConfig to
+mimic a loaded or flaky backend.
+"""
+
+import dataclasses
+import gzip
+import json
+from http import server
+import random
+import re
+import threading
+import time
+
+import google.auth.credentials
+
+# Endpoint of the only model version served by the stand-in server.
+MODEL_ENDPOINT = 'projects/p/models/m/versions/v'
+
+_VERSION_PATH_RE = re.compile(
+    r'/projects/[^/]+/models/[^/]+/versions/[^/:]+(?P<verb>:[a-z]+)?$')
+
+_ERROR_STATUS_NAMES = {
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class ServerConfig:
+  """Behavior of the stand-in server.
+
+  Attributes:
+    predict_latency_ms: Time the server takes to answer a predict request.
+    explain_latency_ms: Time the server takes to answer an explain request.
+    latency_per_instance_ms: Time added per instance of a predict or explain
+      request, on top of its base latency.
+    tail_fraction: Fraction of predict and explain requests that are slow.
+    tail_latency_ms: Time added to slow requests.
+    error_rate: Fraction of predict and explain requests answered with
+      error_status instead of a result.
+    error_status: HTTP status of failed requests.
+    attribution_size: Number of attribution values returned per input of an
+      explained instance.
+    num_labels: Number of labels explained per instance.
+    seed: Seed of the random choice of slow and failed requests.
+  """
+  predict_latency_ms: float = 0.0
+  explain_latency_ms: float = 0.0
+  latency_per_instance_ms: float = 0.0
+  tail_fraction: float = 0.0
+  tail_latency_ms: float = 0.0
+  error_rate: float = 0.0
+  error_status: int = 503
+  attribution_size: int = 2
+  num_labels: int = 1
+  seed: int = 0
+
+
+class StaticCredentials(google.auth.credentials.Credentials):
+  """Credentials that always hold the same fake token."""
+
+  def refresh(self, request):
+    del request
+    self.token = 'stand-in-token'
+
+
+class _Handler(server.BaseHTTPRequestHandler):
+  """Request handler for the stand-in server."""
+
+  protocol_version = 'HTTP/1.1'
+  # Keep-alive responses are small; don't let Nagle hold them back.
+  disable_nagle_algorithm = True
+
+  def log_message(self, *args):  # pylint: disable=arguments-differ
+    pass
+
+  def _send_json(self, status, body):
+    payload = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    if (len(payload) > 1024 and
+        'gzip' in self.headers.get('Accept-Encoding', '')):
+      payload = gzip.compress(payload)
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def _read_body(self):
+    """Reads the request body, simulating the configured upload bandwidth."""
+    length = int(self.headers.get('Content-Length', 0))
+    body = self.rfile.read(length)
+    self.server.stats.record_request(length)
+    if self.server.upload_bandwidth_mbps:
+      time.sleep(length * 8 / (self.server.upload_bandwidth_mbps * 1e6))
+    if self.headers.get('Content-Encoding') == 'gzip':
+      body = gzip.decompress(body)
+    return json.loads(body)
+
+  def _send_not_found(self):
+    self._send_json(404, {'error': 'Unknown route ' + self.path})
+
+  def _match_version_path(self):
+    """Returns the verb of a model version route, '' for GET, or None."""
+    match = _VERSION_PATH_RE.search(self.path)
+    if match is None:
+      return None
+    return match.group('verb') or ''
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self._match_version_path() != '':
+      self._send_not_found()
+      return
+    self._send_json(200, {'deploymentUri': 'gs://stand-in-bucket/model'})
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    verb = self._match_version_path()
+    instances = self._read_body()['instances']
+    if verb not in (':predict', ':explain'):
+      self._send_not_found()
+      return
+    config = self.server.config
+    fails = self.server.simulate_latency(verb, len(instances))
+    if fails:
+      self._send_json(config.error_status, {
+          'error': {
+              'code': config.error_status,
+              'message': 'Simulated failure of the stand-in server.',
+              'status': _ERROR_STATUS_NAMES.get(config.error_status, 'UNKNOWN')
+          }
+      })
+    elif verb == ':predict':
+      self._send_json(200, {'predictions': [0.5] * len(instances)})
+    else:
+      self._send_json(200, {
+          'explanations': [
+              self.server.make_explanation(instance) for instance in instances
+          ]
+      })
+
+
+class ServerStats(object):
+  """Thread-safe counters of the requests received by the server."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.requests = 0
+    self.bytes_received = 0
+    self.errors = 0
+
+  def record_request(self, body_bytes):
+    with self._lock:
+      self.requests += 1
+      self.bytes_received += body_bytes
+
+  def record_error(self):
+    with self._lock:
+      self.errors += 1
+
+
+class _Server(server.ThreadingHTTPServer):
+  """HTTP server holding the configuration shared by all handlers."""
+
+  daemon_threads = True
+
+  def __init__(self, address, config, upload_bandwidth_mbps):
+    super(_Server, self).__init__(address, _Handler)
+    self.config = config
+    self.upload_bandwidth_mbps = upload_bandwidth_mbps
+    self.stats = ServerStats()
+    self._random = random.Random(config.seed)
+    self._random_lock = threading.Lock()
+    # The same values are returned for every input, so that building a
+    # response costs little next to the client work being measured.
+    rng = random.Random(config.seed)
+    self._attribution_values = [
+        round(rng.uniform(-1, 1), 6) for _ in range(config.attribution_size)
+    ]
+
+  def simulate_latency(self, verb, instance_count):
+    """Waits as long as the request takes and returns whether it fails."""
+    config = self.config
+    with self._random_lock:
+      slow = self._random.random() < config.tail_fraction
+      fails = self._random.random() < config.error_rate
+    latency_ms = (
+        config.predict_latency_ms
+        if verb == ':predict' else config.explain_latency_ms)
+    latency_ms += config.latency_per_instance_ms * instance_count
+    if slow:
+      latency_ms += config.tail_latency_ms
+    if latency_ms > 0:
+      time.sleep(latency_ms / 1000.0)
+    if fails:
+      self.stats.record_error()
+    return fails
+
+  def make_explanation(self, instance):
+    """Returns a synthetic explanation with an attribution per input."""
+    input_names = list(instance) if isinstance(instance, dict) else ['data']
+    return {
+        'attributions_by_label': [{
+            'attributions': {
+                name: self._attribution_values for name in input_names
+            },
+            'baseline_score': 0.0001,
+            'example_score': 0.8,
+            'label_index': label_index,
+            'output_name': 'probability'
+        } for label_index in range(self.config.num_labels)]
+    }
+
+
+class StandInServer(object):
+  """Runs the stand-in service on a local port in a background thread."""
+
+  def __init__(self,
+               port = 0,
+               upload_bandwidth_mbps = None,
+               config = ServerConfig()):
+    """Creates the server.
+
+    Args:
+      port: Local port to listen on. 0 picks a free port.
+      upload_bandwidth_mbps: If given, the server waits as long as receiving
+        each request body over a link of this many megabits per second would
+        take, to make the cost of large uploads visible on loopback.
+      config: A ServerConfig with the latency, error rate and response size of
+        the simulated service.
+    """
+    self._server = _Server(('127.0.0.1', port), config, upload_bandwidth_mbps)
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+
+  @property
+  def stats(self):
+    return self._server.stats
+
+  @property
+  def endpoint(self):
+    """Base url to set as CLOUDSDK_API_ENDPOINT_OVERRIDES_ML."""
+    return 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self._server.shutdown()
+    self._server.server_close()
+
@@ -55,11 +55,14 @@ def _convert_dict_to_numpy_types(obj):
 
   Returns:
     An updated dict with certain types of values being converted
-    to numpy types (int, float, and list).
+    to numpy types (int, float, and list). Values that already are numpy
+    arrays or scalars are left as they are.
   """
 
   if isinstance(obj, dict):
     for key in obj:
+      if isinstance(obj[key], (np.ndarray, np.generic)):
+        continue
       if isinstance(obj[key], int):
         obj[key] = np.int32(obj[key])
       elif isinstance(obj[key], float):
@@ -282,9 +285,9 @@ class Attribution(object):
       An Attribution object.
     """
 
-    # Make sure the dict has been converted into numpy types
-    if not isinstance(attrs_obj_dict, np.float64):
-      attrs_obj_dict = _convert_dict_to_numpy_types(attrs_obj_dict)
+    # Make sure the dict has been converted into numpy types. Responses
+    # decoded by the SDK's transports already are, so this only walks them.
+    attrs_obj_dict = _convert_dict_to_numpy_types(attrs_obj_dict)
 
     # The following are required fields
     output_name = attrs_obj_dict[OUTPUT_NAME]
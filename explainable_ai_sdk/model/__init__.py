@@ -17,7 +17,9 @@
 Registers models for model factory.
 """
 from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import local_model
 from explainable_ai_sdk.model import model_factory
 
 
 model_factory.register_remote_model(ai_platform_model.AIPlatformModel)
+model_factory.register_local_model(local_model.LocalModel)
@@ -14,22 +14,157 @@
 
 
 """Model classes for obtaining explanations."""
+from concurrent import futures
 import json
 import os
 import re
+import threading
 
 
 from absl import logging
 import google.auth.credentials
 
-from explainable_ai_sdk.common import explain_metadata
+from explainable_ai_sdk.common import constants as common_constants
 from explainable_ai_sdk.model import configs
 from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
 from explainable_ai_sdk.model import explanation
+from explainable_ai_sdk.model import hedging
 from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import metadata_cache as metadata_cache_lib
 from explainable_ai_sdk.model import model
 from explainable_ai_sdk.model import utils
 
+# Where predict_and_explain takes predictions from.
+PREDICTIONS_FROM_AUTO = 'auto'
+PREDICTIONS_FROM_EXPLAIN = 'explain'
+PREDICTIONS_FROM_PREDICT = 'predict'
+
+
+class ChunkedExplainError(ValueError):
+  """Raised when some of the chunks of a split explain call fail.
+
+  Attributes:
+    explanations: A list with one entry per input instance. Entries of
+      instances in successful chunks hold their Explanation objects, the rest
+      are None.
+    chunk_errors: A list of (start, end, exception) tuples, one per failed
+      chunk. The instances sent in that chunk lie in instances[start:end];
+      those among them without an explanation failed. Other instances in the
+      range may have been explained from the cache.
+  """
+
+  def __init__(self, explanations, chunk_errors):
+    self.explanations = explanations
+    self.chunk_errors = chunk_errors
+    message = '{} of the explain requests failed:\n{}'.format(
+        len(chunk_errors), '\n'.join(
+            'Instances [{}, {}): {}'.format(start, end, error)
+            for start, end, error in chunk_errors))
+    super(ChunkedExplainError, self).__init__(message)
+
+
+def _merge_chunk_results(chunks, results):
+  """Merges the results of the chunks of a split explain call.
+
+  Args:
+    chunks: A list of (start, end) instance ranges sent in each request.
+    results: A list with an (explanations, error) pair for each chunk.
+
+  Returns:
+    A list of Explanation objects in input order.
+
+  Raises:
+    ChunkedExplainError: If any of the chunks failed.
+  """
+  explanations = []
+  chunk_errors = []
+  for (start, end), (chunk_explanations, error) in zip(chunks, results):
+    if error is not None:
+      chunk_errors.append((start, end, error))
+      chunk_explanations = [None] * (end - start)
+    explanations.extend(chunk_explanations)
+  if chunk_errors:
+    raise ChunkedExplainError(explanations, chunk_errors)
+  return explanations
+
+
+def _fill_cache_misses(explanations, miss_indices, miss_explanations):
+  """Puts the explanations of uncached instances at their positions."""
+  for idx, exp in zip(miss_indices, miss_explanations):
+    explanations[idx] = exp
+  return explanations
+
+
+def _fill_cache_misses_of_error(explanations, miss_indices, error):
+  """Maps a ChunkedExplainError of the uncached instances to all instances.
+
+  Args:
+    explanations: The list of cached explanations of all instances.
+    miss_indices: Indices of the instances that were sent to the service.
+    error: The ChunkedExplainError raised when explaining the uncached
+      instances.
+
+  Returns:
+    A ChunkedExplainError whose explanations and chunk ranges refer to the
+    positions of all instances.
+  """
+  _fill_cache_misses(explanations, miss_indices, error.explanations)
+  chunk_errors = [(miss_indices[start], miss_indices[end - 1] + 1, e)
+                  for start, end, e in error.chunk_errors]
+  return ChunkedExplainError(explanations, chunk_errors)
+
+
+def _expand_duplicates_of_error(inverse, error):
+  """Maps a ChunkedExplainError of deduplicated instances to all instances.
+
+  Args:
+    inverse: For each instance, the index of its unique instance.
+    error: The ChunkedExplainError raised when explaining the unique
+      instances.
+
+  Returns:
+    A ChunkedExplainError whose explanations and chunk ranges refer to the
+    positions of all instances.
+  """
+  explanations = [error.explanations[idx] for idx in inverse]
+  chunk_errors = []
+  for start, end, e in error.chunk_errors:
+    positions = [pos for pos, idx in enumerate(inverse) if start <= idx < end]
+    chunk_errors.append((positions[0], positions[-1] + 1, e))
+  return ChunkedExplainError(explanations, chunk_errors)
+
+
+def _predictions_from_explanations(explanations):
+  """Derives predictions from the example scores of explanations.
+
+  The example score of an attribution is the model output it explains. For
+  scalar outputs (e.g., regression or binary classification with a single
+  score), this is the full prediction. For outputs with one score per class,
+  only the scores of the explained labels are known.
+
+  Args:
+    explanations: A list of Explanation objects.
+
+  Returns:
+    A list with one prediction per explanation, shaped like the predictions of
+    a predict request: the example score of a model with a single output, or
+    a dict mapping output names to example scores otherwise. None if an
+    explanation has a non-scalar output.
+  """
+  predictions = []
+  for exp in explanations:
+    prediction = {}
+    for label_index in exp.get_top_k_indices():
+      attr = exp.get_attribution(label_index)
+      if attr.label_index != common_constants.SCALAR_OUTPUT_INDEX:
+        return None
+      prediction[attr.output_name] = attr.example_score
+    if len(prediction) == 1:
+      prediction, = prediction.values()
+    predictions.append(prediction)
+  return predictions
+
 
 class AIPlatformModel(model.Model):
   """Class for models loaded from AI Platform."""
@@ -37,19 +172,98 @@ class AIPlatformModel(model.Model):
   def __init__(
       self,
       endpoint,
-      credentials = None):
+      credentials = None,
+      transport = None,
+      max_instances_per_request = None,
+      max_payload_bytes = None,
+      max_concurrent_requests = constants.DEFAULT_MAX_CONCURRENT_REQUESTS,
+      metadata_cache = None,
+      lazy_metadata = False,
+      explanation_cache = None,
+      deduplicate_instances = False,
+      hedging_policy = None):
     """Constructing basic information of the model.
 
     Args:
       endpoint: an AI Platform model endpoint (i.e.,
         projects/<project_name>/models/<model_name>/versions/<version_name>)
       credentials: The OAuth2.0 credentials to use for GCP services.
+      transport: An http_utils.AIPlatformTransport to send requests with. If
+        not given, the model creates its own connection-pooled transport,
+        which is shared by all threads calling this model.
+      max_instances_per_request: If given, explain calls with more instances
+        are split into several requests of at most this many instances.
+      max_payload_bytes: If given, explain calls are split so that the JSON
+        encoded instances of each request stay under this many bytes.
+      max_concurrent_requests: Maximum number of requests of a split explain
+        call that are in flight at the same time.
+      metadata_cache: A metadata_cache.MetadataCache to look up the explanation
+        metadata in. If not given, the in-memory cache shared by the process
+        is used, which reuses the metadata of a version for up to 10 minutes
+        before checking the service for a changed deploymentUri or metadata
+        file. Pass metadata_cache.MetadataCache(ttl_secs=0) to check on every
+        load, or a cache with a cache_dir to share metadata between
+        processes.
+      lazy_metadata: If True, the explanation metadata is not loaded until it
+        is first needed by explain(), so that constructing a model used only
+        for predict() makes no network calls.
+      explanation_cache: An explanation_cache.ExplanationCache. If given,
+        explain() returns the cached explanations of instances that were
+        explained before and only sends the other instances to the service.
+      deduplicate_instances: If True, explain() sends each distinct instance
+        only once and returns the same Explanation object for all of its
+        copies.
+      hedging_policy: A hedging.HedgingPolicy. If given, predict and explain
+        requests that are slower than most recent ones are sent a second time
+        and the first response is used. Predict and explain requests are
+        compared with recent requests of the same kind only. Requests are
+        hedged independently for each chunk of a split explain call.
     """
     self._credentials = credentials
     self._endpoint = endpoint
-    self._explanation_metadata = self._get_explanation_metadata()
-    self._modality_input_list_map = utils.get_modality_input_list_map(
-        self._explanation_metadata)
+    self._owns_transport = transport is None
+    self._transport = transport or http_utils.AIPlatformTransport()
+    self._max_instances_per_request = max_instances_per_request
+    self._max_payload_bytes = max_payload_bytes
+    self._max_concurrent_requests = max_concurrent_requests
+    self._metadata_cache = (
+        metadata_cache or metadata_cache_lib.get_default_metadata_cache())
+    self._metadata_lock = threading.Lock()
+    self._explanation_metadata = None
+    self._modality_input_list_map = None
+    self._explanation_cache = explanation_cache
+    self._deduplicate_instances = deduplicate_instances
+    self._hedger = None
+    if hedging_policy is not None:
+      self._hedger = hedging.Hedger(hedging_policy)
+    # Whether predictions can be derived from explanations. Unknown (None)
+    # until the first predict_and_explain call.
+    self._scalar_outputs = None
+    self._scalar_outputs_lock = threading.Lock()
+    if not lazy_metadata:
+      self._load_explanation_metadata()
+
+  def _load_explanation_metadata(self):
+    """Loads the explanation metadata and modality map once.
+
+    Returns:
+      The modality to input list map of the model.
+    """
+    if self._modality_input_list_map is None:
+      with self._metadata_lock:
+        # Another thread may have loaded it while we waited for the lock.
+        if self._modality_input_list_map is None:
+          md = self._get_explanation_metadata()
+          self._explanation_metadata = md
+          self._modality_input_list_map = utils.get_modality_input_list_map(
+              md)
+    return self._modality_input_list_map
+
+  @property
+  def explanation_metadata(self):
+    """Explanation metadata of the model, loaded on first access if lazy."""
+    self._load_explanation_metadata()
+    return self._explanation_metadata
 
   def _get_deployment_uri(self):
     """A method to get the depolyment uri of the model.
@@ -62,7 +276,7 @@ class AIPlatformModel(model.Model):
         missing from the returned version information.
     """
     response = http_utils.make_get_request_to_ai_platform(
-        self._endpoint, self._credentials)
+        self._endpoint, self._credentials, transport=self._transport)
 
     if 'deploymentUri' not in response:
       raise KeyError('There is no deploymentUri information in this version')
@@ -96,45 +310,79 @@ class AIPlatformModel(model.Model):
     """A method to get explanation metadata.
 
     The method will call the ml service first to get deployment uri,
-    and then call the gcs to retrieve explanation metadata.json file.
+    and then call the gcs to retrieve explanation metadata.json file. Both
+    calls are skipped when the metadata cache holds a fresh entry.
 
     Returns:
        A dictionary of explanation metatdata.
 
     """
-    explanation_md_uri = self._get_explanation_metadata_uri()
-
-    md = explain_metadata.ExplainMetadata.from_file(explanation_md_uri)
-
-    return md
+    return self._metadata_cache.get(self._endpoint,
+                                    self._get_explanation_metadata_uri)
 
   def predict(self,
               instances,
-              timeout_ms = constants.DEFAULT_TIMEOUT
-             ):
+              timeout_ms = constants.DEFAULT_TIMEOUT,
+              deadline_ms = None):
     """A method to call prediction services with given instances.
 
     Args:
        instances: A list of instances for getting predictions.
        timeout_ms: Timeout for each service call to the api (in milliseconds).
+       deadline_ms: Overall time budget of the call in milliseconds, covering
+         retries. No deadline if None.
 
     Returns:
        A list of the dictionaries.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If the deadline passes before the
+        call completes.
     """
     request_body = {'instances': instances}
-    response = http_utils.make_post_request_to_ai_platform(
-        self._endpoint + ':predict',
-        request_body,
-        self._credentials,
-        timeout_ms)
+    return self._send_post_request(
+        self._endpoint + ':predict', request_body, timeout_ms,
+        deadline_utils.Deadline.from_budget_ms(deadline_ms))
+
+  def hedging_stats(self):
+    """Returns the counters of hedged requests, or None if not hedging."""
+    if self._hedger is None:
+      return None
+    return self._hedger.stats()
 
-    return response
+  def close(self):
+    """Stops the hedging threads and closes the transport the model created.
+
+    A transport passed to the constructor is left open, as other models may
+    share it.
+    """
+    if self._hedger is not None:
+      self._hedger.close()
+    if self._owns_transport:
+      self._transport.close()
+
+  def _send_post_request(self, uri_params_str, request_body, timeout_ms,
+                         deadline=None):
+    """Sends a post request, hedging it if a hedging policy is set."""
+
+    def send():
+      return http_utils.make_post_request_to_ai_platform(
+          uri_params_str,
+          request_body,
+          self._credentials,
+          timeout_ms,
+          transport=self._transport,
+          deadline=deadline)
+
+    if self._hedger is None:
+      return deadline_utils.call_within_deadline(send, deadline)
+    return self._hedger.call(send, deadline, key=uri_params_str)
 
   def explain(self,
               instances,
               params = None,
-              timeout_ms = constants.DEFAULT_TIMEOUT
-             ):
+              timeout_ms = constants.DEFAULT_TIMEOUT,
+              deadline_ms = None):
     """A method to call explanation services with given instances.
 
     Args:
@@ -142,36 +390,253 @@ class AIPlatformModel(model.Model):
        params: Overridable parameters for the explain call. Parameters can not
          be overriden in a remote model at the moment.
        timeout_ms: Timeout for each service call to the api (in milliseconds).
+       deadline_ms: Overall time budget of the call in milliseconds, covering
+         all of its requests and their retries. No deadline if None.
 
     Returns:
        A list of Explanation objects.
 
     Raises:
+      deadline_utils.DeadlineExceededError: If the deadline passes before the
+        call completes.
       ValueError: When explanation service fails, raise ValueError with the
         returned error message. This is likely due to details or formats of
         the instances are not correct.
+      ChunkedExplainError: When the instances are split into several requests
+        and some of them fail. The error holds the explanations of the
+        successful requests.
     """
     if params:
       logging.warn('Params can not be overriden in a remote model at the'
                    ' moment.')
     del params
+    return self._explain_with_deadline(
+        instances, timeout_ms,
+        deadline_utils.Deadline.from_budget_ms(deadline_ms))
+
+  def _explain_with_deadline(self, instances, timeout_ms, deadline):
+    """Explains instances, deduplicating them if configured."""
+    if self._deduplicate_instances:
+      unique_instances, inverse = utils.deduplicate_instances(instances)
+      if len(unique_instances) < len(instances):
+        try:
+          unique_explanations = self._explain_with_cache(
+              unique_instances, timeout_ms, deadline)
+        except ChunkedExplainError as e:
+          raise _expand_duplicates_of_error(inverse, e)
+        return [unique_explanations[idx] for idx in inverse]
+    return self._explain_with_cache(instances, timeout_ms, deadline)
+
+  def predict_and_explain(self,
+                          instances,
+                          timeout_ms = constants.DEFAULT_TIMEOUT,
+                          deadline_ms = None,
+                          predictions_from = PREDICTIONS_FROM_AUTO):
+    """Gets predictions and explanations of instances in one round trip.
+
+    An explain response holds the model output each attribution explains
+    (its example_score). For models with scalar outputs, that is the whole
+    prediction, so no predict request is needed. Whether the outputs are
+    scalar is learned from the first call in 'auto' mode. That call sends a
+    predict request in parallel with the explain request, so it costs two
+    requests and waits for both even if the outputs turn out to be scalar.
+
+    Args:
+       instances: A list of instances.
+       timeout_ms: Timeout for each service call to the api (in milliseconds).
+       deadline_ms: Overall time budget of the call in milliseconds. No
+         deadline if None.
+       predictions_from: Where predictions come from. 'explain' derives them
+         from the explanations, shaped like the predictions of predict().
+         'predict' sends a predict request in parallel with the explain
+         request and returns its predictions. 'auto' derives them if all
+         outputs are scalar and sends a predict request otherwise.
+
+    Returns:
+       A tuple of a list of predictions and a list of Explanation objects.
+
+    Raises:
+      ValueError: When a service call fails, if predictions_from is unknown,
+        or if it is 'explain' and the model has non-scalar outputs.
+    """
+    if predictions_from not in (PREDICTIONS_FROM_AUTO, PREDICTIONS_FROM_EXPLAIN,
+                                PREDICTIONS_FROM_PREDICT):
+      raise ValueError(
+          'Unknown predictions_from: {}'.format(predictions_from))
+    deadline = deadline_utils.Deadline.from_budget_ms(deadline_ms)
+    with self._scalar_outputs_lock:
+      scalar_outputs = self._scalar_outputs
+    if predictions_from == PREDICTIONS_FROM_EXPLAIN or (
+        predictions_from == PREDICTIONS_FROM_AUTO and scalar_outputs):
+      explanations = self._explain_with_deadline(instances, timeout_ms,
+                                                 deadline)
+      predictions = _predictions_from_explanations(explanations)
+      if predictions is not None:
+        return predictions, explanations
+      with self._scalar_outputs_lock:
+        self._scalar_outputs = False
+      if predictions_from == PREDICTIONS_FROM_EXPLAIN:
+        raise ValueError('Predictions can only be derived from explanations '
+                         'of models with scalar outputs.')
+      response = self._send_post_request(self._endpoint + ':predict',
+                                         {'instances': instances}, timeout_ms,
+                                         deadline)
+      return response['predictions'], explanations
+
+    executor = futures.ThreadPoolExecutor(1)
+    predict_future = executor.submit(
+        self._send_post_request, self._endpoint + ':predict',
+        {'instances': instances}, timeout_ms, deadline)
+    try:
+      try:
+        explanations = self._explain_with_deadline(instances, timeout_ms,
+                                                   deadline)
+      except Exception:
+        predict_future.cancel()
+        raise
+      predict_error = predict_future.exception()
+    finally:
+      # A predict that is already being sent can't be cancelled; a failed
+      # explain is raised without waiting for it.
+      executor.shutdown(wait=False)
+    if predictions_from == PREDICTIONS_FROM_AUTO:
+      predictions = _predictions_from_explanations(explanations)
+      with self._scalar_outputs_lock:
+        self._scalar_outputs = predictions is not None
+      if predictions is not None:
+        if predict_error is not None:
+          logging.warning(
+              'The predict request of %s failed, using the predictions '
+              'derived from its explanations: %s', self._endpoint,
+              predict_error)
+        return predictions, explanations
+    return predict_future.result()['predictions'], explanations
+
+  def _explain_with_cache(self, instances, timeout_ms, deadline=None):
+    """Explains instances, only sending those missing from the cache."""
+    if self._explanation_cache is None:
+      return self._explain_uncached(instances, timeout_ms, deadline)
+
+    explanations, miss_indices = self._get_cached_explanations(instances)
+    if not miss_indices:
+      return explanations
+    try:
+      miss_explanations = self._explain_uncached(
+          [instances[i] for i in miss_indices], timeout_ms, deadline)
+    except ChunkedExplainError as e:
+      raise _fill_cache_misses_of_error(explanations, miss_indices, e)
+    return _fill_cache_misses(explanations, miss_indices, miss_explanations)
+
+  def _explain_uncached(self, instances, timeout_ms, deadline=None):
+    """Explains instances, splitting them into several requests if needed."""
+    chunks = utils.split_instances(instances,
+                                   self._max_instances_per_request,
+                                   self._max_payload_bytes)
+    if len(chunks) <= 1:
+      return self._explain_chunk(instances, timeout_ms, deadline)
+
+    executor = futures.ThreadPoolExecutor(
+        min(self._max_concurrent_requests, len(chunks)))
+    chunk_futures = [
+        executor.submit(self._explain_chunk_or_error, instances[start:end],
+                        timeout_ms, deadline) for start, end in chunks
+    ]
+    timeout_secs = None
+    if deadline is not None:
+      timeout_secs = deadline.remaining_ms() / 1000
+    _, pending = futures.wait(chunk_futures, timeout_secs)
+    # Chunks still running past the deadline are left to finish on their own.
+    executor.shutdown(wait=False)
+    if pending:
+      for future in pending:
+        future.cancel()
+      raise deadline_utils.DeadlineExceededError(
+          'The call did not complete within its deadline.')
+    results = [future.result() for future in chunk_futures]
+    for _, error in results:
+      # Running out of time fails the whole call, not single chunks.
+      if isinstance(error, deadline_utils.DeadlineExceededError):
+        raise error
+    return _merge_chunk_results(chunks, results)
+
+  def _get_cached_explanations(self, instances):
+    """Looks up the instances in the explanation cache.
+
+    Args:
+       instances: A list of instances for getting explanations.
+
+    Returns:
+       A tuple of a list with the cached Explanation object of each instance,
+       or None if it is not cached, and the indices of the uncached instances.
+    """
+    explanations = []
+    miss_indices = []
+    modality_input_list_map = None
+    for idx, instance in enumerate(instances):
+      explanation_dict = self._explanation_cache.get(self._endpoint, instance)
+      if explanation_dict is None:
+        explanations.append(None)
+        miss_indices.append(idx)
+        continue
+      if modality_input_list_map is None:
+        modality_input_list_map = self._load_explanation_metadata()
+      explanations.append(explanation.Explanation.from_ai_platform_response(
+          explanation_dict, instance, modality_input_list_map))
+    return explanations, miss_indices
+
+  def _explain_chunk_or_error(self, instances, timeout_ms, deadline=None):
+    """Explains instances, returning the error instead of raising it."""
+    try:
+      return self._explain_chunk(instances, timeout_ms, deadline), None
+    except Exception as e:  # pylint: disable=broad-except
+      return None, e
+
+  def _explain_chunk(self, instances, timeout_ms, deadline=None):
+    """Sends a single explain request for the given instances.
+
+    Args:
+       instances: A list of instances for getting explanations.
+       timeout_ms: Timeout for the service call (in milliseconds).
+       deadline: Optional deadline_utils.Deadline of the whole explain call.
+
+    Returns:
+       A list of Explanation objects.
+
+    Raises:
+      ValueError: When explanation service fails.
+    """
     request_body = {'instances': instances}
-    response = http_utils.make_post_request_to_ai_platform(
-        self._endpoint + ':explain',
-        request_body,
-        self._credentials,
-        timeout_ms)
+    response = self._send_post_request(self._endpoint + ':explain',
+                                       request_body, timeout_ms, deadline)
+    return self._parse_explain_response(response, instances)
+
+  def _parse_explain_response(self, response, instances):
+    """Converts an explain response into Explanation objects.
+
+    Args:
+       response: The json response of an explain request.
+       instances: The instances sent in the request.
 
+    Returns:
+       A list of Explanation objects.
+
+    Raises:
+      ValueError: When the response holds an error.
+    """
     if 'error' in response:
       error_msg = response['error']
       raise ValueError(('Explanation call failed. This is likely due to '
                         'incorrect instance formats. \nOriginal error '
                         'message: ' + json.dumps(error_msg)))
 
+    modality_input_list_map = self._load_explanation_metadata()
     explanations = []
     for idx, explanation_dict in enumerate(response['explanations']):
+      if self._explanation_cache is not None:
+        self._explanation_cache.put(self._endpoint, instances[idx],
+                                    explanation_dict)
       exp_obj = explanation.Explanation.from_ai_platform_response(
-          explanation_dict, instances[idx], self._modality_input_list_map)
+          explanation_dict, instances[idx], modality_input_list_map)
       explanations.append(exp_obj)
 
     return explanations
@@ -14,15 +14,66 @@
 
 
 """Tests for model."""
+from http import server
+import os
+import threading
+import time
+
 import mock
 import numpy as np
 import tensorflow.compat.v1 as tf
 from explainable_ai_sdk.model import ai_platform_model
 from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import explanation_cache
+from explainable_ai_sdk.model import hedging
 from explainable_ai_sdk.model import http_utils
 from explainable_ai_sdk.model import utils
 
 
+def _fake_explain_response(request_body, label_index=0,
+                           output_name='probability'):
+  """Returns an explain response attributing each instance's input to itself."""
+  explanations = []
+  for instance in request_body['instances']:
+    attr = {
+        'attributions': {
+            'data': instance['input']
+        },
+        'baseline_score': 0.0,
+        'example_score': 0.5,
+        'output_name': output_name
+    }
+    if label_index is not None:
+      attr['label_index'] = label_index
+    explanations.append({'attributions_by_label': [attr]})
+  return {'explanations': explanations}
+
+
+def _fake_explain(uri, request_body, *unused_args, **unused_kwargs):
+  del uri
+  return _fake_explain_response(request_body)
+
+
+class _TricklingHandler(server.BaseHTTPRequestHandler):
+  """Answers with a response body sent one byte at a time."""
+
+  def log_message(self, *args):  # pylint: disable=arguments-differ
+    pass
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    payload = b'{"predictions": [0.5]}' + b' ' * 100
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(payload)))
+    self.end_headers()
+    for i in range(len(payload)):
+      self.wfile.write(payload[i:i + 1])
+      self.wfile.flush()
+      time.sleep(0.02)
+
+
 class AIPlatformModelTest(tf.test.TestCase):
 
   @mock.patch.object(ai_platform_model.AIPlatformModel,
@@ -97,6 +148,413 @@ class AIPlatformModelTest(tf.test.TestCase):
          'Original error message: "This is an error."')):
       m.explain(instances)
 
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_in_chunks(self, mock_post_request_func, mock_get_metadata,
+                             mock_get_modality_map):
+
+    mock_post_request_func.side_effect = _fake_explain
+
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', max_instances_per_request=2)
+    instances = [{'input': [float(i)]} for i in range(5)]
+    explanations = m.explain(instances)
+
+    self.assertEqual(mock_post_request_func.call_count, 3)
+    self.assertLen(explanations, 5)
+    for i, exp in enumerate(explanations):
+      self.assertAllClose(exp.as_tensors()['data'], [float(i)])
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_in_chunks_with_error(self, mock_post_request_func,
+                                        mock_get_metadata,
+                                        mock_get_modality_map):
+
+    def fake_explain(uri, request_body, *unused_args, **unused_kwargs):
+      del uri
+      if request_body['instances'][0]['input'] == [2.0]:
+        return {'error': 'This is an error.'}
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = fake_explain
+
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', max_instances_per_request=2)
+    instances = [{'input': [float(i)]} for i in range(5)]
+    with self.assertRaisesRegex(ai_platform_model.ChunkedExplainError,
+                                r'Instances \[2, 4\)') as error:
+      m.explain(instances)
+
+    self.assertLen(error.exception.chunk_errors, 1)
+    self.assertIsNone(error.exception.explanations[2])
+    self.assertIsNone(error.exception.explanations[3])
+    self.assertIsNotNone(error.exception.explanations[4])
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_in_chunks_past_deadline(self, mock_post_request_func,
+                                           mock_get_metadata,
+                                           mock_get_modality_map):
+
+    def fake_explain(uri, request_body, *unused_args, **unused_kwargs):
+      if request_body['instances'][0]['input'] == [2.0]:
+        raise deadline_utils.DeadlineExceededError('Too late.')
+      return _fake_explain(uri, request_body)
+
+    mock_post_request_func.side_effect = fake_explain
+
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', max_instances_per_request=2)
+    instances = [{'input': [float(i)]} for i in range(5)]
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      m.explain(instances, deadline_ms=1000)
+
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(http_utils, '_get_request_header', return_value={})
+  def test_predict_with_trickling_response_honors_deadline(self, *unused_mocks):
+    httpd = server.ThreadingHTTPServer(('127.0.0.1', 0), _TricklingHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    self.addCleanup(httpd.server_close)
+    self.addCleanup(httpd.shutdown)
+    endpoint = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+
+    m = ai_platform_model.AIPlatformModel('fake_end_point')
+    self.addCleanup(m.close)
+    start = time.monotonic()
+    with mock.patch.dict(os.environ,
+                         {'CLOUDSDK_API_ENDPOINT_OVERRIDES_ML': endpoint}):
+      with self.assertRaises(deadline_utils.DeadlineExceededError):
+        m.predict([{'input': [0.1]}], deadline_ms=200)
+    # Each byte arrives well within the read timeout, so only the deadline
+    # stops the call before the whole response is read.
+    self.assertLess(time.monotonic() - start, 1.0)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_in_chunks_waits_until_deadline(self, mock_post_request_func,
+                                                  mock_get_metadata,
+                                                  mock_get_modality_map):
+
+    def stalled_explain(uri, request_body, *unused_args, **unused_kwargs):
+      if request_body['instances'][0]['input'] == [2.0]:
+        time.sleep(2)
+      return _fake_explain(uri, request_body)
+
+    mock_post_request_func.side_effect = stalled_explain
+
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', max_instances_per_request=2)
+    instances = [{'input': [float(i)]} for i in range(5)]
+    start = time.monotonic()
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      m.explain(instances, deadline_ms=200)
+    self.assertLess(time.monotonic() - start, 1.0)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_lazy_metadata(self, mock_post_request_func, mock_get_metadata,
+                         mock_get_modality_map):
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', lazy_metadata=True)
+    mock_post_request_func.return_value = {'predictions': [0.5]}
+    m.predict([{'input': [0.05]}])
+    self.assertFalse(mock_get_metadata.called)
+
+    mock_post_request_func.side_effect = _fake_explain
+    m.explain([{'input': [0.05]}])
+    m.explain([{'input': [0.05]}])
+    self.assertEqual(mock_get_metadata.call_count, 1)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_with_cache(self, mock_post_request_func, mock_get_metadata,
+                              mock_get_modality_map):
+    sent_instances = []
+
+    def fake_explain(uri, request_body, *unused_args, **unused_kwargs):
+      del uri
+      sent_instances.append(request_body['instances'])
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = fake_explain
+    cache = explanation_cache.ExplanationCache()
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', explanation_cache=cache)
+
+    m.explain([{'input': [1.0]}, {'input': [2.0]}])
+    explanations = m.explain([{'input': [2.0]}, {'input': [3.0]}])
+
+    self.assertEqual(sent_instances[1], [{'input': [3.0]}])
+    self.assertLen(explanations, 2)
+    self.assertTrue(
+        np.array_equal(explanations[0].as_tensors()['data'], [2.0]))
+    self.assertTrue(
+        np.array_equal(explanations[1].as_tensors()['data'], [3.0]))
+    self.assertEqual(cache.stats()['hits'], 1)
+    self.assertEqual(cache.stats()['misses'], 3)
+
+    mock_post_request_func.reset_mock()
+    explanations = m.explain([{'input': [3.0]}, {'input': [1.0]}])
+    self.assertFalse(mock_post_request_func.called)
+
+    # Explanations built from the cache do not share arrays.
+    explanations[0].get_attribution().post_processed_attributions['data'][0] = 9
+    explanations = m.explain([{'input': [3.0]}])
+    self.assertAllEqual(explanations[0].as_tensors()['data'], [3.0])
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_explain_deduplicates_instances(self, mock_post_request_func,
+                                          mock_get_metadata,
+                                          mock_get_modality_map):
+
+    mock_post_request_func.side_effect = _fake_explain
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', deduplicate_instances=True)
+    instances = [{'input': [1.0]}, {'input': [2.0]}, {'input': [1.0]}]
+    explanations = m.explain(instances)
+
+    sent_instances = mock_post_request_func.call_args[0][1]['instances']
+    self.assertEqual(sent_instances, [{'input': [1.0]}, {'input': [2.0]}])
+    self.assertLen(explanations, 3)
+    self.assertIs(explanations[0], explanations[2])
+    self.assertTrue(
+        np.array_equal(explanations[1].as_tensors()['data'], [2.0]))
+
+  def test_expand_duplicates_of_error(self):
+    error = ai_platform_model.ChunkedExplainError(
+        ['a', None], [(1, 2, ValueError('boom'))])
+    expanded = ai_platform_model._expand_duplicates_of_error(
+        [0, 1, 0, 1], error)
+    self.assertEqual(expanded.explanations, ['a', None, 'a', None])
+    self.assertEqual(expanded.chunk_errors[0][:2], (1, 4))
+
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={})
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_predict_with_hedging(self, mock_post_request_func,
+                                mock_get_metadata, mock_get_modality_map):
+    mock_post_request_func.return_value = {'predictions': [0.5]}
+
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point', hedging_policy=hedging.HedgingPolicy())
+    predictions = m.predict([{'input': [0.05]}])
+
+    self.assertEqual(predictions['predictions'][0], 0.5)
+    self.assertEqual(m.hedging_stats()['calls'], 1)
+    self.assertEqual(m.hedging_stats()['hedges_issued'], 0)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_hedging_delay_is_kept_per_method(self, mock_post_request_func,
+                                            mock_get_metadata,
+                                            mock_get_modality_map):
+
+    def fake_post(uri, request_body, *unused_args, **unused_kwargs):
+      if uri.endswith(':predict'):
+        return {'predictions': [0.5]}
+      time.sleep(0.1)
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = fake_post
+    m = ai_platform_model.AIPlatformModel(
+        'fake_end_point',
+        hedging_policy=hedging.HedgingPolicy(
+            min_samples=2, delay_percentile=50, min_delay_ms=0,
+            initial_delay_ms=10000))
+    self.addCleanup(m.close)
+    for _ in range(2):
+      m.predict([{'input': [0.1]}])
+      m.explain([{'input': [0.1]}])
+
+    # Slow explains do not delay the hedges of fast predicts.
+    self.assertLess(
+        m._hedger.stats('fake_end_point:predict')['delay_ms'], 50)
+    self.assertGreaterEqual(
+        m._hedger.stats('fake_end_point:explain')['delay_ms'], 100)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_predict_and_explain_derives_scalar_predictions(
+      self, mock_post_request_func, mock_get_metadata, mock_get_modality_map):
+
+    def fake_post(uri, request_body, *unused_args, **unused_kwargs):
+      if uri.endswith(':predict'):
+        return {'predictions': [0.5]}
+      return _fake_explain_response(
+          request_body, label_index=None, output_name='score')
+
+    mock_post_request_func.side_effect = fake_post
+
+    m = ai_platform_model.AIPlatformModel('fake_end_point')
+    predictions, explanations = m.predict_and_explain([{'input': [0.05]}])
+    self.assertEqual(predictions, [0.5])
+    self.assertLen(explanations, 1)
+
+    # Once the outputs are known to be scalar, no predict request is sent.
+    mock_post_request_func.reset_mock()
+    predictions, _ = m.predict_and_explain([{'input': [0.05]}])
+    self.assertEqual(predictions, [0.5])
+    mock_post_request_func.assert_called_once()
+    self.assertTrue(
+        mock_post_request_func.call_args[0][0].endswith(':explain'))
+
+  @mock.patch.object(ai_platform_model.logging, 'warning')
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_predict_and_explain_logs_failed_first_predict(
+      self, mock_post_request_func, mock_get_metadata, mock_get_modality_map,
+      mock_warning):
+
+    def fake_post(uri, request_body, *unused_args, **unused_kwargs):
+      if uri.endswith(':predict'):
+        raise ValueError('Target URI returns HTTP 500 error.')
+      return _fake_explain_response(
+          request_body, label_index=None, output_name='score')
+
+    mock_post_request_func.side_effect = fake_post
+    m = ai_platform_model.AIPlatformModel('fake_end_point')
+
+    predictions, _ = m.predict_and_explain([{'input': [0.05]}])
+    self.assertEqual(predictions, [0.5])
+    mock_warning.assert_called_once()
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_predict_and_explain_falls_back_to_predict(
+      self, mock_post_request_func, mock_get_metadata, mock_get_modality_map):
+
+    def fake_post(uri, request_body, *unused_args, **unused_kwargs):
+      if uri.endswith(':predict'):
+        return {'predictions': [{'probabilities': [0.2, 0.8]}]}
+      return _fake_explain_response(
+          request_body, label_index=1, output_name='probabilities')
+
+    mock_post_request_func.side_effect = fake_post
+    m = ai_platform_model.AIPlatformModel('fake_end_point')
+
+    predictions, _ = m.predict_and_explain([{'input': [0.05]}])
+    self.assertEqual(predictions, [{'probabilities': [0.2, 0.8]}])
+    self.assertEqual(mock_post_request_func.call_count, 2)
+
+    predictions, _ = m.predict_and_explain([{'input': [0.05]}])
+    self.assertEqual(predictions, [{'probabilities': [0.2, 0.8]}])
+    self.assertEqual(mock_post_request_func.call_count, 4)
+
+    predictions, _ = m.predict_and_explain(
+        [{'input': [0.05]}],
+        predictions_from=ai_platform_model.PREDICTIONS_FROM_PREDICT)
+    self.assertEqual(predictions, [{'probabilities': [0.2, 0.8]}])
+
+    with self.assertRaisesRegex(ValueError, 'scalar outputs'):
+      m.predict_and_explain(
+          [{'input': [0.05]}],
+          predictions_from=ai_platform_model.PREDICTIONS_FROM_EXPLAIN)
+
+  @mock.patch.object(
+      utils,
+      'get_modality_input_list_map',
+      return_value={constants.ALL_MODALITY: ['data']})
+  @mock.patch.object(ai_platform_model.AIPlatformModel,
+                     '_get_explanation_metadata')
+  @mock.patch.object(
+      http_utils, 'make_post_request_to_ai_platform', autospec=True)
+  def test_predict_and_explain_fails_without_waiting_for_predict(
+      self, mock_post_request_func, mock_get_metadata, mock_get_modality_map):
+    release_predict = threading.Event()
+    self.addCleanup(release_predict.set)
+
+    def fake_post(uri, request_body, *unused_args, **unused_kwargs):
+      del request_body
+      if uri.endswith(':predict'):
+        release_predict.wait(10)
+        return {'predictions': [0.5]}
+      raise ValueError('Explain failed.')
+
+    mock_post_request_func.side_effect = fake_post
+    m = ai_platform_model.AIPlatformModel('fake_end_point')
+
+    start = time.monotonic()
+    with self.assertRaisesRegex(ValueError, 'Explain failed'):
+      m.predict_and_explain(
+          [{'input': [0.05]}],
+          predictions_from=ai_platform_model.PREDICTIONS_FROM_PREDICT)
+    self.assertLess(time.monotonic() - start, 5)
+
 
 if __name__ == '__main__':
   tf.test.main()
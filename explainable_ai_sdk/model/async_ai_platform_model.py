@@ -0,0 +1,276 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Asyncio model class for obtaining explanations from AI Platform."""
+import asyncio
+
+from absl import logging
+import google.auth.credentials
+
+from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import async_http_utils
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import utils
+
+
+class AsyncAIPlatformModel(ai_platform_model.AIPlatformModel):
+  """AI Platform model with coroutine versions of predict and explain.
+
+  The model is constructed like AIPlatformModel (which still loads the
+  explanation metadata synchronously), and its predict_async/explain_async
+  coroutines send requests over a pooled aiohttp transport, so a single event
+  loop can keep many calls in flight. The synchronous predict/explain methods
+  keep working as well.
+
+  The model should only be awaited from one event loop.
+  """
+
+  def __init__(
+      self,
+      endpoint,
+      credentials = None,
+      async_transport = None,
+      max_instances_per_request = None,
+      max_payload_bytes = None,
+      max_concurrent_requests = constants.DEFAULT_MAX_CONCURRENT_REQUESTS,
+      **kwargs):
+    """Constructing basic information of the model.
+
+    Args:
+      endpoint: an AI Platform model endpoint (i.e.,
+        projects/<project_name>/models/<model_name>/versions/<version_name>)
+      credentials: The OAuth2.0 credentials to use for GCP services.
+      async_transport: An async_http_utils.AsyncAIPlatformTransport to send
+        requests with. If not given, the model creates its own transport that
+        shares the retry policy, retry budget, limiters and circuit breakers
+        of the transport argument of AIPlatformModel.
+      max_instances_per_request: If given, explain calls with more instances
+        are split into several requests of at most this many instances.
+      max_payload_bytes: If given, explain calls are split so that the JSON
+        encoded instances of each request stay under this many bytes.
+      max_concurrent_requests: Maximum number of requests of this model that
+        are in flight at the same time, across all coroutines.
+      **kwargs: Other arguments passed to AIPlatformModel. A hedging_policy
+        applies to the coroutines as well.
+    """
+    super(AsyncAIPlatformModel, self).__init__(
+        endpoint,
+        credentials,
+        max_instances_per_request=max_instances_per_request,
+        max_payload_bytes=max_payload_bytes,
+        max_concurrent_requests=max_concurrent_requests,
+        **kwargs)
+    self._owns_async_transport = async_transport is None
+    if async_transport is None:
+      async_transport = async_http_utils.AsyncAIPlatformTransport(
+          retry_policy=self._transport.retry_policy,
+          retry_budget=self._transport.retry_budget,
+          json_backend=self._transport.json_backend,
+          request_compression=self._transport.request_compression,
+          rate_limiter=self._transport.rate_limiter,
+          concurrency_limiter=self._transport.concurrency_limiter,
+          connect_timeout_ms=self._transport.connect_timeout_ms,
+          circuit_breakers=self._transport.circuit_breakers)
+    self._async_transport = async_transport
+    # Created on first use so that it belongs to the running event loop.
+    self._semaphore = None
+
+  async def aclose(self):
+    """Coroutine counterpart of close() that also closes the async transport.
+
+    As with close(), an async transport passed to the constructor is left
+    open. close() itself can't close the async transport, since that needs
+    the event loop.
+    """
+    # close() waits for the hedging threads, which must not block the loop.
+    await asyncio.get_running_loop().run_in_executor(None, self.close)
+    if self._owns_async_transport:
+      await self._async_transport.close()
+
+  async def _post(self, uri_params_str, request_body, timeout_ms,
+                  deadline=None):
+    """Sends a post request, hedging it if a hedging policy is set."""
+
+    async def send():
+      # Hedges wait for a concurrency slot of their own.
+      if self._semaphore is None:
+        self._semaphore = asyncio.Semaphore(self._max_concurrent_requests)
+      async with self._semaphore:
+        return await async_http_utils.make_post_request_to_ai_platform(
+            uri_params_str, request_body, self._async_transport,
+            self._credentials, timeout_ms, deadline)
+
+    if self._hedger is None:
+      return await send()
+    return await self._hedger.call_async(send, key=uri_params_str)
+
+  async def _with_deadline(self, coro, deadline_ms):
+    # The requests stop at the deadline themselves. This also bounds the
+    # waits outside of them, e.g., for a concurrency slot of the model.
+    if deadline_ms is None:
+      return await coro
+    try:
+      return await asyncio.wait_for(coro, deadline_ms / 1000.0)
+    except asyncio.TimeoutError:
+      raise deadline_utils.DeadlineExceededError(
+          'The call did not complete within its deadline of {} ms.'.format(
+              deadline_ms)) from None
+
+  async def predict_async(
+      self,
+      instances,
+      timeout_ms = constants.DEFAULT_TIMEOUT,
+      deadline_ms = None):
+    """Coroutine to call prediction services with given instances.
+
+    Args:
+       instances: A list of instances for getting predictions.
+       timeout_ms: Timeout for each service call to the api (in milliseconds).
+       deadline_ms: Overall time budget of the call in milliseconds, including
+         the time spent waiting for a concurrency slot. No deadline if None.
+
+    Returns:
+       A list of the dictionaries.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If the deadline passes before the
+        call completes.
+    """
+    request_body = {'instances': instances}
+    deadline = deadline_utils.Deadline.from_budget_ms(deadline_ms)
+    return await self._with_deadline(
+        self._post(self._endpoint + ':predict', request_body, timeout_ms,
+                   deadline), deadline_ms)
+
+  async def explain_async(
+      self,
+      instances,
+      params = None,
+      timeout_ms = constants.DEFAULT_TIMEOUT,
+      deadline_ms = None):
+    """Coroutine to call explanation services with given instances.
+
+    Cancelling the returned coroutine cancels all of its in-flight requests.
+
+    Args:
+       instances: A list of instances for getting explanations.
+       params: Overridable parameters for the explain call. Parameters can not
+         be overriden in a remote model at the moment.
+       timeout_ms: Timeout for each service call to the api (in milliseconds).
+       deadline_ms: Overall time budget of the call in milliseconds, covering
+         all of its requests. No deadline if None.
+
+    Returns:
+       A list of Explanation objects.
+
+    Raises:
+      ValueError: When explanation service fails.
+      ChunkedExplainError: When the instances are split into several requests
+        and some of them fail.
+      deadline_utils.DeadlineExceededError: If the deadline passes before the
+        call completes.
+    """
+    if params:
+      logging.warn('Params can not be overriden in a remote model at the'
+                   ' moment.')
+    del params
+    deadline = deadline_utils.Deadline.from_budget_ms(deadline_ms)
+    return await self._with_deadline(
+        self._explain_deduplicated_async(instances, timeout_ms, deadline),
+        deadline_ms)
+
+  async def _explain_deduplicated_async(self, instances, timeout_ms,
+                                        deadline=None):
+    """Explains instances, sending each distinct one at most once."""
+    if self._modality_input_list_map is None:
+      # Lazily loaded metadata is read from GCS; keep it off the event loop.
+      await asyncio.get_running_loop().run_in_executor(
+          None, self._load_explanation_metadata)
+    if self._deduplicate_instances:
+      unique_instances, inverse = utils.deduplicate_instances(instances)
+      if len(unique_instances) < len(instances):
+        try:
+          unique_explanations = await self._explain_with_cache_async(
+              unique_instances, timeout_ms, deadline)
+        except ai_platform_model.ChunkedExplainError as e:
+          raise ai_platform_model._expand_duplicates_of_error(inverse, e)  # pylint: disable=protected-access
+        return [unique_explanations[idx] for idx in inverse]
+    return await self._explain_with_cache_async(instances, timeout_ms,
+                                                deadline)
+
+  async def _explain_with_cache_async(self, instances, timeout_ms,
+                                      deadline=None):
+    """Explains instances, only sending those missing from the cache."""
+    if self._explanation_cache is None:
+      return await self._explain_chunks_async(instances, timeout_ms, deadline)
+
+    explanations, miss_indices = await self._run_cache_io(
+        self._get_cached_explanations, instances)
+    if not miss_indices:
+      return explanations
+    try:
+      miss_explanations = await self._explain_chunks_async(
+          [instances[i] for i in miss_indices], timeout_ms, deadline)
+    except ai_platform_model.ChunkedExplainError as e:
+      raise ai_platform_model._fill_cache_misses_of_error(  # pylint: disable=protected-access
+          explanations, miss_indices, e)
+    return ai_platform_model._fill_cache_misses(  # pylint: disable=protected-access
+        explanations, miss_indices, miss_explanations)
+
+  async def _explain_chunks_async(self, instances, timeout_ms, deadline=None):
+    """Explains instances, splitting them into concurrent requests if needed."""
+    chunks = utils.split_instances(instances,
+                                   self._max_instances_per_request,
+                                   self._max_payload_bytes)
+    if len(chunks) <= 1:
+      return await self._explain_chunk_async(instances, timeout_ms, deadline)
+
+    outcomes = await asyncio.gather(
+        *[self._explain_chunk_async(instances[start:end], timeout_ms, deadline)
+          for start, end in chunks],
+        return_exceptions=True)
+    results = []
+    for outcome in outcomes:
+      if isinstance(outcome, deadline_utils.DeadlineExceededError):
+        # Running out of time fails the whole call, not single chunks.
+        raise outcome
+      if isinstance(outcome, Exception):
+        results.append((None, outcome))
+      elif isinstance(outcome, BaseException):
+        raise outcome
+      else:
+        results.append((outcome, None))
+    return ai_platform_model._merge_chunk_results(chunks, results)  # pylint: disable=protected-access
+
+  async def _explain_chunk_async(self, instances, timeout_ms, deadline=None):
+    """Sends a single explain request for the given instances."""
+    request_body = {'instances': instances}
+    response = await self._post(self._endpoint + ':explain', request_body,
+                                timeout_ms, deadline)
+    # Parsing stores the explanations in the explanation cache.
+    return await self._run_cache_io(self._parse_explain_response, response,
+                                    instances)
+
+  async def _run_cache_io(self, fn, *args):
+    """Calls fn, in the default executor if it may read or write files.
+
+    Explanation cache lookups and stores only touch memory, unless the cache
+    has a disk tier, whose file reads and writes must not block the loop.
+    """
+    if (self._explanation_cache is None or
+        not self._explanation_cache.cache_dir):
+      return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
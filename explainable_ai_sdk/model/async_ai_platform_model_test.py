@@ -0,0 +1,339 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for async_ai_platform_model."""
+import asyncio
+from concurrent import futures
+import contextlib
+import threading
+
+import mock
+import tensorflow.compat.v1 as tf
+from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import async_ai_platform_model
+from explainable_ai_sdk.model import async_http_utils
+from explainable_ai_sdk.model import circuit_breaker
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import explanation_cache
+from explainable_ai_sdk.model import hedging
+from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import json_utils
+from explainable_ai_sdk.model import retry_utils
+from explainable_ai_sdk.model import throttling
+from explainable_ai_sdk.model import utils
+
+
+def _fake_explain_response(request_body):
+  return {
+      'explanations': [{
+          'attributions_by_label': [{
+              'attributions': {
+                  'data': instance['input']
+              },
+              'baseline_score': 0.0,
+              'example_score': 0.5,
+              'label_index': 0,
+              'output_name': 'probability'
+          }]
+      } for instance in request_body['instances']]
+  }
+
+
+class _FakeResponse(object):
+
+  def __init__(self, status, content, headers):
+    self.status = status
+    self.headers = headers
+    self._content = content
+
+  async def read(self):
+    return self._content
+
+
+class _FakeSession(object):
+  """Answers every request with the same predict response after a delay."""
+
+  def __init__(self, status=200, headers=None):
+    self.requests = 0
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.timeouts = []
+    self._status = status
+    self._headers = headers or {}
+
+  @contextlib.asynccontextmanager
+  async def request(self, *unused_args, timeout=None, **unused_kwargs):
+    self.requests += 1
+    self.timeouts.append(timeout)
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      await asyncio.sleep(0.01)
+      yield _FakeResponse(self._status, b'{"predictions": [0.5]}',
+                          self._headers)
+    finally:
+      self.in_flight -= 1
+
+
+def _patch_session(session):
+  return mock.patch.object(
+      async_http_utils.AsyncAIPlatformTransport,
+      'session',
+      new_callable=mock.PropertyMock,
+      return_value=session)
+
+
+@mock.patch.object(
+    async_http_utils,
+    '_get_request_header',
+    new=mock.AsyncMock(return_value={}))
+@mock.patch.object(
+    utils,
+    'get_modality_input_list_map',
+    return_value={constants.ALL_MODALITY: ['data']})
+@mock.patch.object(ai_platform_model.AIPlatformModel,
+                   '_get_explanation_metadata')
+class AsyncAIPlatformModelTest(tf.test.TestCase):
+
+  @mock.patch.object(async_http_utils, 'make_post_request_to_ai_platform')
+  def test_predict_async(self, mock_post_request_func, *unused_mocks):
+    mock_post_request_func.side_effect = mock.AsyncMock(
+        return_value={'predictions': [0.5]})
+
+    m = async_ai_platform_model.AsyncAIPlatformModel('fake_end_point')
+    predictions = asyncio.run(m.predict_async([{'input': [0.05]}]))
+
+    self.assertEqual(predictions['predictions'][0], 0.5)
+    self.assertEqual(mock_post_request_func.call_args[0][0],
+                     'fake_end_point:predict')
+
+  @mock.patch.object(async_http_utils, 'make_post_request_to_ai_platform')
+  def test_explain_async_in_chunks(self, mock_post_request_func,
+                                   *unused_mocks):
+    in_flight = []
+    max_in_flight = []
+
+    async def fake_post(uri, request_body, *unused_args):
+      del uri
+      in_flight.append(1)
+      max_in_flight.append(len(in_flight))
+      await asyncio.sleep(0.01)
+      in_flight.pop()
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = fake_post
+
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', max_instances_per_request=1,
+        max_concurrent_requests=2)
+    instances = [{'input': [float(i)]} for i in range(6)]
+    explanations = asyncio.run(m.explain_async(instances))
+
+    self.assertEqual(mock_post_request_func.call_count, 6)
+    self.assertEqual(max(max_in_flight), 2)
+    for i, exp in enumerate(explanations):
+      self.assertAllClose(exp.as_tensors()['data'], [float(i)])
+
+  @mock.patch.object(async_http_utils, 'make_post_request_to_ai_platform')
+  def test_explain_async_deadline(self, mock_post_request_func, *unused_mocks):
+
+    async def slow_post(uri, request_body, *unused_args):
+      del uri
+      await asyncio.sleep(10)
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = slow_post
+
+    m = async_ai_platform_model.AsyncAIPlatformModel('fake_end_point')
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      asyncio.run(m.explain_async([{'input': [0.1]}], deadline_ms=50))
+
+  def test_async_transport_keeps_sync_transport_settings(self, *unused_mocks):
+    compression = http_utils.RequestCompression(threshold_bytes=1)
+    transport = http_utils.AIPlatformTransport(
+        json_backend=json_utils.STDLIB, request_compression=compression)
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', transport=transport)
+
+    self.assertIs(m._async_transport.request_compression, compression)
+    self.assertIs(m._async_transport.json_decoder,
+                  json_utils.get_decoder(json_utils.STDLIB))
+
+  @mock.patch.object(async_http_utils, 'make_post_request_to_ai_platform')
+  def test_explain_async_uses_disk_cache_off_the_loop(self,
+                                                      mock_post_request_func,
+                                                      *unused_mocks):
+
+    async def fake_post(uri, request_body, *unused_args):
+      del uri
+      return _fake_explain_response(request_body)
+
+    mock_post_request_func.side_effect = fake_post
+    cache = explanation_cache.ExplanationCache(cache_dir=self.get_temp_dir())
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', explanation_cache=cache)
+    lookup_threads = []
+    get_cached_explanations = m._get_cached_explanations
+
+    def record_thread(instances):
+      lookup_threads.append(threading.get_ident())
+      return get_cached_explanations(instances)
+
+    async def explain_twice():
+      await m.explain_async([{'input': [0.1]}])
+      return await m.explain_async([{'input': [0.1]}])
+
+    with mock.patch.object(m, '_get_cached_explanations', record_thread):
+      explanations = asyncio.run(explain_twice())
+
+    self.assertAllClose(explanations[0].as_tensors()['data'], [0.1])
+    self.assertEqual(mock_post_request_func.call_count, 1)
+    self.assertLen(lookup_threads, 2)
+    self.assertNotIn(threading.get_ident(), lookup_threads)
+
+  def test_predict_async_respects_limiters(self, *unused_mocks):
+    rate_limiter = throttling.RateLimiter(requests_per_sec=100)
+    concurrency_limiter = throttling.AdaptiveConcurrencyLimiter(
+        initial_limit=1, max_limit=1)
+    transport = http_utils.AIPlatformTransport(
+        rate_limiter=rate_limiter, concurrency_limiter=concurrency_limiter)
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', transport=transport)
+    session = _FakeSession()
+
+    async def predict_concurrently():
+      return await asyncio.gather(
+          *[m.predict_async([{'input': [0.1]}]) for _ in range(3)])
+
+    with _patch_session(session):
+      asyncio.run(predict_concurrently())
+    self.assertEqual(session.requests, 3)
+    self.assertEqual(session.max_in_flight, 1)
+    self.assertEqual(rate_limiter.stats()['requests'], 3)
+    self.assertEqual(concurrency_limiter.stats()['in_flight'], 0)
+
+  def test_concurrency_limit_does_not_hold_executor_threads(
+      self, *unused_mocks):
+    concurrency_limiter = throttling.AdaptiveConcurrencyLimiter(
+        initial_limit=4, max_limit=4)
+    transport = http_utils.AIPlatformTransport(
+        concurrency_limiter=concurrency_limiter)
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', transport=transport, max_concurrent_requests=100)
+    session = _FakeSession()
+
+    async def get_header_in_executor(unused_credentials):
+      # Like a token refresh, which needs a thread of the default executor.
+      await asyncio.get_running_loop().run_in_executor(None, lambda: None)
+      return {}
+
+    async def predict_concurrently():
+      asyncio.get_running_loop().set_default_executor(
+          futures.ThreadPoolExecutor(max_workers=2))
+      return await asyncio.wait_for(
+          asyncio.gather(
+              *[m.predict_async([{'input': [0.1]}]) for _ in range(50)]), 10)
+
+    with _patch_session(session), mock.patch.object(
+        async_http_utils, '_get_request_header', new=get_header_in_executor):
+      asyncio.run(predict_concurrently())
+    self.assertEqual(session.requests, 50)
+    self.assertEqual(session.max_in_flight, 4)
+    self.assertEqual(concurrency_limiter.stats()['in_flight'], 0)
+
+  def test_predict_async_respects_circuit_breaker(self, *unused_mocks):
+    transport = http_utils.AIPlatformTransport(
+        retry_policy=retry_utils.NO_RETRY_POLICY,
+        circuit_breakers=circuit_breaker.CircuitBreakerRegistry(
+            circuit_breaker.CircuitBreakerPolicy(min_requests=2)))
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', transport=transport)
+    session = _FakeSession(status=500)
+
+    with _patch_session(session):
+      for _ in range(2):
+        with self.assertRaisesRegex(ValueError, 'HTTP 500'):
+          asyncio.run(m.predict_async([{'input': [0.1]}]))
+      with self.assertRaises(circuit_breaker.CircuitOpenError):
+        asyncio.run(m.predict_async([{'input': [0.1]}]))
+    self.assertEqual(session.requests, 2)
+
+  def test_predict_async_does_not_retry_past_deadline(self, *unused_mocks):
+    retry_budget = retry_utils.RetryBudget()
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point',
+        transport=http_utils.AIPlatformTransport(retry_budget=retry_budget))
+    session = _FakeSession(status=503, headers={'Retry-After': '10'})
+
+    with _patch_session(session):
+      with self.assertRaisesRegex(ValueError, 'HTTP 503'):
+        asyncio.run(m.predict_async([{'input': [0.1]}], deadline_ms=1000))
+    self.assertEqual(session.requests, 1)
+    self.assertEqual(retry_budget.stats()['retries'], 0)
+    self.assertLessEqual(session.timeouts[0].total, 1.0)
+
+  def test_predict_async_uses_connect_timeout_of_transport(
+      self, *unused_mocks):
+    transport = http_utils.AIPlatformTransport(connect_timeout_ms=250)
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', transport=transport)
+    session = _FakeSession()
+
+    with _patch_session(session):
+      asyncio.run(m.predict_async([{'input': [0.1]}]))
+    self.assertEqual(session.timeouts[0].connect, 0.25)
+
+  @mock.patch.object(async_http_utils, 'make_post_request_to_ai_platform')
+  def test_predict_async_is_hedged(self, mock_post_request_func,
+                                   *unused_mocks):
+    calls = []
+
+    async def fake_post(*unused_args):
+      calls.append(None)
+      if len(calls) == 1:
+        await asyncio.sleep(10)
+        return {'predictions': ['slow']}
+      return {'predictions': ['fast']}
+
+    mock_post_request_func.side_effect = fake_post
+    m = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point',
+        hedging_policy=hedging.HedgingPolicy(
+            initial_delay_ms=10, max_hedge_ratio=1.0))
+
+    predictions = asyncio.run(m.predict_async([{'input': [0.1]}]))
+    self.assertEqual(predictions['predictions'], ['fast'])
+    self.assertEqual(m.hedging_stats()['hedges_won'], 1)
+
+  def test_aclose_closes_only_owned_transports(self, *unused_mocks):
+    own = async_ai_platform_model.AsyncAIPlatformModel('fake_end_point')
+    async_transport = mock.Mock(spec=async_http_utils.AsyncAIPlatformTransport)
+    shared = async_ai_platform_model.AsyncAIPlatformModel(
+        'fake_end_point', async_transport=async_transport)
+
+    with mock.patch.object(
+        async_http_utils.AsyncAIPlatformTransport, 'close') as mock_close:
+      asyncio.run(own.aclose())
+      asyncio.run(shared.aclose())
+    mock_close.assert_called_once()
+    self.assertFalse(async_transport.close.called)
+
+    # close() keeps the synchronous contract of AIPlatformModel.
+    self.assertIsNone(shared.close())
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,402 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Asyncio counterparts of the HTTP util functions in http_utils.
+
+Requires the optional aiohttp dependency:
+
+  pip install explainable-ai-sdk[async]
+"""
+import asyncio
+import json
+
+from absl import logging
+import google.auth.credentials
+
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import json_utils
+from explainable_ai_sdk.model import retry_utils
+from explainable_ai_sdk.model import token_cache
+
+try:
+  import aiohttp  # pylint: disable=g-import-not-at-top
+except ImportError:
+  aiohttp = None
+
+
+class _Response(object):
+  """Holds a fully read aiohttp response in the shape http_utils expects."""
+
+  def __init__(self, status_code, content, headers):
+    self.status_code = status_code
+    self.content = content
+    self.headers = headers
+
+  @property
+  def text(self):
+    return self.content.decode('utf-8', errors='replace')
+
+  def json(self):
+    return json.loads(self.content)
+
+
+class AsyncAIPlatformTransport(object):
+  """Connection-pooled asyncio HTTP transport for AI Platform requests.
+
+  The underlying aiohttp session is bound to the event loop it is first used
+  in, so a transport should only be used from a single event loop.
+  """
+
+  def __init__(self,
+               pool_maxsize = constants.DEFAULT_POOL_MAXSIZE,
+               pool_maxsize_per_host = 0,
+               retry_policy = retry_utils.DEFAULT_RETRY_POLICY,
+               retry_budget = None,
+               json_backend = json_utils.AUTO,
+               request_compression = None,
+               rate_limiter = None,
+               concurrency_limiter = None,
+               connect_timeout_ms = constants.DEFAULT_CONNECT_TIMEOUT_MS,
+               circuit_breakers = None):
+    """Creates a transport.
+
+    Args:
+      pool_maxsize: Maximum number of simultaneous connections. Requests beyond
+        this wait for a free connection. 0 means no limit.
+      pool_maxsize_per_host: Maximum number of simultaneous connections to one
+        host. 0 means no limit.
+      retry_policy: RetryPolicy for requests sent through this transport.
+      retry_budget: RetryBudget to draw retries from. If not given, the budget
+        shared by the whole process is used.
+      json_backend: JSON library to decode responses with (see
+        json_utils.get_decoder). By default the fastest installed one is used.
+      request_compression: An http_utils.RequestCompression to gzip large post
+        bodies with. Request bodies are sent uncompressed if not given.
+      rate_limiter: A throttling.RateLimiter that every attempt waits on
+        before it is sent. It can be shared with synchronous transports.
+      concurrency_limiter: A throttling.AdaptiveConcurrencyLimiter bounding
+        the attempts in flight. It can be shared with synchronous transports.
+      connect_timeout_ms: Timeout for establishing a connection, in
+        milliseconds. The timeout_ms of each call bounds the whole attempt.
+      circuit_breakers: A circuit_breaker.CircuitBreakerRegistry that makes
+        requests to a failing model version fail fast, as in
+        http_utils.AIPlatformTransport.
+
+    Raises:
+      ImportError: If aiohttp is not installed.
+    """
+    if aiohttp is None:
+      raise ImportError('aiohttp is required for the asyncio API. Install it '
+                        'with `pip install explainable-ai-sdk[async]`.')
+    self._pool_maxsize = pool_maxsize
+    self._pool_maxsize_per_host = pool_maxsize_per_host
+    self._retry_policy = retry_policy
+    self._retry_budget = retry_budget or retry_utils.get_default_retry_budget()
+    self._json_decoder = json_utils.get_decoder(json_backend)
+    self._request_compression = request_compression
+    self._rate_limiter = rate_limiter
+    self._concurrency_limiter = concurrency_limiter
+    self._connect_timeout_ms = connect_timeout_ms
+    self._circuit_breakers = circuit_breakers
+    self._session = None
+
+  @property
+  def retry_policy(self):
+    return self._retry_policy
+
+  @property
+  def retry_budget(self):
+    return self._retry_budget
+
+  @property
+  def json_decoder(self):
+    return self._json_decoder
+
+  @property
+  def request_compression(self):
+    return self._request_compression
+
+  @property
+  def rate_limiter(self):
+    return self._rate_limiter
+
+  @property
+  def concurrency_limiter(self):
+    return self._concurrency_limiter
+
+  @property
+  def connect_timeout_ms(self):
+    return self._connect_timeout_ms
+
+  @property
+  def circuit_breakers(self):
+    return self._circuit_breakers
+
+  @property
+  def session(self):
+    """Returns the aiohttp session, creating it in the running loop."""
+    if self._session is None or self._session.closed:
+      connector = aiohttp.TCPConnector(
+          limit=self._pool_maxsize, limit_per_host=self._pool_maxsize_per_host)
+      self._session = aiohttp.ClientSession(connector=connector)
+    return self._session
+
+  async def close(self):
+    """Closes all pooled connections."""
+    if self._session is not None:
+      await self._session.close()
+      self._session = None
+
+
+async def _get_request_header(
+    credentials = None):
+  """Gets a request header without blocking the event loop.
+
+  Cached tokens are returned directly. When the token has to be refreshed, the
+  blocking refresh runs in the default executor.
+
+  Args:
+    credentials: The credentials to use for GCP services.
+
+  Returns:
+    A header dict for requests.
+  """
+  if token_cache.get_token_cache(credentials).has_usable_token():
+    return http_utils._get_request_header(credentials)  # pylint: disable=protected-access
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(
+      None, http_utils._get_request_header, credentials)  # pylint: disable=protected-access
+
+
+async def _acquire_concurrency_slot(limiter, deadline):
+  """Waits for a slot of a concurrency limiter without blocking a thread.
+
+  The wait happens on the event loop: when all slots are taken, the limiter
+  wakes the waiter up through the loop on its next release, whichever thread
+  releases the slot.
+
+  Args:
+    limiter: A throttling.AdaptiveConcurrencyLimiter.
+    deadline: Deadline of the call, which bounds the wait.
+
+  Returns:
+    The ticket of the slot.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If no slot frees up before the
+      deadline.
+  """
+  loop = asyncio.get_running_loop()
+  while True:
+    released = asyncio.Event()
+
+    def on_release(released=released):
+      try:
+        loop.call_soon_threadsafe(released.set)
+      except RuntimeError:
+        pass  # The loop of an abandoned wait was closed.
+
+    ticket = limiter.try_acquire(on_release)
+    if ticket is not None:
+      return ticket
+    timeout_secs = None
+    if deadline is not None:
+      deadline.check()
+      timeout_secs = deadline.remaining_ms() / 1000.0
+    try:
+      await asyncio.wait_for(released.wait(), timeout_secs)
+    except asyncio.TimeoutError:
+      raise deadline_utils.DeadlineExceededError(
+          'No concurrency slot freed up before the deadline of the call.')
+
+
+async def _send_limited(send_fn, transport, instance_count, deadline):
+  """Sends one attempt once the limiters of the transport allow."""
+  if transport.rate_limiter is not None:
+    wait_secs = transport.rate_limiter.reserve(instance_count, deadline)
+    if wait_secs > 0:
+      await asyncio.sleep(wait_secs)
+  concurrency_limiter = transport.concurrency_limiter
+  if concurrency_limiter is None:
+    return await send_fn()
+  ticket = await _acquire_concurrency_slot(concurrency_limiter, deadline)
+  status_code = None
+  try:
+    response = await send_fn()
+    status_code = response.status_code
+    return response
+  finally:
+    concurrency_limiter.release(ticket, status_code)
+
+
+async def _send_once(uri, send_fn, transport, instance_count, deadline):
+  """Sends one attempt of a request through the circuit breaker and limiters.
+
+  Args:
+    uri: Request uri.
+    send_fn: Coroutine function that sends the request once and returns the
+      response.
+    transport: The AsyncAIPlatformTransport the request is sent with.
+    instance_count: Number of instances in the request.
+    deadline: Deadline of the call, bounding the time spent in the limiters.
+
+  Returns:
+    The response.
+
+  Raises:
+    circuit_breaker.CircuitOpenError: If the circuit breaker of the endpoint
+      is open.
+    deadline_utils.DeadlineExceededError: If the limiters do not let the
+      request through before the deadline.
+  """
+  if transport.circuit_breakers is None:
+    return await _send_limited(send_fn, transport, instance_count, deadline)
+
+  breaker = transport.circuit_breakers.get(http_utils._get_endpoint_key(uri))  # pylint: disable=protected-access
+  breaker_token = breaker.before_request()
+  try:
+    response = await _send_limited(send_fn, transport, instance_count,
+                                   deadline)
+  except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+    breaker.record_failure(breaker_token)
+    raise
+  except BaseException:
+    # Includes cancellation, e.g., by a hedge that completed first.
+    breaker.record_abandoned(breaker_token)
+    raise
+  if response.status_code >= 500:
+    breaker.record_failure(breaker_token)
+  else:
+    breaker.record_success(breaker_token)
+  return response
+
+
+async def _send_request(method, uri_params_str, credentials, timeout_ms,
+                        transport, request_body=None, deadline=None):
+  """Sends a request to AI Platform and returns the json results.
+
+  Each attempt goes through the circuit breaker and limiters of the
+  transport, and transient failures are retried per its retry policy. With a
+  deadline, each attempt only waits for the time left, and retries whose
+  backoff would end after the deadline are not attempted.
+  """
+  uri = http_utils._get_ai_platform_uri(uri_params_str)  # pylint: disable=protected-access
+  body_kwargs, body_headers = {}, {}
+  if request_body is not None:
+    body_kwargs, body_headers = http_utils._encode_request_body(  # pylint: disable=protected-access
+        request_body, transport.request_compression)
+  instance_count = len((request_body or {}).get('instances', ()))
+
+  async def send():
+    headers = dict(await _get_request_header(credentials), **body_headers)
+    connect_secs, total_secs = deadline_utils.get_timeout_secs(
+        transport.connect_timeout_ms, timeout_ms, deadline)
+    timeout = aiohttp.ClientTimeout(total=total_secs, connect=connect_secs)
+    async with transport.session.request(
+        method, uri, headers=headers, timeout=timeout, **body_kwargs) as r:
+      return _Response(r.status, await r.read(), r.headers)
+
+  policy = transport.retry_policy
+  budget = transport.retry_budget
+  budget.record_request()
+  attempt = 0
+  while True:
+    attempt += 1
+    try:
+      response = await _send_once(uri, send, transport, instance_count,
+                                  deadline)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+      if deadline is not None:
+        # A timeout may have been shortened to the time left.
+        deadline.check()
+      if not policy.retry_on_connection_errors:
+        raise
+      backoff_secs = policy.backoff_secs(attempt)
+      # Only draw from the budget for retries there is time left for.
+      if not (http_utils._fits_deadline(backoff_secs, deadline) and  # pylint: disable=protected-access
+              retry_utils.should_retry(policy, budget, attempt)):
+        raise
+      logging.warning('Request to %s failed (%s), retrying.', uri, e)
+      await asyncio.sleep(backoff_secs)
+      continue
+
+    backoff_secs = policy.backoff_secs(attempt,
+                                       response.headers.get('Retry-After'))
+    if not (policy.is_retryable_status(response.status_code) and
+            http_utils._fits_deadline(backoff_secs, deadline) and  # pylint: disable=protected-access
+            retry_utils.should_retry(policy, budget, attempt)):
+      return http_utils._handle_ai_platform_response(  # pylint: disable=protected-access
+          uri, response, transport.json_decoder)
+    logging.warning('Request to %s returned HTTP %d, retrying.', uri,
+                    response.status_code)
+    await asyncio.sleep(backoff_secs)
+
+
+async def make_get_request_to_ai_platform(
+    uri_params_str,
+    transport,
+    credentials = None,
+    timeout_ms = constants.DEFAULT_TIMEOUT,
+    deadline = None):
+  """Makes a get request to AI Platform.
+
+  Args:
+    uri_params_str: A string representing uri parameters (e.g.,
+      projects/<proj_name>/models/<model_name>/versions/<version_name>).
+    transport: The AsyncAIPlatformTransport to send the request with.
+    credentials: The OAuth2.0 credentials to use for GCP services.
+    timeout_ms: Timeout for the service call to the api (in milliseconds).
+    deadline: Optional deadline_utils.Deadline bounding the whole request,
+      retries included.
+
+  Returns:
+    Request results in json format.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If the deadline passed.
+  """
+  return await _send_request('GET', uri_params_str, credentials, timeout_ms,
+                             transport, deadline=deadline)
+
+
+async def make_post_request_to_ai_platform(
+    uri_params_str,
+    request_body,
+    transport,
+    credentials = None,
+    timeout_ms = constants.DEFAULT_TIMEOUT,
+    deadline = None):
+  """Makes a post request to AI Platform.
+
+  Args:
+    uri_params_str: A string representing uri parameters (e.g.,
+      projects/<proj_name>/models/<model_name>/versions/<version_name>).
+    request_body: A dict for the request body
+    transport: The AsyncAIPlatformTransport to send the request with.
+    credentials: The OAuth2.0 credentials to use for GCP services.
+    timeout_ms: Timeout for the service call to the api (in milliseconds).
+    deadline: Optional deadline_utils.Deadline bounding the whole request,
+      retries included.
+
+  Returns:
+    Request results in json format.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If the deadline passed.
+  """
+  return await _send_request('POST', uri_params_str, credentials, timeout_ms,
+                             transport, request_body, deadline)
@@ -0,0 +1,377 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Explains instances of a JSONL file in bulk.
+
+Instances are read from the input file one chunk at a time, explained with a
+model and the attributions are appended to sharded output files, so the memory
+used does not depend on the size of the input. Input and output paths can be
+local or on GCS. Progress is checkpointed in a manifest, so an interrupted job
+resumes where it stopped when run again.
+
+The runner can be used from Python:
+
+  model = explainable_ai_sdk.load_model_from_ai_platform(
+      project, model_name, version, max_instances_per_request=100)
+  bulk_explain.explain_jsonl(model, 'gs://bucket/instances.jsonl',
+                             'gs://bucket/explanations')
+
+or from the command line:
+
+  python -m explainable_ai_sdk.model.bulk_explain --project=... \
+      --model=... --input=instances.jsonl --output_dir=explanations
+"""
+import argparse
+import json
+
+from absl import logging
+import tensorflow as tf
+
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import model_factory
+
+_SHARD_NAME_FORMAT = 'explanations-{:05d}.jsonl'
+_IN_PROGRESS_SUFFIX = '.inprogress'
+_PARTIAL_SUFFIX = '.partial'
+MANIFEST_NAME = 'manifest.json'
+
+
+def _join(output_dir, name):
+  return '/'.join([output_dir.rstrip('/'), name])
+
+
+def get_shard_path(output_dir, shard_index):
+  """Returns the path of the output shard with the given index."""
+  return _join(output_dir, _SHARD_NAME_FORMAT.format(shard_index))
+
+
+def get_manifest_path(output_dir):
+  """Returns the path of the manifest of the job writing to output_dir."""
+  return _join(output_dir, MANIFEST_NAME)
+
+
+def _new_manifest(input_path, label_index):
+  """Returns the manifest of a job that has not committed anything yet.
+
+  Attributes of the manifest:
+    input_path, label_index: Settings of the job. A job is only resumed with
+      the same settings.
+    completed_shards: Number of shards that are complete and final.
+    shard_start_byte, shard_start_instance, shard_start_chunk: Input byte
+      offset, instance count and chunk count at which the current (first
+      incomplete) shard starts.
+    committed_byte, committed_instances: Input byte offset and instance count
+      up to which the chunks were explained and written to the current shard.
+    committed_chunks: Number of chunks committed so far.
+    done: Whether the whole input was explained.
+  """
+  return {
+      'input_path': input_path,
+      'label_index': label_index,
+      'completed_shards': 0,
+      'shard_start_byte': 0,
+      'shard_start_instance': 0,
+      'shard_start_chunk': 0,
+      'committed_byte': 0,
+      'committed_instances': 0,
+      'committed_chunks': 0,
+      'done': False,
+  }
+
+
+def _read_manifest(output_dir):
+  """Returns the manifest in output_dir, or None if there is none."""
+  path = get_manifest_path(output_dir)
+  if not tf.io.gfile.exists(path):
+    return None
+  with tf.io.gfile.GFile(path, 'r') as f:
+    return json.load(f)
+
+
+def _write_manifest(output_dir, manifest):
+  """Atomically replaces the manifest in output_dir."""
+  path = get_manifest_path(output_dir)
+  tmp_path = path + _IN_PROGRESS_SUFFIX
+  with tf.io.gfile.GFile(tmp_path, 'w') as f:
+    json.dump(manifest, f)
+  tf.io.gfile.rename(tmp_path, path, overwrite=True)
+
+
+def _read_chunks(input_path, chunk_size, start_byte=0):
+  """Yields chunks of at most chunk_size instances decoded from a JSONL file.
+
+  Blank lines are skipped.
+
+  Args:
+    input_path: Path of the JSONL file.
+    chunk_size: Maximum number of instances in a chunk.
+    start_byte: Byte offset of the line to start reading at.
+
+  Yields:
+    Tuples of a list of instances and the byte offset right after the last
+    line read for the chunk.
+  """
+  chunk = []
+  offset = start_byte
+  with tf.io.gfile.GFile(input_path, 'rb') as f:
+    f.seek(start_byte)
+    for line in f:
+      offset += len(line)
+      if not line.strip():
+        continue
+      chunk.append(json.loads(line))
+      if len(chunk) >= chunk_size:
+        yield chunk, offset
+        chunk = []
+  if chunk:
+    yield chunk, offset
+
+
+def _to_json_line(explanation, label_index):
+  """Returns the JSON encoded attribution of an explanation."""
+  return explanation.get_attribution(label_index).to_json() + '\n'
+
+
+def _reopen_shard(output_dir, manifest):
+  """Opens the current shard for writing, keeping its committed lines.
+
+  Lines past the committed offset, written after the last manifest update,
+  are dropped. If the committed lines cannot be recovered (e.g., the shard
+  was being uploaded to GCS when the job died), the manifest is rewound to
+  the start of the shard so that the whole shard is written again.
+
+  Args:
+    output_dir: The output directory of the job.
+    manifest: The manifest of the job. Updated in place when rewound.
+
+  Returns:
+    A writable file positioned after the committed lines of the shard.
+  """
+  in_progress_path = (get_shard_path(output_dir, manifest['completed_shards'])
+                      + _IN_PROGRESS_SUFFIX)
+  partial_path = in_progress_path + _PARTIAL_SUFFIX
+  committed_lines = (manifest['committed_instances'] -
+                     manifest['shard_start_instance'])
+  if committed_lines and tf.io.gfile.exists(in_progress_path):
+    tf.io.gfile.rename(in_progress_path, partial_path, overwrite=True)
+  # Copy line by line so that at most one line is held in memory.
+  shard_file = tf.io.gfile.GFile(in_progress_path, 'w')
+  copied_lines = 0
+  if committed_lines and tf.io.gfile.exists(partial_path):
+    with tf.io.gfile.GFile(partial_path, 'r') as f:
+      for line in f:
+        if copied_lines >= committed_lines or not line.endswith('\n'):
+          break
+        shard_file.write(line)
+        copied_lines += 1
+  if copied_lines < committed_lines:
+    logging.warning('Could not recover shard %d, explaining it again.',
+                    manifest['completed_shards'])
+    manifest['committed_byte'] = manifest['shard_start_byte']
+    manifest['committed_instances'] = manifest['shard_start_instance']
+    manifest['committed_chunks'] = manifest['shard_start_chunk']
+    # Reopening truncates the lines copied so far.
+    shard_file.close()
+    shard_file = tf.io.gfile.GFile(in_progress_path, 'w')
+  if tf.io.gfile.exists(partial_path):
+    tf.io.gfile.remove(partial_path)
+  return shard_file
+
+
+def _complete_shard(output_dir, shard_file, shard_index):
+  """Closes the current shard and gives it its final name."""
+  shard_file.close()
+  shard_path = get_shard_path(output_dir, shard_index)
+  tf.io.gfile.rename(shard_path + _IN_PROGRESS_SUFFIX, shard_path,
+                     overwrite=True)
+
+
+def _stats(manifest):
+  return {
+      'instances': manifest['committed_instances'],
+      'chunks': manifest['committed_chunks'],
+      'shards': manifest['completed_shards'],
+  }
+
+
+def explain_jsonl(model,
+                  input_path,
+                  output_dir,
+                  chunk_size = constants.DEFAULT_BULK_CHUNK_SIZE,
+                  instances_per_shard = (
+                      constants.DEFAULT_BULK_INSTANCES_PER_SHARD),
+                  label_index = None,
+                  timeout_ms = constants.DEFAULT_TIMEOUT,
+                  resume = True):
+  """Explains every instance of a JSONL file.
+
+  Each line of the output shards holds the Attribution.to_json() of the
+  instance on the same line of the input (blank lines excluded), in order. A
+  new shard is started once a shard holds at least instances_per_shard
+  attributions; shards always end at a chunk boundary.
+
+  After each chunk, the job records how far it got in a manifest next to the
+  shards. A job that died (e.g., on a quota error or preemption) continues
+  from the last committed chunk when run again with the same output_dir.
+  Shards are written under a temporary name and only renamed once complete,
+  and rewriting a shard replaces it, so no attribution is lost or duplicated.
+
+  Args:
+    model: The model to explain instances with, e.g. an AIPlatformModel.
+    input_path: Path of a file with one JSON encoded instance per line.
+    output_dir: Directory to write the output shards and manifest to.
+    chunk_size: Number of instances passed to one explain() call. Only one
+      chunk is held in memory at a time. Set the model's
+      max_instances_per_request to send a chunk in concurrent requests.
+    instances_per_shard: Number of attributions after which a new output
+      shard is started.
+    label_index: The label to write attributions of. If None, the label with
+      the highest prediction score of each instance is used.
+    timeout_ms: Timeout for each service call to the api (in milliseconds).
+    resume: Whether to continue the job recorded in the manifest of
+      output_dir. If False, existing shards are deleted and the job starts
+      from the first instance.
+
+  Returns:
+    A dict with the number of instances explained and of chunks and shards
+    written, including those of earlier runs of a resumed job.
+
+  Raises:
+    ValueError: If chunk_size or instances_per_shard is not positive, if the
+      manifest in output_dir belongs to a job with other settings, or when
+      explaining a chunk fails.
+  """
+  if chunk_size <= 0:
+    raise ValueError('chunk_size must be positive.')
+  if instances_per_shard <= 0:
+    raise ValueError('instances_per_shard must be positive.')
+  tf.io.gfile.makedirs(output_dir)
+
+  manifest = _read_manifest(output_dir) if resume else None
+  if manifest is None:
+    for path in tf.io.gfile.glob(_join(output_dir, 'explanations-*')):
+      tf.io.gfile.remove(path)
+    manifest = _new_manifest(input_path, label_index)
+  elif (manifest['input_path'] != input_path or
+        manifest['label_index'] != label_index):
+    raise ValueError(
+        'The manifest in {} belongs to a job with other settings. Use another '
+        'output_dir or pass resume=False.'.format(output_dir))
+  elif manifest['done']:
+    return _stats(manifest)
+  else:
+    logging.info('Resuming after %d instances.',
+                 manifest['committed_instances'])
+
+  shard_file = _reopen_shard(output_dir, manifest)
+  try:
+    for chunk, end_byte in _read_chunks(input_path, chunk_size,
+                                        manifest['committed_byte']):
+      explanations = model.explain(chunk, timeout_ms=timeout_ms)
+      shard_file.write(''.join(
+          _to_json_line(exp, label_index) for exp in explanations))
+      shard_file.flush()
+      manifest['committed_byte'] = end_byte
+      manifest['committed_instances'] += len(chunk)
+      manifest['committed_chunks'] += 1
+      if (manifest['committed_instances'] - manifest['shard_start_instance'] >=
+          instances_per_shard):
+        _complete_shard(output_dir, shard_file, manifest['completed_shards'])
+        manifest['completed_shards'] += 1
+        manifest['shard_start_byte'] = manifest['committed_byte']
+        manifest['shard_start_instance'] = manifest['committed_instances']
+        manifest['shard_start_chunk'] = manifest['committed_chunks']
+        shard_file = tf.io.gfile.GFile(
+            get_shard_path(output_dir, manifest['completed_shards']) +
+            _IN_PROGRESS_SUFFIX, 'w')
+      _write_manifest(output_dir, manifest)
+      logging.info('Explained %d instances.', manifest['committed_instances'])
+  finally:
+    shard_file.close()
+
+  in_progress_path = (get_shard_path(output_dir, manifest['completed_shards'])
+                      + _IN_PROGRESS_SUFFIX)
+  if manifest['committed_instances'] > manifest['shard_start_instance']:
+    tf.io.gfile.rename(in_progress_path,
+                       get_shard_path(output_dir, manifest['completed_shards']),
+                       overwrite=True)
+    manifest['completed_shards'] += 1
+  else:
+    tf.io.gfile.remove(in_progress_path)
+  manifest['done'] = True
+  _write_manifest(output_dir, manifest)
+  return _stats(manifest)
+
+
+def _parse_args(argv):
+  parser = argparse.ArgumentParser(
+      description='Explains the instances of a JSONL file with a model on '
+      'AI Platform.')
+  parser.add_argument('--project', required=True,
+                      help='AI Platform project name.')
+  parser.add_argument('--model', required=True,
+                      help='AI Platform Prediction model name.')
+  parser.add_argument('--version', default=None,
+                      help='Model version. The default version if not set.')
+  parser.add_argument('--input', required=True,
+                      help='JSONL file with one instance per line.')
+  parser.add_argument('--output_dir', required=True,
+                      help='Directory to write the output shards to.')
+  parser.add_argument('--chunk_size', type=int,
+                      default=constants.DEFAULT_BULK_CHUNK_SIZE,
+                      help='Instances explained per explain() call.')
+  parser.add_argument('--instances_per_shard', type=int,
+                      default=constants.DEFAULT_BULK_INSTANCES_PER_SHARD,
+                      help='Attributions per output shard.')
+  parser.add_argument('--max_instances_per_request', type=int, default=100,
+                      help='Instances sent in one explain request.')
+  parser.add_argument('--max_concurrent_requests', type=int,
+                      default=constants.DEFAULT_MAX_CONCURRENT_REQUESTS,
+                      help='Explain requests in flight at the same time.')
+  parser.add_argument('--label_index', type=int, default=None,
+                      help='Label to write attributions of. The top label '
+                      'of each instance if not set.')
+  parser.add_argument('--timeout_ms', type=int,
+                      default=constants.DEFAULT_TIMEOUT,
+                      help='Timeout of each request in milliseconds.')
+  parser.add_argument('--no_resume', dest='resume', action='store_false',
+                      help='Start from the first instance even if the '
+                      'output_dir holds a manifest of an unfinished job.')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  """Runs explain_jsonl with command line arguments."""
+  args = _parse_args(argv)
+  model = model_factory.load_model_from_ai_platform(
+      args.project,
+      args.model,
+      args.version,
+      max_instances_per_request=args.max_instances_per_request,
+      max_concurrent_requests=args.max_concurrent_requests)
+  stats = explain_jsonl(
+      model,
+      args.input,
+      args.output_dir,
+      chunk_size=args.chunk_size,
+      instances_per_shard=args.instances_per_shard,
+      label_index=args.label_index,
+      timeout_ms=args.timeout_ms,
+      resume=args.resume)
+  print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,164 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for bulk_explain."""
+import json
+import os
+
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import bulk_explain
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import explanation
+from explainable_ai_sdk.model import model_factory
+
+
+class _FakeModel(object):
+  """Attributes each instance its own 'input' value."""
+
+  def __init__(self, fail_at_chunk=None):
+    self.chunk_sizes = []
+    self._fail_at_chunk = fail_at_chunk
+
+  def explain(self, instances, params=None, timeout_ms=None):
+    del params, timeout_ms
+    if len(self.chunk_sizes) == self._fail_at_chunk:
+      raise ValueError('Quota exceeded.')
+    self.chunk_sizes.append(len(instances))
+    return [
+        explanation.Explanation.from_ai_platform_response(
+            {
+                'attributions_by_label': [{
+                    'attributions': {
+                        'data': instance['input']
+                    },
+                    'baseline_score': 0.0,
+                    'example_score': 0.5,
+                    'label_index': 0,
+                    'output_name': 'probability'
+                }]
+            }, instance, {constants.ALL_MODALITY: ['data']})
+        for instance in instances
+    ]
+
+
+def _read_shard(path):
+  with open(path) as f:
+    return [json.loads(line) for line in f]
+
+
+class BulkExplainTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(BulkExplainTest, self).setUp()
+    self._input_path = os.path.join(self.get_temp_dir(), 'instances.jsonl')
+    with open(self._input_path, 'w') as f:
+      for i in range(7):
+        f.write(json.dumps({'input': [float(i)]}) + '\n')
+      f.write('\n')
+    self._output_dir = os.path.join(self.get_temp_dir(), 'out')
+
+  def test_explain_jsonl(self):
+    model = _FakeModel()
+    stats = bulk_explain.explain_jsonl(
+        model, self._input_path, self._output_dir, chunk_size=2,
+        instances_per_shard=4)
+
+    self.assertEqual(stats, {'instances': 7, 'chunks': 4, 'shards': 2})
+    self.assertEqual(model.chunk_sizes, [2, 2, 2, 1])
+    first_shard = _read_shard(bulk_explain.get_shard_path(self._output_dir, 0))
+    second_shard = _read_shard(
+        bulk_explain.get_shard_path(self._output_dir, 1))
+    self.assertLen(first_shard, 4)
+    self.assertLen(second_shard, 3)
+    self.assertEqual([row['attributions']['data'] for row in second_shard],
+                     [[4.0], [5.0], [6.0]])
+
+  def test_resume_after_failure(self):
+    with self.assertRaisesRegex(ValueError, 'Quota'):
+      bulk_explain.explain_jsonl(
+          _FakeModel(fail_at_chunk=3), self._input_path, self._output_dir,
+          chunk_size=2, instances_per_shard=4)
+    manifest = bulk_explain._read_manifest(self._output_dir)
+    self.assertEqual(manifest['committed_instances'], 6)
+    self.assertEqual(manifest['completed_shards'], 1)
+
+    model = _FakeModel()
+    stats = bulk_explain.explain_jsonl(
+        model, self._input_path, self._output_dir, chunk_size=2,
+        instances_per_shard=4)
+
+    self.assertEqual(model.chunk_sizes, [1])
+    self.assertEqual(stats, {'instances': 7, 'chunks': 4, 'shards': 2})
+    second_shard = _read_shard(
+        bulk_explain.get_shard_path(self._output_dir, 1))
+    self.assertEqual([row['attributions']['data'] for row in second_shard],
+                     [[4.0], [5.0], [6.0]])
+    self.assertCountEqual(
+        os.listdir(self._output_dir),
+        ['manifest.json', 'explanations-00000.jsonl',
+         'explanations-00001.jsonl'])
+
+  def test_lost_shard_is_explained_again(self):
+    with self.assertRaises(ValueError):
+      bulk_explain.explain_jsonl(
+          _FakeModel(fail_at_chunk=3), self._input_path, self._output_dir,
+          chunk_size=2, instances_per_shard=4)
+    os.remove(
+        bulk_explain.get_shard_path(self._output_dir, 1) + '.inprogress')
+
+    model = _FakeModel()
+    stats = bulk_explain.explain_jsonl(
+        model, self._input_path, self._output_dir, chunk_size=2,
+        instances_per_shard=4)
+
+    self.assertEqual(model.chunk_sizes, [2, 1])
+    self.assertEqual(stats, {'instances': 7, 'chunks': 4, 'shards': 2})
+    self.assertLen(
+        _read_shard(bulk_explain.get_shard_path(self._output_dir, 1)), 3)
+
+  def test_finished_job_is_not_run_again(self):
+    bulk_explain.explain_jsonl(_FakeModel(), self._input_path,
+                               self._output_dir, chunk_size=2)
+    model = _FakeModel()
+    stats = bulk_explain.explain_jsonl(model, self._input_path,
+                                       self._output_dir, chunk_size=2)
+
+    self.assertEqual(model.chunk_sizes, [])
+    self.assertEqual(stats['instances'], 7)
+
+  def test_invalid_chunk_size(self):
+    with self.assertRaises(ValueError):
+      bulk_explain.explain_jsonl(
+          _FakeModel(), self._input_path, self._output_dir, chunk_size=0)
+
+  @mock.patch.object(model_factory, 'load_model_from_ai_platform')
+  def test_main(self, mock_load_model):
+    mock_load_model.return_value = _FakeModel()
+    bulk_explain.main([
+        '--project=p', '--model=m', '--input', self._input_path,
+        '--output_dir', self._output_dir, '--max_instances_per_request=3'
+    ])
+
+    mock_load_model.assert_called_once_with(
+        'p', 'm', None, max_instances_per_request=3,
+        max_concurrent_requests=constants.DEFAULT_MAX_CONCURRENT_REQUESTS)
+    self.assertLen(
+        _read_shard(bulk_explain.get_shard_path(self._output_dir, 0)), 7)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,205 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Circuit breakers that fail fast while an AI Platform endpoint is down.
+
+A breaker tracks the outcome of the most recent requests to an endpoint. When
+too many of them failed, it opens and requests fail right away with
+CircuitOpenError instead of waiting for a timeout. After open_secs it lets a
+few probe requests through (half-open) and closes again if they succeed.
+"""
+import collections
+import dataclasses
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(ValueError):
+  """Raised instead of sending a request to an endpoint considered down."""
+
+
+@dataclasses.dataclass(frozen=True)
+class CircuitBreakerPolicy:
+  """Configuration of circuit breakers.
+
+  Attributes:
+    failure_rate_threshold: Fraction of failed requests in the window at which
+      the breaker opens.
+    window_size: Number of most recent requests the failure rate is computed
+      over.
+    min_requests: Minimum number of requests in the window before the breaker
+      may open.
+    open_secs: Seconds the breaker stays open before probing the endpoint.
+    half_open_probes: Number of probe requests let through while half-open.
+      The breaker closes once all of them succeeded and opens again as soon
+      as one fails.
+  """
+  failure_rate_threshold: float = 0.5
+  window_size: int = 20
+  min_requests: int = 10
+  open_secs: float = 30.0
+  half_open_probes: int = 1
+
+
+class CircuitBreaker(object):
+  """Thread-safe circuit breaker of a single endpoint.
+
+  before_request() returns a token that the outcome of the request is
+  recorded with. Tokens change with every change of state, so the outcome of
+  a request admitted before the breaker opened, or before the current probes
+  were let through, is ignored.
+  """
+
+  def __init__(self, name, policy = CircuitBreakerPolicy()):
+    self._name = name
+    self._policy = policy
+    self._lock = threading.Lock()
+    self._outcomes = collections.deque(maxlen=policy.window_size)
+    self._state = CLOSED
+    self._generation = 0
+    self._opened_at = 0.0
+    self._probes_started = 0
+    self._probes_succeeded = 0
+    self._rejected = 0
+    self._opened = 0
+
+  @property
+  def state(self):
+    with self._lock:
+      self._update_state(time.monotonic())
+      return self._state
+
+  def stats(self):
+    """Returns the state, number of times opened and requests rejected."""
+    with self._lock:
+      self._update_state(time.monotonic())
+      return {
+          'state': self._state,
+          'opened': self._opened,
+          'rejected': self._rejected,
+      }
+
+  def _set_state(self, state):
+    """Changes the state. Must be called with the lock held."""
+    self._state = state
+    self._generation += 1
+    self._outcomes.clear()
+
+  def _update_state(self, now):
+    """Moves an open breaker to half-open. Must be called with the lock held."""
+    if self._state == OPEN and now - self._opened_at >= self._policy.open_secs:
+      self._set_state(HALF_OPEN)
+      self._probes_started = 0
+      self._probes_succeeded = 0
+
+  def _open(self, now):
+    self._set_state(OPEN)
+    self._opened_at = now
+    self._opened += 1
+
+  def before_request(self):
+    """Admits a request or fails fast.
+
+    Returns:
+      The token to record the outcome of the request with.
+
+    Raises:
+      CircuitOpenError: If the breaker is open, or half-open with all probes
+        already in flight.
+    """
+    with self._lock:
+      self._update_state(time.monotonic())
+      if self._state == HALF_OPEN:
+        if self._probes_started < self._policy.half_open_probes:
+          self._probes_started += 1
+          return self._generation
+      elif self._state == CLOSED:
+        return self._generation
+      self._rejected += 1
+    raise CircuitOpenError(
+        'The circuit breaker of {} is open after repeated failures. Requests '
+        'are rejected until the endpoint recovers.'.format(self._name))
+
+  def record_success(self, token):
+    """Records a request that the endpoint answered.
+
+    Args:
+      token: The token before_request() returned for the request.
+    """
+    with self._lock:
+      if token != self._generation:
+        return
+      if self._state == HALF_OPEN:
+        self._probes_succeeded += 1
+        if self._probes_succeeded >= self._policy.half_open_probes:
+          self._set_state(CLOSED)
+        return
+      self._outcomes.append(False)
+
+  def record_abandoned(self, token):
+    """Records an admitted request that was not sent after all.
+
+    Args:
+      token: The token before_request() returned for the request.
+    """
+    with self._lock:
+      if (token == self._generation and self._state == HALF_OPEN and
+          self._probes_started > 0):
+        self._probes_started -= 1
+
+  def record_failure(self, token):
+    """Records a request that failed because of the endpoint.
+
+    Args:
+      token: The token before_request() returned for the request.
+    """
+    with self._lock:
+      if token != self._generation:
+        return
+      now = time.monotonic()
+      if self._state == HALF_OPEN:
+        self._open(now)
+        return
+      self._outcomes.append(True)
+      failures = sum(self._outcomes)
+      if (len(self._outcomes) >= self._policy.min_requests and
+          failures >= self._policy.failure_rate_threshold * len(self._outcomes)):
+        self._open(now)
+
+
+class CircuitBreakerRegistry(object):
+  """Holds one circuit breaker per endpoint. Thread-safe.
+
+  Share a registry between the transports of a process so that all of them
+  stop sending requests to an endpoint that is down.
+  """
+
+  def __init__(self, policy = CircuitBreakerPolicy()):
+    self._policy = policy
+    self._lock = threading.Lock()
+    self._breakers = {}
+
+  def get(self, endpoint):
+    """Returns the circuit breaker of the endpoint, creating it if needed."""
+    with self._lock:
+      breaker = self._breakers.get(endpoint)
+      if breaker is None:
+        breaker = CircuitBreaker(endpoint, self._policy)
+        self._breakers[endpoint] = breaker
+      return breaker
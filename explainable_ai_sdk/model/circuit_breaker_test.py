@@ -0,0 +1,111 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for circuit_breaker."""
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import circuit_breaker
+
+_POLICY = circuit_breaker.CircuitBreakerPolicy(
+    failure_rate_threshold=0.5, window_size=4, min_requests=4, open_secs=10)
+
+
+def _record(breaker, failed):
+  """Sends a request through the breaker and records its outcome."""
+  token = breaker.before_request()
+  if failed:
+    breaker.record_failure(token)
+  else:
+    breaker.record_success(token)
+
+
+class CircuitBreakerTest(tf.test.TestCase):
+
+  def test_opens_at_failure_rate(self):
+    breaker = circuit_breaker.CircuitBreaker('endpoint', _POLICY)
+    _record(breaker, failed=False)
+    _record(breaker, failed=True)
+    _record(breaker, failed=False)
+    self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+    _record(breaker, failed=True)
+    self.assertEqual(breaker.state, circuit_breaker.OPEN)
+    with self.assertRaises(circuit_breaker.CircuitOpenError):
+      breaker.before_request()
+    self.assertEqual(breaker.stats()['rejected'], 1)
+
+  def test_outcomes_while_open_are_ignored(self):
+    breaker = circuit_breaker.CircuitBreaker('endpoint', _POLICY)
+    late_tokens = [breaker.before_request() for _ in range(2)]
+    for _ in range(4):
+      _record(breaker, failed=True)
+
+    # Answers to requests that were admitted before the breaker opened.
+    breaker.record_success(late_tokens[0])
+    breaker.record_failure(late_tokens[1])
+    self.assertEqual(breaker.state, circuit_breaker.OPEN)
+    self.assertEmpty(breaker._outcomes)
+
+  @mock.patch.object(circuit_breaker.time, 'monotonic')
+  def test_half_open_probe_closes(self, mock_monotonic):
+    mock_monotonic.return_value = 100.0
+    breaker = circuit_breaker.CircuitBreaker('endpoint', _POLICY)
+    for _ in range(4):
+      _record(breaker, failed=True)
+
+    mock_monotonic.return_value = 110.0
+    token = breaker.before_request()
+    # Only one probe at a time.
+    with self.assertRaises(circuit_breaker.CircuitOpenError):
+      breaker.before_request()
+    breaker.record_success(token)
+    self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+  @mock.patch.object(circuit_breaker.time, 'monotonic')
+  def test_late_success_does_not_close_half_open_breaker(self, mock_monotonic):
+    mock_monotonic.return_value = 100.0
+    breaker = circuit_breaker.CircuitBreaker('endpoint', _POLICY)
+    late_token = breaker.before_request()
+    for _ in range(4):
+      _record(breaker, failed=True)
+
+    mock_monotonic.return_value = 110.0
+    probe_token = breaker.before_request()
+    breaker.record_success(late_token)
+    self.assertEqual(breaker.state, circuit_breaker.HALF_OPEN)
+    breaker.record_success(probe_token)
+    self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+  @mock.patch.object(circuit_breaker.time, 'monotonic')
+  def test_failed_probe_reopens(self, mock_monotonic):
+    mock_monotonic.return_value = 100.0
+    breaker = circuit_breaker.CircuitBreaker('endpoint', _POLICY)
+    for _ in range(4):
+      _record(breaker, failed=True)
+
+    mock_monotonic.return_value = 110.0
+    breaker.record_failure(breaker.before_request())
+    self.assertEqual(breaker.state, circuit_breaker.OPEN)
+    self.assertEqual(breaker.stats()['opened'], 2)
+
+  def test_registry_has_one_breaker_per_endpoint(self):
+    registry = circuit_breaker.CircuitBreakerRegistry(_POLICY)
+    self.assertIs(registry.get('a'), registry.get('a'))
+    self.assertIsNot(registry.get('a'), registry.get('b'))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -21,7 +21,25 @@ ALL_MODALITY = 'all'
 TABULAR_MODALITY = 'tabular'
 
 # HTTP related constants
-DEFAULT_TIMEOUT = 1200
+# Timeouts are in milliseconds.
+DEFAULT_TIMEOUT = 120 * 1000
+DEFAULT_CONNECT_TIMEOUT_MS = 10 * 1000
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_COMPRESSION_THRESHOLD_BYTES = 16 * 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+DEFAULT_METADATA_CACHE_TTL_SECS = 600
+DEFAULT_TOKEN_REFRESH_MARGIN_SECS = 60
+DEFAULT_TOKEN_BACKGROUND_REFRESH_MARGIN_SECS = 300
+DEFAULT_MICRO_BATCH_MAX_SIZE = 32
+DEFAULT_MICRO_BATCH_MAX_WAIT_MS = 5
+DEFAULT_EXPLANATION_CACHE_MAX_ENTRIES = 10000
+DEFAULT_EXPLANATION_CACHE_TTL_SECS = 24 * 60 * 60
+DEFAULT_BULK_CHUNK_SIZE = 1000
+DEFAULT_BULK_INSTANCES_PER_SHARD = 100000
+DEFAULT_LOCAL_MAX_BATCH_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENTATION_CACHE_MAX_ENTRIES = 16
 USER_AGENT_FOR_CAIP_TRACKING = 'xai-sdk/' + version.__version__
 
 CAIP_API_ENDPOINT = 'https://ml.googleapis.com/'
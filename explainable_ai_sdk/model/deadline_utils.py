@@ -0,0 +1,131 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Deadlines that bound the total time of calls spanning several requests."""
+from concurrent import futures
+import threading
+import time
+
+# Threads that run calls for call_within_deadline. A call abandoned at its
+# deadline keeps its thread until the request's own timeouts end it, so the
+# threads are shared and bounded rather than started per call.
+_MAX_DEADLINE_WORKERS = 64
+_deadline_executor = futures.ThreadPoolExecutor(
+    _MAX_DEADLINE_WORKERS, thread_name_prefix='deadline')
+_deadline_slots = threading.BoundedSemaphore(_MAX_DEADLINE_WORKERS)
+
+
+class DeadlineExceededError(ValueError):
+  """Raised when a call runs out of its time budget."""
+
+
+class Deadline(object):
+  """A point in time by which a call has to complete.
+
+  A deadline is created once per call and passed down to every request the
+  call sends (retries and chunks included), each of which only waits for the
+  time that is left.
+  """
+
+  def __init__(self, budget_ms):
+    """Creates a deadline budget_ms milliseconds from now.
+
+    Args:
+      budget_ms: The time budget of the call in milliseconds.
+    """
+    self._budget_ms = budget_ms
+    self._expires_at = time.monotonic() + budget_ms / 1000.0
+
+  @classmethod
+  def from_budget_ms(cls, budget_ms):
+    """Returns a Deadline for the budget, or None if budget_ms is None."""
+    if budget_ms is None:
+      return None
+    return cls(budget_ms)
+
+  def remaining_ms(self):
+    """Returns the milliseconds left, or 0 if the deadline passed."""
+    return max(0.0, (self._expires_at - time.monotonic()) * 1000)
+
+  def check(self):
+    """Raises DeadlineExceededError if the deadline passed."""
+    if self.remaining_ms() <= 0:
+      raise DeadlineExceededError(
+          'The call did not complete within its deadline of {} ms.'.format(
+              self._budget_ms))
+
+
+def get_timeout_secs(connect_timeout_ms,
+                     read_timeout_ms,
+                     deadline = None):
+  """Returns the (connect, read) timeouts of a request attempt in seconds.
+
+  Args:
+    connect_timeout_ms: Timeout for establishing the connection.
+    read_timeout_ms: Timeout for waiting on the server between bytes of the
+      response.
+    deadline: Deadline of the call the request belongs to, which caps both
+      timeouts.
+
+  Returns:
+    A tuple to pass as the timeout argument of requests.
+
+  Raises:
+    DeadlineExceededError: If the deadline already passed.
+  """
+  if deadline is not None:
+    deadline.check()
+    remaining_ms = deadline.remaining_ms()
+    connect_timeout_ms = min(connect_timeout_ms, remaining_ms)
+    read_timeout_ms = min(read_timeout_ms, remaining_ms)
+  return connect_timeout_ms / 1000.0, read_timeout_ms / 1000.0
+
+
+def call_within_deadline(fn, deadline = None):
+  """Calls fn, waiting for it no longer than the deadline allows.
+
+  The timeouts of a request bound each read from the socket, not the whole
+  response, so a server that trickles its response could keep a request going
+  past the deadline. With a deadline, fn runs in a thread of a shared pool and
+  is left to finish on its own if the deadline passes first. If all threads of
+  the pool are taken, e.g., by requests to a backend that stopped answering,
+  fn runs in the calling thread and only its timeouts bound it.
+
+  Args:
+    fn: Function without arguments to call.
+    deadline: Optional Deadline bounding the wait. fn is called directly if
+      None.
+
+  Returns:
+    The result of fn.
+
+  Raises:
+    DeadlineExceededError: If fn did not complete before the deadline.
+  """
+  if deadline is None:
+    return fn()
+  deadline.check()
+  slots = _deadline_slots
+  if not slots.acquire(blocking=False):
+    return fn()
+  future = _deadline_executor.submit(fn)
+  future.add_done_callback(lambda _: slots.release())
+  try:
+    return future.result(timeout=deadline.remaining_ms() / 1000)
+  except futures.TimeoutError:
+    if future.done():
+      raise
+    raise DeadlineExceededError(
+        'The call did not complete within its deadline.')
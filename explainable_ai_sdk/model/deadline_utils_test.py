@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for deadline_utils."""
+import threading
+
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import deadline_utils
+
+
+class DeadlineUtilsTest(tf.test.TestCase):
+
+  def test_timeouts_are_in_seconds(self):
+    self.assertEqual(
+        deadline_utils.get_timeout_secs(5000, 1200), (5.0, 1.2))
+
+  @mock.patch.object(deadline_utils.time, 'monotonic')
+  def test_timeouts_are_capped_by_deadline(self, mock_monotonic):
+    mock_monotonic.return_value = 100.0
+    deadline = deadline_utils.Deadline(3000)
+    mock_monotonic.return_value = 101.0
+
+    self.assertEqual(deadline.remaining_ms(), 2000)
+    self.assertEqual(
+        deadline_utils.get_timeout_secs(5000, 1000, deadline), (2.0, 1.0))
+
+  @mock.patch.object(deadline_utils.time, 'monotonic')
+  def test_expired_deadline_raises(self, mock_monotonic):
+    mock_monotonic.return_value = 100.0
+    deadline = deadline_utils.Deadline(3000)
+    mock_monotonic.return_value = 103.0
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      deadline_utils.get_timeout_secs(5000, 1000, deadline)
+
+  def test_no_budget_means_no_deadline(self):
+    self.assertIsNone(deadline_utils.Deadline.from_budget_ms(None))
+
+
+  def test_call_within_deadline_returns_result(self):
+    self.assertEqual(
+        deadline_utils.call_within_deadline(
+            lambda: 'done', deadline_utils.Deadline(1000)), 'done')
+
+  def test_call_within_deadline_stops_waiting_at_deadline(self):
+    stalled = threading.Event()
+    self.addCleanup(stalled.set)
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      deadline_utils.call_within_deadline(
+          lambda: stalled.wait(10), deadline_utils.Deadline(50))
+
+  def test_call_within_deadline_bounds_abandoned_threads(self):
+    stalled = threading.Event()
+    self.addCleanup(stalled.set)
+
+    with mock.patch.object(deadline_utils, '_deadline_slots',
+                           threading.BoundedSemaphore(1)):
+      with self.assertRaises(deadline_utils.DeadlineExceededError):
+        deadline_utils.call_within_deadline(
+            lambda: stalled.wait(10), deadline_utils.Deadline(50))
+      # The only thread is still taken, so the call runs in this thread.
+      self.assertEqual(
+          deadline_utils.call_within_deadline(
+              threading.get_ident, deadline_utils.Deadline(1000)),
+          threading.get_ident())
+
+if __name__ == '__main__':
+  tf.test.main()
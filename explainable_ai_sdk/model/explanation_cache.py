@@ -0,0 +1,200 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Caches explanations of instances that were already explained.
+
+Explaining an instance runs a full attribution computation on the service.
+ExplanationCache keeps the explanation returned for each instance, keyed by a
+hash of the model endpoint and the canonical JSON encoding of the instance, so
+that explaining the same instance again costs no request.
+"""
+import collections
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+from absl import logging
+
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import utils
+
+
+def make_key(endpoint, instance):
+  """Returns the cache key of an instance explained by the given endpoint.
+
+  Args:
+    endpoint: An AI Platform model endpoint (i.e.,
+      projects/<project_name>/models/<model_name>/versions/<version_name>).
+    instance: A JSON serializable instance.
+
+  Returns:
+    A hex digest that only depends on the endpoint (including the API endpoint
+    it is served from) and the content of the instance, not on the order of
+    its keys.
+  """
+  uri = http_utils._get_ai_platform_uri(endpoint)  # pylint: disable=protected-access
+  return hashlib.sha256(
+      (uri + '\n' + utils.canonical_json(instance)).encode('utf-8')).hexdigest()
+
+
+class ExplanationCache(object):
+  """Thread-safe LRU memory and disk cache of explanation responses.
+
+  The cache stores the explanation entries of explain responses (the dicts
+  holding 'attributions_by_label'), from which Explanation objects are built.
+  Entries older than ttl_secs are ignored and dropped. The memory tier holds
+  at most max_entries entries and evicts the least recently used one first.
+  The optional disk tier is not size-bounded; its files can be shared with
+  other processes on the same machine.
+  """
+
+  def __init__(self,
+               max_entries = constants.DEFAULT_EXPLANATION_CACHE_MAX_ENTRIES,
+               ttl_secs = constants.DEFAULT_EXPLANATION_CACHE_TTL_SECS,
+               cache_dir = None):
+    """Creates an explanation cache.
+
+    Args:
+      max_entries: Maximum number of entries kept in memory.
+      ttl_secs: Seconds an entry stays valid after it was stored.
+      cache_dir: Local directory to persist entries in. If None, entries are
+        only kept in memory.
+    """
+    self._max_entries = max_entries
+    self._ttl_secs = ttl_secs
+    self._cache_dir = cache_dir
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._disk_hits = 0
+    self._evictions = 0
+    if cache_dir:
+      os.makedirs(cache_dir, exist_ok=True)
+
+  @property
+  def cache_dir(self):
+    return self._cache_dir
+
+  def stats(self):
+    """Returns a snapshot of the cache counters.
+
+    Returns:
+      A dict with the number of hits (of which disk_hits were read from disk),
+      misses, memory evictions, the number of entries in memory and the hit
+      rate.
+    """
+    with self._lock:
+      lookups = self._hits + self._misses
+      return {
+          'hits': self._hits,
+          'misses': self._misses,
+          'disk_hits': self._disk_hits,
+          'evictions': self._evictions,
+          'entries': len(self._entries),
+          'hit_rate': self._hits / lookups if lookups else 0.0,
+      }
+
+  def _entry_path(self, key):
+    return os.path.join(self._cache_dir, key + '.json')
+
+  def _is_fresh(self, stored_at):
+    return time.time() - stored_at < self._ttl_secs
+
+  def _put_in_memory(self, key, entry):
+    """Adds an entry to the memory tier. Must be called with the lock held."""
+    self._entries[key] = entry
+    self._entries.move_to_end(key)
+    while len(self._entries) > self._max_entries:
+      self._entries.popitem(last=False)
+      self._evictions += 1
+
+  def _read_from_disk(self, key):
+    """Returns the fresh disk entry of the key, or None."""
+    path = self._entry_path(key)
+    try:
+      with open(path) as f:
+        entry = json.load(f)
+    except (IOError, ValueError):
+      return None
+    if entry.get('key') != key:
+      return None
+    if not self._is_fresh(entry['stored_at']):
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      return None
+    return entry
+
+  def get(self, endpoint, instance):
+    """Returns the cached explanation entry of an instance.
+
+    Args:
+      endpoint: The AI Platform model endpoint that explains the instance.
+      instance: The instance to look up.
+
+    Returns:
+      A copy of the explanation dict of the instance as returned by the
+      service, or None if it is not cached. Callers may modify it.
+    """
+    key = make_key(endpoint, instance)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        if self._is_fresh(entry['stored_at']):
+          self._entries.move_to_end(key)
+          self._hits += 1
+          return copy.deepcopy(entry['explanation'])
+        del self._entries[key]
+
+    entry = self._read_from_disk(key) if self._cache_dir else None
+    with self._lock:
+      if entry is None:
+        self._misses += 1
+        return None
+      self._put_in_memory(key, entry)
+      self._hits += 1
+      self._disk_hits += 1
+    return copy.deepcopy(entry['explanation'])
+
+  def put(self, endpoint, instance, explanation_dict):
+    """Stores the explanation entry of an instance.
+
+    Args:
+      endpoint: The AI Platform model endpoint that explained the instance.
+      instance: The explained instance.
+      explanation_dict: The explanation dict of the instance as returned by
+        the service. The cache keeps a copy, so the caller may modify it
+        afterwards.
+    """
+    key = make_key(endpoint, instance)
+    entry = {
+        'key': key,
+        'explanation': copy.deepcopy(explanation_dict),
+        'stored_at': time.time(),
+    }
+    with self._lock:
+      self._put_in_memory(key, entry)
+    if not self._cache_dir:
+      return
+    try:
+      utils.write_json_atomically(self._entry_path(key), entry)
+    except (IOError, OSError) as e:
+      logging.warning('Could not write explanation cache entry: %s', e)
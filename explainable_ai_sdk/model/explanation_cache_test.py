@@ -0,0 +1,103 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for explanation_cache."""
+import os
+
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import explanation_cache
+
+_ENDPOINT = 'projects/p/models/m/versions/v'
+
+
+def _explanation_dict(value):
+  return {'attributions_by_label': [{'attributions': {'data': [value]}}]}
+
+
+class ExplanationCacheTest(tf.test.TestCase):
+
+  def test_key_ignores_key_order(self):
+    self.assertEqual(
+        explanation_cache.make_key(_ENDPOINT, {'a': 1, 'b': [1, 2]}),
+        explanation_cache.make_key(_ENDPOINT, {'b': [1, 2], 'a': 1}))
+    self.assertNotEqual(
+        explanation_cache.make_key(_ENDPOINT, {'a': 1}),
+        explanation_cache.make_key(_ENDPOINT, {'a': 2}))
+    self.assertNotEqual(
+        explanation_cache.make_key(_ENDPOINT, {'a': 1}),
+        explanation_cache.make_key('projects/p/models/m/versions/w', {'a': 1}))
+
+  def test_get_and_put(self):
+    cache = explanation_cache.ExplanationCache()
+    self.assertIsNone(cache.get(_ENDPOINT, {'a': 1}))
+    cache.put(_ENDPOINT, {'a': 1}, _explanation_dict(1))
+
+    self.assertEqual(cache.get(_ENDPOINT, {'a': 1}), _explanation_dict(1))
+    stats = cache.stats()
+    self.assertEqual(stats['hits'], 1)
+    self.assertEqual(stats['misses'], 1)
+    self.assertEqual(stats['hit_rate'], 0.5)
+
+  def test_callers_do_not_share_entries(self):
+    cache = explanation_cache.ExplanationCache()
+    explanation_dict = _explanation_dict(1)
+    cache.put(_ENDPOINT, {'a': 1}, explanation_dict)
+    explanation_dict['attributions_by_label'][0]['attributions']['data'] = 2
+    cache.get(_ENDPOINT, {'a': 1})['attributions_by_label'].append({})
+
+    self.assertEqual(cache.get(_ENDPOINT, {'a': 1}), _explanation_dict(1))
+
+  def test_least_recently_used_entry_is_evicted(self):
+    cache = explanation_cache.ExplanationCache(max_entries=2)
+    cache.put(_ENDPOINT, {'a': 1}, _explanation_dict(1))
+    cache.put(_ENDPOINT, {'a': 2}, _explanation_dict(2))
+    cache.get(_ENDPOINT, {'a': 1})
+    cache.put(_ENDPOINT, {'a': 3}, _explanation_dict(3))
+
+    self.assertIsNotNone(cache.get(_ENDPOINT, {'a': 1}))
+    self.assertIsNone(cache.get(_ENDPOINT, {'a': 2}))
+    self.assertEqual(cache.stats()['evictions'], 1)
+
+  def test_expired_entry_is_a_miss(self):
+    cache = explanation_cache.ExplanationCache(ttl_secs=0)
+    cache.put(_ENDPOINT, {'a': 1}, _explanation_dict(1))
+
+    self.assertIsNone(cache.get(_ENDPOINT, {'a': 1}))
+    self.assertEqual(cache.stats()['entries'], 0)
+
+  def test_disk_entries_are_shared(self):
+    cache_dir = os.path.join(self.get_temp_dir(), 'exp_cache')
+    explanation_cache.ExplanationCache(cache_dir=cache_dir).put(
+        _ENDPOINT, {'a': 1}, _explanation_dict(1))
+
+    other_cache = explanation_cache.ExplanationCache(cache_dir=cache_dir)
+    self.assertEqual(
+        other_cache.get(_ENDPOINT, {'a': 1}), _explanation_dict(1))
+    self.assertEqual(other_cache.stats()['disk_hits'], 1)
+
+  def test_disk_entries_with_numpy_values(self):
+    cache_dir = os.path.join(self.get_temp_dir(), 'numpy_cache')
+    explanation_cache.ExplanationCache(cache_dir=cache_dir).put(
+        _ENDPOINT, {'a': 1}, _explanation_dict(np.array([0.5, 1.0])))
+
+    other_cache = explanation_cache.ExplanationCache(cache_dir=cache_dir)
+    self.assertEqual(
+        other_cache.get(_ENDPOINT, {'a': 1}), _explanation_dict([0.5, 1.0]))
+
+
+if __name__ == '__main__':
+  tf.test.main()
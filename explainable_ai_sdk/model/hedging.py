@@ -0,0 +1,258 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Hedged requests to cut the latency tail of AI Platform calls.
+
+A hedged call sends a request and, if no response arrived after a delay taken
+from the recent latency distribution (e.g., its 95th percentile), sends the
+same request again and uses whichever response comes first. Since only the
+slowest few percent of calls are hedged, the extra load is small while the
+latency tail caused by a slow backend mostly disappears.
+"""
+import asyncio
+import collections
+from concurrent import futures
+import dataclasses
+import math
+import threading
+import time
+
+from explainable_ai_sdk.model import deadline_utils
+
+
+@dataclasses.dataclass(frozen=True)
+class HedgingPolicy:
+  """Configuration of hedged requests.
+
+  Attributes:
+    delay_percentile: Percentile of recent latencies after which a request
+      that has not completed is hedged.
+    min_delay_ms: Lower bound of the hedging delay.
+    initial_delay_ms: Hedging delay used until min_samples latencies were
+      observed.
+    min_samples: Number of latencies needed before the percentile is used.
+    window_size: Number of most recent latencies the percentile is taken
+      over. Each kind of request (see Hedger.call) has its own window.
+    max_hedge_ratio: Maximum number of hedges per request. Hedges draw from a
+      budget that earns this many tokens per request, so a slow backend cannot
+      double the load.
+    max_workers: Number of threads sending hedged calls. Bounds the number of
+      requests in flight, hedges included.
+  """
+  delay_percentile: float = 95.0
+  min_delay_ms: float = 10.0
+  initial_delay_ms: float = 1000.0
+  min_samples: int = 20
+  window_size: int = 1000
+  max_hedge_ratio: float = 0.1
+  max_workers: int = 32
+
+
+class Hedger(object):
+  """Runs calls with hedging. Thread-safe.
+
+  The losing request cannot be cancelled once it is being sent, since
+  requests are blocking; its result is discarded when it completes.
+  """
+
+  def __init__(self, policy = HedgingPolicy()):
+    self._policy = policy
+    self._executor = futures.ThreadPoolExecutor(policy.max_workers)
+    # Latency windows by request kind, e.g. predict and explain requests.
+    self._latencies = collections.defaultdict(
+        lambda: collections.deque(maxlen=policy.window_size))
+    self._lock = threading.Lock()
+    self._hedge_tokens = 1.0
+    self._calls = 0
+    self._hedges_issued = 0
+    self._hedges_won = 0
+
+  def stats(self, key = None):
+    """Returns a snapshot of the hedging counters.
+
+    Args:
+      key: The kind of request to return the hedging delay of.
+
+    Returns:
+      A dict with the number of calls, hedges issued, hedges whose response
+      was used, and the current hedging delay in milliseconds.
+    """
+    with self._lock:
+      return {
+          'calls': self._calls,
+          'hedges_issued': self._hedges_issued,
+          'hedges_won': self._hedges_won,
+          'delay_ms': self._delay_secs(key) * 1000,
+      }
+
+  def _delay_secs(self, key):
+    """Returns the hedging delay of a kind of request.
+
+    Must be called with the lock held.
+    """
+    policy = self._policy
+    window = self._latencies.get(key, ())
+    if len(window) < policy.min_samples:
+      delay_ms = policy.initial_delay_ms
+    else:
+      latencies = sorted(window)
+      rank = math.ceil(policy.delay_percentile / 100 * len(latencies)) - 1
+      delay_ms = latencies[min(max(rank, 0), len(latencies) - 1)]
+    return max(delay_ms, policy.min_delay_ms) / 1000
+
+  def _try_acquire_hedge(self):
+    with self._lock:
+      if self._hedge_tokens < 1:
+        return False
+      self._hedge_tokens -= 1
+      self._hedges_issued += 1
+      return True
+
+  def close(self):
+    """Stops the worker threads once the calls in flight complete."""
+    self._executor.shutdown(wait=True)
+
+  def call(self, fn, deadline = None, key = None):
+    """Calls fn, hedging it with a second call if the first one is slow.
+
+    Args:
+      fn: Function without arguments that sends a request and returns its
+        result. It is called from worker threads, possibly twice at once.
+      deadline: Optional deadline_utils.Deadline of the call. No hedge is sent
+        after it, and the call stops waiting for fn once it passed.
+      key: The kind of request fn sends. The hedging delay is taken from the
+        latencies of earlier calls with the same key, so that requests with
+        different latencies, like predict and explain requests, do not skew
+        each other's delay.
+
+    Returns:
+      The result of the call that completed first without an error.
+
+    Raises:
+      Exception: The error of the first call if no call succeeded.
+      deadline_utils.DeadlineExceededError: If no call completed before the
+        deadline.
+    """
+    start = time.monotonic()
+    delay_secs = self._start_call(key)
+    primary = self._executor.submit(fn)
+    done, _ = _wait([primary], delay_secs, deadline)
+    if done or not self._try_acquire_hedge():
+      _wait([primary], None, deadline)
+      return self._finish(primary, start, key)
+
+    hedge = self._executor.submit(fn)
+    pending = {primary, hedge}
+    while pending:
+      done, pending = _wait(pending, None, deadline)
+      for future in done:
+        if future.exception() is None:
+          for other in pending:
+            other.cancel()
+          if future is hedge:
+            with self._lock:
+              self._hedges_won += 1
+          return self._finish(future, start, key)
+    return self._finish(primary, start, key)
+
+  async def call_async(self, coro_fn, key = None):
+    """Coroutine counterpart of call() for the asyncio API.
+
+    Args:
+      coro_fn: Coroutine function without arguments that sends a request and
+        returns its result. It may be running twice at once.
+      key: The kind of request coro_fn sends, as in call().
+
+    Returns:
+      The result of the call that completed first without an error.
+
+    Raises:
+      Exception: The error of the first call if no call succeeded.
+    """
+    start = time.monotonic()
+    delay_secs = self._start_call(key)
+    primary = asyncio.ensure_future(coro_fn())
+    tasks = [primary]
+    try:
+      done, _ = await asyncio.wait(tasks, timeout=delay_secs)
+      if not done and self._try_acquire_hedge():
+        tasks.append(asyncio.ensure_future(coro_fn()))
+      pending = set(tasks)
+      while pending:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          if task.exception() is None:
+            if task is not primary:
+              with self._lock:
+                self._hedges_won += 1
+            return self._finish(task, start, key)
+      return self._finish(primary, start, key)
+    finally:
+      for task in tasks:
+        task.cancel()
+
+  def _start_call(self, key):
+    """Counts a call and returns the hedging delay for it."""
+    with self._lock:
+      self._calls += 1
+      self._hedge_tokens = min(1.0,
+                               self._hedge_tokens + self._policy.max_hedge_ratio)
+      return self._delay_secs(key)
+
+  def _finish(self, future, start, key):
+    """Returns the result of a completed call and records its latency.
+
+    The latency is measured from the start of the primary request, also when
+    the hedge won, so that the slow requests that got hedged still count
+    towards the latency distribution the delay is taken from.
+    """
+    result = future.result()
+    self._record_latency((time.monotonic() - start) * 1000, key)
+    return result
+
+  def _record_latency(self, latency_ms, key=None):
+    with self._lock:
+      self._latencies[key].append(latency_ms)
+
+
+def _wait(fs, timeout_secs, deadline):
+  """Waits for the first of the futures to complete.
+
+  Args:
+    fs: The futures to wait for.
+    timeout_secs: Seconds to wait at most, or None to wait until one completes.
+    deadline: Optional deadline_utils.Deadline that bounds the wait.
+
+  Returns:
+    A tuple of the completed and the pending futures.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If the deadline passed before a
+      future completed. The pending futures are cancelled if not running yet.
+  """
+  if deadline is not None:
+    remaining_secs = deadline.remaining_ms() / 1000
+    if timeout_secs is None or remaining_secs <= timeout_secs:
+      done, pending = futures.wait(
+          fs, timeout=remaining_secs, return_when=futures.FIRST_COMPLETED)
+      if not done:
+        for future in pending:
+          future.cancel()
+        raise deadline_utils.DeadlineExceededError(
+            'The call did not complete within its deadline.')
+      return done, pending
+  return futures.wait(
+      fs, timeout=timeout_secs, return_when=futures.FIRST_COMPLETED)
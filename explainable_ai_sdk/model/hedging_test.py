@@ -0,0 +1,140 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for hedging."""
+import threading
+
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import hedging
+
+
+class HedgerTest(tf.test.TestCase):
+
+  def test_fast_call_is_not_hedged(self):
+    hedger = hedging.Hedger(hedging.HedgingPolicy(initial_delay_ms=1000))
+    self.assertEqual(hedger.call(lambda: 'result'), 'result')
+    hedger.close()
+    self.assertEqual(hedger.stats()['hedges_issued'], 0)
+
+  def test_slow_call_is_hedged(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(initial_delay_ms=10, max_hedge_ratio=1.0))
+    release_first = threading.Event()
+    calls = []
+
+    def fn():
+      calls.append(None)
+      if len(calls) == 1:
+        release_first.wait(5)
+        return 'slow'
+      return 'fast'
+
+    self.assertEqual(hedger.call(fn), 'fast')
+    release_first.set()
+    hedger.close()
+    stats = hedger.stats()
+    self.assertEqual(stats['hedges_issued'], 1)
+    self.assertEqual(stats['hedges_won'], 1)
+
+  def test_latency_of_hedged_call_counts_from_primary_start(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(initial_delay_ms=50, max_hedge_ratio=1.0))
+    release_first = threading.Event()
+    calls = []
+
+    def fn():
+      calls.append(None)
+      if len(calls) == 1:
+        release_first.wait(5)
+      return len(calls)
+
+    hedger.call(fn)
+    release_first.set()
+    hedger.close()
+    self.assertLen(hedger._latencies[None], 1)
+    self.assertGreaterEqual(hedger._latencies[None][0], 50)
+
+  def test_hedge_rate_is_capped(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(initial_delay_ms=0, min_delay_ms=0,
+                              max_hedge_ratio=0.0))
+    release = threading.Event()
+
+    def fn():
+      release.wait(0.05)
+      return 'result'
+
+    # The budget starts with one hedge and earns none.
+    for _ in range(3):
+      hedger.call(fn)
+    hedger.close()
+    self.assertEqual(hedger.stats()['hedges_issued'], 1)
+
+  def test_error_of_first_call_falls_back_to_hedge(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(initial_delay_ms=10, max_hedge_ratio=1.0))
+    hedge_started = threading.Event()
+    calls = []
+
+    def fn():
+      calls.append(None)
+      if len(calls) == 1:
+        hedge_started.wait(5)
+        raise ValueError('boom')
+      hedge_started.set()
+      return 'hedged'
+
+    self.assertEqual(hedger.call(fn), 'hedged')
+    hedger.close()
+
+  def test_call_gives_up_at_deadline(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(initial_delay_ms=10, max_hedge_ratio=1.0))
+    release = threading.Event()
+
+    def fn():
+      release.wait(5)
+      return 'slow'
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      hedger.call(fn, deadline_utils.Deadline.from_budget_ms(50))
+    release.set()
+    hedger.close()
+
+  def test_delay_follows_latency_percentile(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(min_samples=4, delay_percentile=50,
+                              min_delay_ms=0))
+    for latency_ms in (10, 20, 30, 40):
+      hedger._record_latency(latency_ms)
+    self.assertEqual(hedger.stats()['delay_ms'], 20)
+    hedger.close()
+
+  def test_delay_is_kept_per_kind_of_request(self):
+    hedger = hedging.Hedger(
+        hedging.HedgingPolicy(min_samples=4, delay_percentile=50,
+                              min_delay_ms=0))
+    for latency_ms in (10, 20, 30, 40):
+      hedger._record_latency(latency_ms, 'predict')
+      hedger._record_latency(latency_ms * 100, 'explain')
+    self.assertEqual(hedger.stats('predict')['delay_ms'], 20)
+    self.assertEqual(hedger.stats('explain')['delay_ms'], 2000)
+    hedger.close()
+
+
+if __name__ == '__main__':
+  tf.test.main()
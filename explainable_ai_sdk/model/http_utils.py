@@ -15,15 +15,213 @@
 
 """HTTP-related util functions in SDK."""
 
+import dataclasses
+import gzip
+import json
 import os
+import time
 
+from absl import logging
 import requests
+from requests import adapters
 
-import google.auth
 import google.auth.credentials
-import google.auth.transport.requests
 
 from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import json_utils
+from explainable_ai_sdk.model import retry_utils
+from explainable_ai_sdk.model import token_cache
+
+
+@dataclasses.dataclass(frozen=True)
+class RequestCompression:
+  """Configuration of gzip compression for request bodies.
+
+  Attributes:
+    threshold_bytes: Bodies smaller than this many bytes are sent
+      uncompressed, since compressing them costs more than it saves.
+    level: gzip compression level from 1 (fastest) to 9 (smallest).
+  """
+  threshold_bytes: int = constants.DEFAULT_COMPRESSION_THRESHOLD_BYTES
+  level: int = constants.DEFAULT_COMPRESSION_LEVEL
+
+
+class AIPlatformTransport(object):
+  """Connection-pooled HTTP transport for AI Platform requests.
+
+  A transport owns a requests.Session whose adapters keep TCP/TLS connections
+  alive between calls, so repeated predict/explain requests to the same host
+  skip the connection handshake. Sessions are safe to share across threads as
+  long as the pool is large enough for the number of concurrent callers.
+  """
+
+  def __init__(self,
+               pool_connections = constants.DEFAULT_POOL_CONNECTIONS,
+               pool_maxsize = constants.DEFAULT_POOL_MAXSIZE,
+               pool_block = False,
+               retry_policy = retry_utils.DEFAULT_RETRY_POLICY,
+               retry_budget = None,
+               json_backend = json_utils.AUTO,
+               request_compression = None,
+               rate_limiter = None,
+               concurrency_limiter = None,
+               connect_timeout_ms = constants.DEFAULT_CONNECT_TIMEOUT_MS,
+               circuit_breakers = None):
+    """Creates a transport with its own connection pool.
+
+    Args:
+      pool_connections: Number of per-host connection pools to cache.
+      pool_maxsize: Maximum number of connections kept alive per host. This
+        also bounds the number of concurrent requests to one host when
+        pool_block is set.
+      pool_block: If True, callers wait for a free connection when all
+        pool_maxsize connections to a host are in use instead of opening
+        connections that will not be kept alive.
+      retry_policy: RetryPolicy for requests sent through this transport.
+      retry_budget: RetryBudget to draw retries from. If not given, the budget
+        shared by the whole process is used.
+      json_backend: JSON library to decode responses with (see
+        json_utils.get_decoder). By default the fastest installed one is used.
+      request_compression: A RequestCompression to gzip large post bodies
+        with. Request bodies are sent uncompressed if not given. Compressed
+        responses are negotiated (Accept-Encoding: gzip, deflate) and decoded
+        by the session in any case.
+      rate_limiter: A throttling.RateLimiter that every attempt waits on
+        before it is sent. Share one limiter between transports to limit
+        their combined rate.
+      concurrency_limiter: A throttling.AdaptiveConcurrencyLimiter bounding
+        the attempts in flight, which backs off when the service answers
+        with 429 or 503.
+      connect_timeout_ms: Timeout for establishing a connection, in
+        milliseconds. The timeout_ms of each call bounds the wait for the
+        response once connected.
+      circuit_breakers: A circuit_breaker.CircuitBreakerRegistry. If given,
+        requests to a model version that keeps failing (5xx responses,
+        connection errors and timeouts) fail fast with CircuitOpenError
+        until the version recovers.
+    """
+    self._retry_policy = retry_policy
+    self._retry_budget = retry_budget or retry_utils.get_default_retry_budget()
+    self._json_backend = json_backend
+    self._json_decoder = json_utils.get_decoder(json_backend)
+    self._request_compression = request_compression
+    self._rate_limiter = rate_limiter
+    self._concurrency_limiter = concurrency_limiter
+    self._connect_timeout_ms = connect_timeout_ms
+    self._circuit_breakers = circuit_breakers
+    self._session = requests.Session()
+
+    adapter = adapters.HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block)
+    self._session.mount('https://', adapter)
+    self._session.mount('http://', adapter)
+
+  @property
+  def session(self):
+    return self._session
+
+  @property
+  def retry_policy(self):
+    return self._retry_policy
+
+  @property
+  def retry_budget(self):
+    return self._retry_budget
+
+  @property
+  def json_backend(self):
+    return self._json_backend
+
+  @property
+  def json_decoder(self):
+    return self._json_decoder
+
+  @property
+  def request_compression(self):
+    return self._request_compression
+
+  @property
+  def rate_limiter(self):
+    return self._rate_limiter
+
+  @property
+  def concurrency_limiter(self):
+    return self._concurrency_limiter
+
+  @property
+  def connect_timeout_ms(self):
+    return self._connect_timeout_ms
+
+  @property
+  def circuit_breakers(self):
+    return self._circuit_breakers
+
+  def close(self):
+    """Closes all pooled connections."""
+    self._session.close()
+
+
+def _get_http_client(transport):
+  """Returns the object to issue requests with for the given transport."""
+  if transport is None:
+    return requests
+  return transport.session
+
+
+def _get_json_decoder(transport):
+  """Returns the JSON decoder of the transport, or None for response.json()."""
+  return transport.json_decoder if transport is not None else None
+
+
+def _encode_request_body(request_body, compression):
+  """Encodes a post body, gzipping it if it is large enough.
+
+  Args:
+    request_body: A dict for the request body.
+    compression: A RequestCompression, or None to leave encoding to the HTTP
+      library.
+
+  Returns:
+    A tuple of keyword arguments carrying the body for the HTTP library and a
+    dict of extra headers to send with it.
+  """
+  if compression is None:
+    return {'json': request_body}, {}
+  body = json.dumps(request_body).encode('utf-8')
+  headers = {'content-type': 'application/json'}
+  if len(body) >= compression.threshold_bytes:
+    body = gzip.compress(body, compresslevel=compression.level)
+    headers['content-encoding'] = 'gzip'
+  return {'data': body}, headers
+
+
+def _get_timeout_secs(transport, timeout_ms, deadline):
+  """Returns the (connect, read) timeouts in seconds for a request attempt."""
+  connect_timeout_ms = (
+      transport.connect_timeout_ms
+      if transport is not None else constants.DEFAULT_CONNECT_TIMEOUT_MS)
+  return deadline_utils.get_timeout_secs(connect_timeout_ms, timeout_ms,
+                                         deadline)
+
+
+def _get_retry_settings(transport):
+  """Returns the retry policy and budget to use for the given transport."""
+  if transport is None:
+    return (retry_utils.DEFAULT_RETRY_POLICY,
+            retry_utils.get_default_retry_budget())
+  return transport.retry_policy, transport.retry_budget
+
+
+def _get_ai_platform_uri(uri_params_str):
+  """Builds the full AI Platform uri from the given uri parameters."""
+  ai_platform_endpoint = (
+      os.getenv('CLOUDSDK_API_ENDPOINT_OVERRIDES_ML') or
+      constants.CAIP_API_ENDPOINT)
+  return os.path.join(
+      ai_platform_endpoint, constants.CAIP_API_ENDPOINT_VERSION, uri_params_str)
 
 
 def _get_request_header(
@@ -31,42 +229,45 @@ def _get_request_header(
 ):
   """Gets a request header.
 
+  Access tokens are cached per credentials object and only refreshed when they
+  get close to expiring (see token_cache.TokenCache).
+
   Args:
     credentials: The credentials to use for GCP services.
 
   Returns:
     A header dict for requests.
   """
-  # If credentials is not given, use the default credentials
-  if credentials is None:
-    credentials, _ = google.auth.default()
-
-  # Refresh credentials in case it has been expired.
-  auth_req = google.auth.transport.requests.Request()
-  credentials.refresh(auth_req)
-
-  headers = {}
+  headers = token_cache.get_token_cache(credentials).get_request_header()
   # Set user-agent for logging usages.
   headers['user-agent'] = constants.USER_AGENT_FOR_CAIP_TRACKING
-  credentials.apply(headers)
 
   return headers
 
 
-def _handle_ai_platform_response(uri, response):
+def _handle_ai_platform_response(uri, response, json_decoder=None):
   """Handle response to AI platform from both get/post calls.
 
   Args:
     uri: Request uri.
     response: Response from the request.
+    json_decoder: Optional function to decode the raw response body with
+      instead of response.json().
   Returns:
-    Request results in json format.
+    Request results in json format. The attributions of explain responses
+    are converted to numpy types.
   Raises:
     ValueError: When the request fails, the ValueError will be raised with
       either 404 error or the raw errors.
   """
   if response.status_code == 200:
-    return response.json()
+    if json_decoder is not None:
+      result = json_decoder(response.content)
+    else:
+      result = response.json()
+    if uri.endswith(':explain') and isinstance(result, dict):
+      json_utils.convert_explain_response(result)
+    return result
   elif response.status_code == 404:
     raise ValueError(('Target URI {} returns HTTP 404 error.\n'
                       'Please check if the project, model, and version names '
@@ -77,38 +278,182 @@ def _handle_ai_platform_response(uri, response):
                     ).format(uri, response.status_code, response.text))
 
 
+def _get_endpoint_key(uri):
+  """Returns the uri of the resource a request goes to, without its method."""
+  base, _, last = uri.rpartition('/')
+  return base + '/' + last.split(':')[0]
+
+
+def _send_once(uri, send_fn, transport, instance_count, deadline=None):
+  """Sends one attempt of a request through the circuit breaker and limiters.
+
+  Args:
+    uri: Request uri.
+    send_fn: Function that sends the request once and returns the response.
+    transport: The AIPlatformTransport the request is sent with, or None.
+    instance_count: Number of instances in the request.
+    deadline: Deadline of the call, bounding the time spent in the limiters.
+
+  Returns:
+    The response.
+
+  Raises:
+    circuit_breaker.CircuitOpenError: If the circuit breaker of the endpoint
+      is open.
+    deadline_utils.DeadlineExceededError: If the limiters do not let the
+      request through before the deadline.
+  """
+  if transport is None:
+    return send_fn()
+  if transport.circuit_breakers is None:
+    return _send_limited(send_fn, transport, instance_count, deadline)
+
+  breaker = transport.circuit_breakers.get(_get_endpoint_key(uri))
+  breaker_token = breaker.before_request()
+  try:
+    response = _send_limited(send_fn, transport, instance_count, deadline)
+  except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+    breaker.record_failure(breaker_token)
+    raise
+  except Exception:
+    breaker.record_abandoned(breaker_token)
+    raise
+  if response.status_code >= 500:
+    breaker.record_failure(breaker_token)
+  else:
+    breaker.record_success(breaker_token)
+  return response
+
+
+def _send_limited(send_fn, transport, instance_count, deadline):
+  """Sends one attempt of a request once the limiters of the transport allow."""
+  if transport.rate_limiter is not None:
+    transport.rate_limiter.acquire(instance_count, deadline)
+  concurrency_limiter = transport.concurrency_limiter
+  if concurrency_limiter is None:
+    return send_fn()
+  ticket = concurrency_limiter.acquire(deadline)
+  status_code = None
+  try:
+    response = send_fn()
+    status_code = response.status_code
+    return response
+  finally:
+    concurrency_limiter.release(ticket, status_code)
+
+
+def _fits_deadline(backoff_secs, deadline):
+  """Returns whether a retry after the backoff starts before the deadline."""
+  return deadline is None or backoff_secs * 1000 < deadline.remaining_ms()
+
+
+def _send_with_retries(uri, send_fn, transport, instance_count=0,
+                       deadline=None):
+  """Sends a request, retrying transient failures per the retry policy.
+
+  Args:
+    uri: Request uri, used for logging.
+    send_fn: Function that sends the request once and returns the response.
+    transport: The AIPlatformTransport the request is sent with, or None.
+    instance_count: Number of instances in the request, for rate limiting.
+    deadline: Deadline of the call. Retries whose backoff would end after it
+      are not attempted.
+
+  Returns:
+    The response of the last attempt.
+
+  Raises:
+    requests.exceptions.RequestException: If the last attempt failed with a
+      connection error or timeout.
+    deadline_utils.DeadlineExceededError: If the deadline passed.
+    circuit_breaker.CircuitOpenError: If the circuit breaker of the endpoint
+      is open.
+  """
+  policy, budget = _get_retry_settings(transport)
+  budget.record_request()
+  attempt = 0
+  while True:
+    attempt += 1
+    try:
+      response = _send_once(uri, send_fn, transport, instance_count,
+                            deadline)
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
+      if deadline is not None:
+        # A timeout may have been shortened to the time left.
+        deadline.check()
+      if not policy.retry_on_connection_errors:
+        raise
+      backoff_secs = policy.backoff_secs(attempt)
+      # Only draw from the budget for retries there is time left for.
+      if not (_fits_deadline(backoff_secs, deadline) and
+              retry_utils.should_retry(policy, budget, attempt)):
+        raise
+      logging.warning('Request to %s failed (%s), retrying.', uri, e)
+      time.sleep(backoff_secs)
+      continue
+
+    if not policy.is_retryable_status(response.status_code):
+      return response
+    headers = getattr(response, 'headers', None) or {}
+    backoff_secs = policy.backoff_secs(attempt, headers.get('Retry-After'))
+    if not (_fits_deadline(backoff_secs, deadline) and
+            retry_utils.should_retry(policy, budget, attempt)):
+      return response
+    logging.warning('Request to %s returned HTTP %d, retrying.', uri,
+                    response.status_code)
+    time.sleep(backoff_secs)
+
+
 def make_get_request_to_ai_platform(
     uri_params_str,
     credentials = None,
-    timeout_ms = constants.DEFAULT_TIMEOUT):
+    timeout_ms = constants.DEFAULT_TIMEOUT,
+    transport = None,
+    deadline = None):
   """Makes a get request to AI Platform.
 
   Args:
     uri_params_str: A string representing uri parameters (e.g.,
       projects/<proj_name>/models/<model_name>/versions/<version_name>).
     credentials: The OAuth2.0 credentials to use for GCP services.
-    timeout_ms: Timeout for each service call to the api (in milliseconds).
+    timeout_ms: Timeout for waiting on the response of each attempt (in
+      milliseconds). Connecting is bounded by the connect timeout of the
+      transport.
+    transport: Optional AIPlatformTransport to reuse pooled connections and
+      take the retry policy from. If not given, a new connection is opened for
+      each attempt and the default retry policy is used.
+    deadline: Optional deadline_utils.Deadline bounding the whole request,
+      retries included.
 
   Returns:
     Request results in json format.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If the deadline passed.
+    circuit_breaker.CircuitOpenError: If the transport's circuit breaker of
+      the endpoint is open.
   """
-  headers = _get_request_header(credentials)
-  ai_platform_endpoint = (
-      os.getenv('CLOUDSDK_API_ENDPOINT_OVERRIDES_ML') or
-      constants.CAIP_API_ENDPOINT)
+  uri = _get_ai_platform_uri(uri_params_str)
 
-  uri = os.path.join(
-      ai_platform_endpoint, constants.CAIP_API_ENDPOINT_VERSION, uri_params_str)
+  def send():
+    headers = _get_request_header(credentials)
+    return _get_http_client(transport).get(
+        uri,
+        headers=headers,
+        timeout=_get_timeout_secs(transport, timeout_ms, deadline))
 
-  r = requests.get(uri, headers=headers, timeout=timeout_ms)
-  return _handle_ai_platform_response(uri, r)
+  r = _send_with_retries(uri, send, transport, deadline=deadline)
+  return _handle_ai_platform_response(uri, r, _get_json_decoder(transport))
 
 
 def make_post_request_to_ai_platform(
     uri_params_str,
     request_body,
     credentials = None,
-    timeout_ms = constants.DEFAULT_TIMEOUT):
+    timeout_ms = constants.DEFAULT_TIMEOUT,
+    transport = None,
+    deadline = None):
   """Makes a post request to AI Platform.
 
   Args:
@@ -116,17 +461,37 @@ def make_post_request_to_ai_platform(
       projects/<proj_name>/models/<model_name>/versions/<version_name>).
     request_body: A dict for the request body
     credentials: The OAuth2.0 credentials to use for GCP services.
-    timeout_ms: Timeout for each service call to the api (in milliseconds).
+    timeout_ms: Timeout for waiting on the response of each attempt (in
+      milliseconds). Connecting is bounded by the connect timeout of the
+      transport.
+    transport: Optional AIPlatformTransport to reuse pooled connections and
+      take the retry policy from. If not given, a new connection is opened for
+      each attempt and the default retry policy is used.
+    deadline: Optional deadline_utils.Deadline bounding the whole request,
+      retries included.
 
   Returns:
     Request results in json format.
+
+  Raises:
+    deadline_utils.DeadlineExceededError: If the deadline passed.
+    circuit_breaker.CircuitOpenError: If the transport's circuit breaker of
+      the endpoint is open.
   """
-  headers = _get_request_header(credentials)
-  ai_platform_endpoint = (
-      os.getenv('CLOUDSDK_API_ENDPOINT_OVERRIDES_ML') or
-      constants.CAIP_API_ENDPOINT)
-  uri = os.path.join(
-      ai_platform_endpoint, constants.CAIP_API_ENDPOINT_VERSION, uri_params_str)
+  uri = _get_ai_platform_uri(uri_params_str)
+  # Encode once; retries resend the same bytes.
+  body_kwargs, body_headers = _encode_request_body(
+      request_body,
+      transport.request_compression if transport is not None else None)
+
+  def send():
+    headers = dict(_get_request_header(credentials), **body_headers)
+    return _get_http_client(transport).post(
+        uri,
+        headers=headers,
+        timeout=_get_timeout_secs(transport, timeout_ms, deadline),
+        **body_kwargs)
 
-  r = requests.post(uri, headers=headers, json=request_body, timeout=timeout_ms)
-  return _handle_ai_platform_response(uri, r)
+  r = _send_with_retries(uri, send, transport,
+                         len(request_body.get('instances', ())), deadline)
+  return _handle_ai_platform_response(uri, r, _get_json_decoder(transport))
@@ -15,11 +15,18 @@
 
 """Tests for http_utils."""
 
+import gzip
+import json
+
 import mock
 import requests
 import tensorflow.compat.v1 as tf
 
+from explainable_ai_sdk.model import circuit_breaker
+from explainable_ai_sdk.model import deadline_utils
 from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import retry_utils
+from explainable_ai_sdk.model import throttling
 
 
 class MockResponse(object):
@@ -28,6 +35,16 @@ class MockResponse(object):
     pass
 
 
+def _make_response(status_code, json_value=None, headers=None):
+  response = mock.Mock()
+  response.status_code = status_code
+  response.json.return_value = json_value
+  response.content = json.dumps(json_value).encode('utf-8')
+  response.text = 'error %d' % status_code
+  response.headers = headers or {}
+  return response
+
+
 class HttpUtilsTest(tf.test.TestCase):
 
   @mock.patch.object(requests, 'get', autospec=True)
@@ -133,6 +150,245 @@ class HttpUtilsTest(tf.test.TestCase):
       http_utils.make_post_request_to_ai_platform('uri/test_uri',
                                                   {'data': 123})
 
+  @mock.patch.object(requests, 'post', autospec=True)
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_with_transport(
+      self, mock_request_header, mock_session_post_func, mock_post_func):
+    mock_request_header.return_value = {}
+    mock_session_post_func.return_value = _make_response(200, 'results')
+
+    transport = http_utils.AIPlatformTransport(pool_maxsize=4)
+    for _ in range(2):
+      res = http_utils.make_post_request_to_ai_platform(
+          'uri/test_uri', {'data': 123}, transport=transport)
+      self.assertEqual(res, 'results')
+    self.assertEqual(mock_session_post_func.call_count, 2)
+    self.assertIs(mock_session_post_func.call_args[0][0], transport.session)
+    self.assertFalse(mock_post_func.called)
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_retries_transient_errors(
+      self, mock_request_header, mock_post_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_post_func.side_effect = [
+        _make_response(503),
+        _make_response(429, headers={'Retry-After': '7'}),
+        _make_response(200, 'results'),
+    ]
+
+    res = http_utils.make_post_request_to_ai_platform('uri/test_uri',
+                                                      {'data': 123})
+    self.assertEqual(res, 'results')
+    self.assertEqual(mock_post_func.call_count, 3)
+    self.assertEqual(mock_sleep.call_count, 2)
+    self.assertEqual(mock_sleep.call_args[0][0], 7)
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests.Session, 'get', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_get_request_to_ai_platform_retries_connection_errors(
+      self, mock_request_header, mock_get_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_get_func.side_effect = [
+        requests.exceptions.ConnectionError('reset'),
+        _make_response(200, 'results'),
+    ]
+
+    transport = http_utils.AIPlatformTransport(
+        retry_budget=retry_utils.RetryBudget())
+    res = http_utils.make_get_request_to_ai_platform(
+        'uri/test_uri', transport=transport)
+    self.assertEqual(res, 'results')
+    self.assertEqual(transport.retry_budget.stats()['retries'], 1)
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_gives_up_after_max_attempts(
+      self, mock_request_header, mock_post_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(503)
+
+    transport = http_utils.AIPlatformTransport(
+        retry_policy=retry_utils.RetryPolicy(max_attempts=4),
+        retry_budget=retry_utils.RetryBudget())
+    with self.assertRaisesRegex(ValueError, 'returns HTTP 503 error'):
+      http_utils.make_post_request_to_ai_platform(
+          'uri/test_uri', {'data': 123}, transport=transport)
+    self.assertEqual(mock_post_func.call_count, 4)
+    self.assertEqual(transport.retry_budget.stats()['attempts_exhausted'], 1)
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_respects_retry_budget(
+      self, mock_request_header, mock_post_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(503)
+
+    transport = http_utils.AIPlatformTransport(
+        retry_budget=retry_utils.RetryBudget(retry_ratio=0, max_tokens=1))
+    for _ in range(3):
+      with self.assertRaises(ValueError):
+        http_utils.make_post_request_to_ai_platform(
+            'uri/test_uri', {'data': 123}, transport=transport)
+    # One retry from the budget, then one attempt per request.
+    self.assertEqual(mock_post_func.call_count, 4)
+    self.assertEqual(transport.retry_budget.stats()['budget_exhausted'], 3)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_decodes_content(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    response = _make_response(200)
+    response.content = b'{"explanations": [1, 2]}'
+    mock_post_func.return_value = response
+
+    transport = http_utils.AIPlatformTransport(json_backend='json')
+    res = http_utils.make_post_request_to_ai_platform(
+        'uri/test_uri', {'data': 123}, transport=transport)
+    self.assertEqual(res, {'explanations': [1, 2]})
+    self.assertFalse(response.json.called)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_compresses_large_bodies(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(200, 'results')
+    transport = http_utils.AIPlatformTransport(
+        request_compression=http_utils.RequestCompression(threshold_bytes=100))
+
+    large_body = {'instances': [{'data': [0.5] * 100}]}
+    http_utils.make_post_request_to_ai_platform(
+        'uri/test_uri', large_body, transport=transport)
+    kwargs = mock_post_func.call_args[1]
+    self.assertEqual(kwargs['headers']['content-encoding'], 'gzip')
+    self.assertEqual(
+        json.loads(gzip.decompress(kwargs['data'])), large_body)
+
+    small_body = {'instances': [{'data': [0.5]}]}
+    http_utils.make_post_request_to_ai_platform(
+        'uri/test_uri', small_body, transport=transport)
+    kwargs = mock_post_func.call_args[1]
+    self.assertNotIn('content-encoding', kwargs['headers'])
+    self.assertEqual(json.loads(kwargs['data']), small_body)
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_uses_limiters(
+      self, mock_request_header, mock_post_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_post_func.side_effect = [
+        _make_response(429),
+        _make_response(200, 'results'),
+    ]
+    rate_limiter = mock.Mock(spec=throttling.RateLimiter)
+    concurrency_limiter = throttling.AdaptiveConcurrencyLimiter(
+        initial_limit=8)
+    transport = http_utils.AIPlatformTransport(
+        retry_budget=retry_utils.RetryBudget(),
+        rate_limiter=rate_limiter,
+        concurrency_limiter=concurrency_limiter)
+
+    http_utils.make_post_request_to_ai_platform(
+        'uri/test_uri', {'instances': [1, 2, 3]}, transport=transport)
+    self.assertEqual(rate_limiter.acquire.call_args_list,
+                     [mock.call(3, None), mock.call(3, None)])
+    self.assertEqual(concurrency_limiter.stats()['decreases'], 1)
+    self.assertEqual(concurrency_limiter.stats()['in_flight'], 0)
+    self.assertEqual(concurrency_limiter.limit, 4)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_limiter_wait_honors_deadline(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    concurrency_limiter = throttling.AdaptiveConcurrencyLimiter(
+        initial_limit=1)
+    concurrency_limiter.acquire()
+    transport = http_utils.AIPlatformTransport(
+        concurrency_limiter=concurrency_limiter)
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      http_utils.make_post_request_to_ai_platform(
+          'uri/test_uri', {'instances': [1]},
+          transport=transport,
+          deadline=deadline_utils.Deadline.from_budget_ms(50))
+    self.assertFalse(mock_post_func.called)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_timeouts_in_seconds(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(200, 'results')
+    transport = http_utils.AIPlatformTransport(connect_timeout_ms=3000)
+
+    http_utils.make_post_request_to_ai_platform(
+        'uri/test_uri', {'data': 123}, timeout_ms=1500, transport=transport)
+    self.assertEqual(mock_post_func.call_args[1]['timeout'], (3.0, 1.5))
+
+  @mock.patch.object(http_utils.time, 'sleep', autospec=True)
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_stops_retrying_at_deadline(
+      self, mock_request_header, mock_post_func, mock_sleep):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(
+        503, headers={'Retry-After': '10'})
+    transport = http_utils.AIPlatformTransport(
+        retry_budget=retry_utils.RetryBudget())
+
+    with self.assertRaisesRegex(ValueError, 'returns HTTP 503 error'):
+      http_utils.make_post_request_to_ai_platform(
+          'uri/test_uri', {'data': 123}, transport=transport,
+          deadline=deadline_utils.Deadline(5000))
+    self.assertEqual(mock_post_func.call_count, 1)
+    self.assertFalse(mock_sleep.called)
+    # A retry skipped for lack of time does not spend the budget.
+    self.assertEqual(transport.retry_budget.stats()['retries'], 0)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_expired_deadline(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    transport = http_utils.AIPlatformTransport()
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      http_utils.make_post_request_to_ai_platform(
+          'uri/test_uri', {'data': 123}, transport=transport,
+          deadline=deadline_utils.Deadline(0))
+    self.assertFalse(mock_post_func.called)
+
+  @mock.patch.object(requests.Session, 'post', autospec=True)
+  @mock.patch.object(http_utils, '_get_request_header', autospec=True)
+  def test_make_post_request_to_ai_platform_circuit_breaker(
+      self, mock_request_header, mock_post_func):
+    mock_request_header.return_value = {}
+    mock_post_func.return_value = _make_response(500)
+    registry = circuit_breaker.CircuitBreakerRegistry(
+        circuit_breaker.CircuitBreakerPolicy(min_requests=2, window_size=2))
+    transport = http_utils.AIPlatformTransport(
+        retry_policy=retry_utils.NO_RETRY_POLICY, circuit_breakers=registry)
+
+    for _ in range(2):
+      with self.assertRaisesRegex(ValueError, 'HTTP 500'):
+        http_utils.make_post_request_to_ai_platform(
+            'projects/p/models/m/versions/v:explain', {'data': 123},
+            transport=transport)
+    with self.assertRaises(circuit_breaker.CircuitOpenError):
+      http_utils.make_post_request_to_ai_platform(
+          'projects/p/models/m/versions/v:predict', {'data': 123},
+          transport=transport)
+    self.assertEqual(mock_post_func.call_count, 2)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,363 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Integrated Gradients attributions computed in-process.
+
+Integrated Gradients attributes the difference between the model score at an
+instance and at a baseline to the input features by integrating the gradients
+along the straight path between the two. The integral is approximated with a
+Riemann (midpoint) or trapezoidal rule over step_count points of the path.
+
+All path points of all instances, labels and baselines are evaluated as one
+batch, which is split into sub-batches whose inputs and gradients fit in
+max_batch_bytes. Path points are interpolated per sub-batch, so the full
+interpolation tensor is never held in memory.
+"""
+import numpy as np
+
+from explainable_ai_sdk.common import utils as common_utils
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import explanation
+from explainable_ai_sdk.model import utils
+
+# Rules for integrating the gradients along the path.
+RIEMANN = 'riemann'
+TRAPEZOIDAL = 'trapezoidal'
+
+
+def get_path_weights(step_count, rule = RIEMANN):
+  """Returns the path positions and integration weights of a rule.
+
+  Args:
+    step_count: Number of points the gradients are evaluated at.
+    rule: RIEMANN evaluates the midpoints of step_count equal intervals.
+      TRAPEZOIDAL evaluates step_count evenly spaced points including both
+      ends of the path, and needs at least two.
+
+  Returns:
+    A tuple of arrays of path positions in [0, 1] and of weights summing to
+    one.
+
+  Raises:
+    ValueError: If the rule is unknown or step_count is too small for it.
+  """
+  if rule == RIEMANN:
+    if step_count < 1:
+      raise ValueError('step_count must be positive.')
+    alphas = (np.arange(step_count) + 0.5) / step_count
+    return alphas, np.full(step_count, 1.0 / step_count)
+  if rule == TRAPEZOIDAL:
+    if step_count < 2:
+      raise ValueError('The trapezoidal rule needs a step_count of 2 or more.')
+    alphas = np.linspace(0.0, 1.0, step_count)
+    weights = np.full(step_count, 1.0 / (step_count - 1))
+    weights[[0, -1]] /= 2
+    return alphas, weights
+  raise ValueError('Unknown integration rule: %s.' % rule)
+
+
+def get_max_batch_size(inputs, max_batch_bytes):
+  """Returns how many rows of inputs and their gradients fit in the budget."""
+  row_bytes = sum(value[0].nbytes for value in inputs.values())
+  # Gradients are returned as float64, at most twice the size of the inputs.
+  return max(1, int(max_batch_bytes // max(3 * row_bytes, 1)))
+
+
+def stack_baselines(model_fn,
+                    baselines):
+  """Returns the baselines of the attributed inputs as arrays [baselines, ...].
+
+  Only differentiable inputs with a baseline are attributed. The others use
+  their instance values at every point of the path and are left out.
+  """
+  return {
+      name: np.stack([baseline[name] for baseline in baselines])
+      for name in model_fn.differentiable_inputs if name in baselines[0]
+  }
+
+
+def interpolate(inputs, stacked_baselines,
+                instance_rows, baseline_rows,
+                alphas):
+  """Returns the path points of the given rows.
+
+  Args:
+    inputs: Dictionary from input name to a batch of instance values.
+    stacked_baselines: Dictionary from input name to baselines [baselines,
+      ...], as returned by stack_baselines.
+    instance_rows: Array with the instance of each row.
+    baseline_rows: Array with the baseline of each row.
+    alphas: Array with the path position of each row.
+
+  Returns:
+    Dictionary from input name to an array of path points, one per row.
+  """
+  path = {}
+  for name, value in inputs.items():
+    instance_values = value[instance_rows]
+    if name not in stacked_baselines:
+      path[name] = instance_values
+      continue
+    baseline_values = stacked_baselines[name][baseline_rows]
+    shape = (-1,) + (1,) * (value.ndim - 1)
+    path[name] = baseline_values + alphas.reshape(shape).astype(
+        value.dtype) * (instance_values - baseline_values)
+  return path
+
+
+class IntegratedGradients(object):
+  """Explains the outputs of a model function with Integrated Gradients.
+
+  With a max_step_count above step_count, the step count adapts to each
+  explained (instance, label) pair: all pairs start with step_count points,
+  and pairs whose approximation error (the completeness gap) is above
+  target_error are refined by halving the intervals of the trapezoidal rule
+  until they meet the target or reach max_step_count. Refining reuses the
+  gradients already computed, so it only evaluates the new midpoints, and
+  instances that converge early cost no more than step_count points.
+  """
+
+  def __init__(self,
+               step_count = 50,
+               rule = None,
+               max_batch_bytes = constants.DEFAULT_LOCAL_MAX_BATCH_BYTES,
+               max_step_count = None,
+               target_error = explanation.APPROX_ERROR_THRESHOLD):
+    """Creates the explainer.
+
+    Args:
+      step_count: Number of points of the path the gradients are evaluated at,
+        or the initial number of points if the step count is adaptive.
+      rule: Integration rule, RIEMANN or TRAPEZOIDAL. Defaults to RIEMANN, or
+        to TRAPEZOIDAL if the step count is adaptive, which requires it.
+      max_batch_bytes: Memory budget of the inputs and gradients of one model
+        call. Larger budgets mean fewer, larger calls.
+      max_step_count: If greater than step_count, the step count is adaptive
+        and a pair is refined as long as its refined step count stays within
+        this bound.
+      target_error: Approximation error at which adaptive refinement of a pair
+        stops.
+
+    Raises:
+      ValueError: If the rule is unknown, step_count is too small for it, or
+        the step count is adaptive and the rule is not TRAPEZOIDAL.
+    """
+    self._adaptive = max_step_count is not None and max_step_count > step_count
+    if rule is None:
+      rule = TRAPEZOIDAL if self._adaptive else RIEMANN
+    if self._adaptive and rule != TRAPEZOIDAL:
+      raise ValueError('An adaptive step count needs the trapezoidal rule.')
+    self._alphas, self._weights = get_path_weights(step_count, rule)
+    self._max_batch_bytes = max_batch_bytes
+    self._max_step_count = max_step_count
+    self._target_error = target_error
+
+  def _integrate_pairs(self, model_fn, inputs,
+                       stacked_baselines,
+                       pair_instances, pair_labels,
+                       alphas, weights):
+    """Returns the path integrals of the gradients of (instance, label) pairs.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      stacked_baselines: Baselines as returned by stack_baselines.
+      pair_instances: Array with the instance of each pair.
+      pair_labels: Array with the output index of each pair.
+      alphas: Path positions to evaluate the gradients at.
+      weights: Integration weight of each path position.
+
+    Returns:
+      Dictionary from input name to integrals of shape [pairs, baselines,
+      ...].
+    """
+    names = list(stacked_baselines)
+    if not names:
+      return {}
+    pair_count = len(pair_instances)
+    baseline_count = len(next(iter(stacked_baselines.values())))
+    step_count = len(alphas)
+    group_count = pair_count * baseline_count
+
+    # Rows are ordered by pair, baseline and step, so the steps of each
+    # (pair, baseline) group are contiguous.
+    pairs, baseline_ids, steps = np.meshgrid(
+        np.arange(pair_count), np.arange(baseline_count),
+        np.arange(step_count), indexing='ij')
+    row_feed = {
+        'instance': pair_instances[pairs].ravel(),
+        'label': pair_labels[pairs].ravel(),
+        'baseline': baseline_ids.ravel(),
+        'step': steps.ravel(),
+        'group': np.arange(group_count).repeat(step_count),
+    }
+    integrals = {
+        name: np.zeros((group_count,) + inputs[name].shape[1:])
+        for name in names
+    }
+    max_batch_size = get_max_batch_size(inputs, self._max_batch_bytes)
+    for rows in common_utils.split_feeds(row_feed, [], {}, max_batch_size):
+      path = interpolate(inputs, stacked_baselines, rows['instance'],
+                         rows['baseline'], alphas[rows['step']])
+      _, gradients = model_fn.gradients(path, rows['label'], names)
+      row_weights = weights[rows['step']]
+      groups, starts = np.unique(rows['group'], return_index=True)
+      for name in names:
+        weighted = gradients[name] * row_weights.reshape(
+            (-1,) + (1,) * (gradients[name].ndim - 1))
+        integrals[name][groups] += np.add.reduceat(weighted, starts, axis=0)
+    return {
+        name: integral.reshape((pair_count, baseline_count) +
+                               integral.shape[1:])
+        for name, integral in integrals.items()
+    }
+
+  def integrate_gradients(self, model_fn, inputs,
+                          baselines,
+                          label_indices):
+    """Returns the path integrals of the gradients of each label.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      baselines: A list of dictionaries from input name to baseline values
+        without the batch dimension.
+      label_indices: Array of shape [instances, labels] with the output
+        indices to explain for each instance.
+
+    Returns:
+      Dictionary from input name to the integrated gradients of shape
+      [instances, labels, baselines, ...], for the differentiable inputs with
+      baselines. The step count is not adaptive.
+    """
+    instance_count, label_count = label_indices.shape
+    integrals = self._integrate_pairs(
+        model_fn, inputs, stack_baselines(model_fn, baselines),
+        np.arange(instance_count).repeat(label_count), label_indices.ravel(),
+        self._alphas, self._weights)
+    return {
+        name: integral.reshape((instance_count, label_count) +
+                               integral.shape[1:])
+        for name, integral in integrals.items()
+    }
+
+  def get_baseline_scores(self, model_fn, inputs,
+                          baselines,
+                          label_indices):
+    """Returns the scores of the labels at each baseline, averaged.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      baselines: A list of dictionaries from input name to baseline values.
+      label_indices: Array of shape [instances, labels].
+
+    Returns:
+      An array of shape [instances, labels].
+    """
+    stacked_baselines = stack_baselines(model_fn, baselines)
+    instance_count = label_indices.shape[0]
+    instances, baseline_ids = np.meshgrid(
+        np.arange(instance_count), np.arange(len(baselines)), indexing='ij')
+    row_feed = {'instance': instances.ravel(), 'baseline': baseline_ids.ravel()}
+    scores = []
+    max_batch_size = get_max_batch_size(inputs, self._max_batch_bytes)
+    for rows in common_utils.split_feeds(row_feed, [], {}, max_batch_size):
+      path = interpolate(inputs, stacked_baselines, rows['instance'],
+                         rows['baseline'], np.zeros(len(rows['instance'])))
+      scores.append(model_fn.scores(path))
+    scores = np.concatenate(scores).reshape(instance_count, len(baselines), -1)
+    return np.take_along_axis(
+        scores.mean(axis=1), label_indices, axis=1)
+
+  def attribute(self, model_fn, inputs,
+                baselines,
+                label_indices,
+                scores = None):
+    """Computes attributions of the given labels of each instance.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      baselines: A list of dictionaries from input name to baseline values
+        without the batch dimension. Attributions are averaged over baselines.
+      label_indices: Array of shape [instances, labels] with the output
+        indices to explain for each instance.
+      scores: Optional array of shape [instances, outputs] with the scores of
+        the instances, if the caller already computed them.
+
+    Returns:
+      A utils.AttributionResult.
+    """
+    instance_count, label_count = label_indices.shape
+    stacked_baselines = stack_baselines(model_fn, baselines)
+    pair_instances = np.arange(instance_count).repeat(label_count)
+    pair_labels = label_indices.ravel()
+    baseline_scores = self.get_baseline_scores(
+        model_fn, inputs, baselines, label_indices).reshape(-1, 1)
+    if scores is None:
+      scores = model_fn.scores(inputs)
+    example_scores = np.take_along_axis(
+        scores, label_indices, axis=1).reshape(-1, 1)
+
+    def get_attributions(integrals, pairs):
+      """Returns attributions of shape [pairs, 1, ...] and their errors."""
+      attributions = {}
+      for name, integral in integrals.items():
+        # [pairs, 1, ...] - [1, baselines, ...]
+        differences = (inputs[name][pair_instances[pairs], np.newaxis] -
+                       stacked_baselines[name][np.newaxis])
+        attributions[name] = (integral * differences).mean(
+            axis=1)[:, np.newaxis]
+      return attributions, utils.get_approx_errors(
+          attributions, example_scores[pairs], baseline_scores[pairs])
+
+    all_pairs = np.arange(len(pair_instances))
+    integrals = self._integrate_pairs(model_fn, inputs, stacked_baselines,
+                                      pair_instances, pair_labels,
+                                      self._alphas, self._weights)
+    attributions, approx_errors = get_attributions(integrals, all_pairs)
+
+    if self._adaptive:
+      interval_count = len(self._alphas) - 1
+      pending = all_pairs[approx_errors[:, 0] > self._target_error]
+      while pending.size and 2 * interval_count + 1 <= self._max_step_count:
+        # Halving the intervals averages the trapezoidal rule with the
+        # midpoint rule of the current intervals.
+        midpoint_integrals = self._integrate_pairs(
+            model_fn, inputs, stacked_baselines, pair_instances[pending],
+            pair_labels[pending],
+            (np.arange(interval_count) + 0.5) / interval_count,
+            np.full(interval_count, 1.0 / interval_count))
+        interval_count *= 2
+        refined = {
+            name: (integrals[name][pending] + midpoint_integrals[name]) / 2
+            for name in integrals
+        }
+        refined_attributions, refined_errors = get_attributions(
+            refined, pending)
+        for name in integrals:
+          integrals[name][pending] = refined[name]
+          attributions[name][pending] = refined_attributions[name]
+        approx_errors[pending] = refined_errors
+        pending = pending[refined_errors[:, 0] > self._target_error]
+
+    return utils.AttributionResult(
+        {
+            name: attrs.reshape((instance_count, label_count) +
+                                attrs.shape[2:])
+            for name, attrs in attributions.items()
+        }, baseline_scores.reshape(instance_count, label_count),
+        approx_errors.reshape(instance_count, label_count))
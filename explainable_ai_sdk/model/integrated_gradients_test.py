@@ -0,0 +1,147 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for integrated_gradients."""
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import integrated_gradients
+
+
+class _PowerModelFunction(object):
+  """Scores sum(x ** power) as label 0 and sum(x) as label 1."""
+
+  differentiable_inputs = ['x']
+
+  def __init__(self, power=2):
+    self.batch_sizes = []
+    self._power = power
+
+  def scores(self, inputs):
+    x = inputs['x']
+    return np.stack([np.sum(x**self._power, axis=1), np.sum(x, axis=1)],
+                    axis=1)
+
+  def gradients(self, inputs, label_indices, names):
+    del names
+    x = inputs['x']
+    self.batch_sizes.append(len(x))
+    gradients = np.where(label_indices[:, np.newaxis] == 0,
+                         self._power * x**(self._power - 1), np.ones_like(x))
+    return self.scores(inputs)[np.arange(len(x)), label_indices], {
+        'x': gradients
+    }
+
+
+class IntegratedGradientsTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(IntegratedGradientsTest, self).setUp()
+    self._inputs = {'x': np.array([[1.0, 2.0], [3.0, -1.0], [0.5, 0.5]])}
+    self._baselines = [{'x': np.array([0.0, 0.0])},
+                       {'x': np.array([1.0, 1.0])}]
+    self._label_indices = np.array([[0, 1], [1, 0], [0, 1]])
+
+  def test_get_path_weights(self):
+    alphas, weights = integrated_gradients.get_path_weights(
+        4, integrated_gradients.TRAPEZOIDAL)
+    self.assertAllClose(alphas, [0.0, 1 / 3, 2 / 3, 1.0])
+    self.assertAllClose(weights, [1 / 6, 1 / 3, 1 / 3, 1 / 6])
+    alphas, weights = integrated_gradients.get_path_weights(
+        4, integrated_gradients.RIEMANN)
+    self.assertAllClose(alphas, [0.125, 0.375, 0.625, 0.875])
+    self.assertAllClose(weights, [0.25] * 4)
+    with self.assertRaises(ValueError):
+      integrated_gradients.get_path_weights(1,
+                                            integrated_gradients.TRAPEZOIDAL)
+
+  def test_attribute(self):
+    model_fn = _PowerModelFunction()
+    for rule in (integrated_gradients.RIEMANN,
+                 integrated_gradients.TRAPEZOIDAL):
+      explainer = integrated_gradients.IntegratedGradients(step_count=3,
+                                                           rule=rule)
+      result = explainer.attribute(model_fn, self._inputs, self._baselines,
+                                   self._label_indices)
+
+      # Gradients are linear along the path, so both rules are exact.
+      x = self._inputs['x']
+      expected_label_0 = (2 * x**2 - 1) / 2
+      expected_label_1 = (2 * x - 1) / 2
+      self.assertAllClose(result.attributions['x'][0, 0], expected_label_0[0])
+      self.assertAllClose(result.attributions['x'][0, 1], expected_label_1[0])
+      self.assertAllClose(result.attributions['x'][1, 0], expected_label_1[1])
+      self.assertAllClose(result.baseline_scores,
+                          [[1.0, 1.0], [1.0, 1.0], [1.0, 1.0]])
+      self.assertAllClose(result.approx_errors, np.zeros((3, 2)))
+
+  def test_attribute_uses_given_scores(self):
+    model_fn = _PowerModelFunction()
+    explainer = integrated_gradients.IntegratedGradients(step_count=3)
+    scores = model_fn.scores(self._inputs) + 1.0
+    result = explainer.attribute(model_fn, self._inputs, self._baselines,
+                                 self._label_indices, scores)
+
+    # The attributions are exact, so only the offset scores cause errors.
+    self.assertTrue(np.all(result.approx_errors > 0))
+
+  def test_attribute_splits_batch_under_memory_budget(self):
+    model_fn = _PowerModelFunction()
+    explainer = integrated_gradients.IntegratedGradients(step_count=5)
+    expected = explainer.attribute(model_fn, self._inputs, self._baselines,
+                                   self._label_indices)
+    # One batch with all 3 instances x 2 labels x 2 baselines x 5 steps.
+    self.assertEqual(model_fn.batch_sizes, [60])
+
+    model_fn = _PowerModelFunction()
+    # Rows of two float64 features take 16 bytes, and gradients twice more.
+    explainer = integrated_gradients.IntegratedGradients(
+        step_count=5, max_batch_bytes=7 * 48)
+    result = explainer.attribute(model_fn, self._inputs, self._baselines,
+                                 self._label_indices)
+    self.assertEqual(model_fn.batch_sizes, [7] * 8 + [4])
+    self.assertAllClose(result.attributions['x'], expected.attributions['x'])
+
+  def test_attribute_refines_pairs_above_target_error(self):
+    model_fn = _PowerModelFunction(power=3)
+    explainer = integrated_gradients.IntegratedGradients(
+        step_count=2, max_step_count=9)
+    baselines = [{'x': np.array([0.0, 0.0])}]
+    result = explainer.attribute(model_fn, self._inputs, baselines,
+                                 self._label_indices)
+
+    # The gradients of sum(x ** 3) are quadratic along the path. Trapezoidal
+    # rules with 1, 2 and 4 intervals are off by 50%, 12.5% and 3.1%, so only
+    # the 3 pairs of label 0 are refined, twice. Label 1 is linear and exact.
+    self.assertEqual(model_fn.batch_sizes, [12, 3, 6])
+    x = self._inputs['x']
+    self.assertAllClose(result.attributions['x'][0, 0], x[0]**3 * 1.03125)
+    self.assertAllClose(result.attributions['x'][0, 1], x[0])
+    self.assertAllClose(result.approx_errors,
+                        [[0.03125, 0.0], [0.0, 0.03125], [0.03125, 0.0]])
+
+  def test_attribute_stops_refining_at_max_step_count(self):
+    model_fn = _PowerModelFunction(power=3)
+    explainer = integrated_gradients.IntegratedGradients(
+        step_count=2, max_step_count=4)
+    result = explainer.attribute(model_fn, self._inputs,
+                                 [{'x': np.array([0.0, 0.0])}],
+                                 self._label_indices)
+    self.assertEqual(model_fn.batch_sizes, [12, 3])
+    self.assertAllClose(result.approx_errors[0], [0.125, 0.0])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,113 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Pluggable JSON decoders for AI Platform responses.
+
+Explain responses of image and embedding models can be several megabytes of
+numbers. orjson and ujson parse them several times faster than the standard
+library, so they are used when installed:
+
+  pip install explainable-ai-sdk[fast_json]
+
+Attribution values are converted to numpy arrays right after decoding (see
+convert_explain_response), so building Attribution objects from the response
+does not walk the decoded lists again.
+"""
+import json
+
+from explainable_ai_sdk.common import attribution
+
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  orjson = None
+
+try:
+  import ujson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  ujson = None
+
+AUTO = 'auto'
+ORJSON = 'orjson'
+UJSON = 'ujson'
+STDLIB = 'json'
+
+
+def _orjson_loads(content):
+  return orjson.loads(content)
+
+
+def _ujson_loads(content):
+  return ujson.loads(content)
+
+
+def _stdlib_loads(content):
+  if isinstance(content, bytes):
+    content = content.decode('utf-8')
+  return json.loads(content)
+
+
+def convert_explain_response(response):
+  """Converts the attributions of a decoded explain response to numpy types.
+
+  Each entry of attributions_by_label is converted in place as
+  Attribution.from_dict would, which then skips the values that are already
+  numpy arrays and scalars.
+
+  Args:
+    response: The decoded JSON response of an explain request.
+
+  Returns:
+    The response.
+  """
+  for explanation_dict in response.get('explanations', ()):
+    if not isinstance(explanation_dict, dict):
+      continue
+    for attrs_obj_dict in explanation_dict.get('attributions_by_label', ()):
+      attribution._convert_dict_to_numpy_types(attrs_obj_dict)  # pylint: disable=protected-access
+  return response
+
+
+def get_decoder(backend = AUTO):
+  """Returns a function decoding JSON bytes or str with the given backend.
+
+  Args:
+    backend: One of 'orjson', 'ujson', 'json' or 'auto'. 'auto' picks the
+      fastest installed backend.
+
+  Returns:
+    A function that takes a bytes or str JSON document and returns the decoded
+    Python object.
+
+  Raises:
+    ValueError: If the backend is unknown or not installed.
+  """
+  if backend == AUTO:
+    if orjson is not None:
+      return _orjson_loads
+    if ujson is not None:
+      return _ujson_loads
+    return _stdlib_loads
+  if backend == ORJSON:
+    if orjson is None:
+      raise ValueError('orjson is not installed.')
+    return _orjson_loads
+  if backend == UJSON:
+    if ujson is None:
+      raise ValueError('ujson is not installed.')
+    return _ujson_loads
+  if backend == STDLIB:
+    return _stdlib_loads
+  raise ValueError('Unknown JSON backend: {}'.format(backend))
@@ -0,0 +1,67 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for json_utils."""
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.common import attribution
+from explainable_ai_sdk.model import json_utils
+
+_DOC = b'{"explanations": [{"attributions": {"data": [0.5, -1e-3, 2]}}]}'
+_EXPECTED = {'explanations': [{'attributions': {'data': [0.5, -1e-3, 2]}}]}
+
+
+class JsonUtilsTest(tf.test.TestCase):
+
+  def test_decoders_agree(self):
+    backends = [json_utils.AUTO, json_utils.STDLIB]
+    if json_utils.orjson is not None:
+      backends.append(json_utils.ORJSON)
+    if json_utils.ujson is not None:
+      backends.append(json_utils.UJSON)
+    for backend in backends:
+      decoder = json_utils.get_decoder(backend)
+      self.assertEqual(decoder(_DOC), _EXPECTED)
+      self.assertEqual(decoder(_DOC.decode('utf-8')), _EXPECTED)
+
+  def test_convert_explain_response(self):
+    response = json_utils.convert_explain_response({
+        'explanations': [{
+            'attributions_by_label': [{
+                'attributions': {'data': [[0.5, 1.0]]},
+                'baseline_score': 0.0,
+                'example_score': 1,
+                'output_name': 'probability'
+            }]
+        }]
+    })
+
+    attrs_obj_dict = response['explanations'][0]['attributions_by_label'][0]
+    data = attrs_obj_dict['attributions']['data']
+    self.assertIsInstance(data, np.ndarray)
+    self.assertAllEqual(data, [[0.5, 1.0]])
+    self.assertIsInstance(attrs_obj_dict['example_score'], np.int32)
+    # Attributions are built from the converted arrays without copying them.
+    attr = attribution.Attribution.from_dict(attrs_obj_dict)
+    self.assertIs(attr.post_processed_attributions['data'], data)
+
+  def test_unknown_backend(self):
+    with self.assertRaisesRegex(ValueError, 'Unknown JSON backend'):
+      json_utils.get_decoder('simdjson')
+
+
+if __name__ == '__main__':
+  tf.test.main()
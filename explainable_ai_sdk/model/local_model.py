@@ -0,0 +1,457 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Model class that explains a TF2 SavedModel in-process.
+
+LocalModel loads a SavedModel together with the explanation_metadata.json
+saved next to it (e.g., by SavedModelMetadataBuilder) and computes
+attributions with a local implementation of the configured method, so that
+explanations need no network calls. It returns the same Explanation objects as
+AIPlatformModel.
+"""
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from explainable_ai_sdk.common import attribution
+from explainable_ai_sdk.common import constants as common_constants
+from explainable_ai_sdk.common import explain_metadata
+from explainable_ai_sdk.common import utils as common_utils
+from explainable_ai_sdk.model import configs
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import explanation
+from explainable_ai_sdk.model import integrated_gradients
+from explainable_ai_sdk.model import model
+from explainable_ai_sdk.model import sampled_shapley
+from explainable_ai_sdk.model import utils
+from explainable_ai_sdk.model import xrai
+
+_METADATA_FILE_NAME = 'explanation_metadata.json'
+
+
+class ModelFunction(object):
+  """Evaluates the explained output of a SavedModel signature.
+
+  Inputs are dictionaries from metadata input names to batches of values.
+  Scores are the explained output as an array of shape [batch, outputs].
+  """
+
+  def __init__(self, signature, explain_md):
+    """Creates a model function.
+
+    Args:
+      signature: A concrete function of a loaded SavedModel signature.
+      explain_md: ExplainMetadata of the signature.
+
+    Raises:
+      ValueError: If an input or output in the metadata is not in the
+        signature, or the output is not a scalar or a vector per instance.
+    """
+    self._signature = signature
+    _, input_specs = signature.structured_input_signature
+    self._tensor_names = {}
+    self._input_specs = {}
+    for input_md in explain_md.inputs:
+      tensor_name = input_md.input_tensor_name or input_md.name
+      if tensor_name not in input_specs:
+        raise ValueError('Input tensor %s of input %s is not an input of the '
+                         'signature.' % (tensor_name, input_md.name))
+      self._tensor_names[input_md.name] = tensor_name
+      self._input_specs[input_md.name] = input_specs[tensor_name]
+    output_md = explain_md.outputs[0]
+    self._output_key = output_md.output_tensor_name or output_md.name
+    output_spec = signature.structured_outputs.get(self._output_key)
+    if output_spec is None:
+      raise ValueError('Output tensor %s is not an output of the signature.' %
+                       self._output_key)
+    if output_spec.shape.rank not in (None, 1, 2):
+      raise ValueError('Only outputs with a scalar or a vector of scores per '
+                       'instance can be explained.')
+    self._scalar_output = output_spec.shape.rank == 1
+
+  @property
+  def tensor_names(self):
+    """Dictionary from input name to the signature input it is fed to."""
+    return self._tensor_names
+
+  @property
+  def scalar_output(self):
+    """Whether the explained output has a single score per instance."""
+    return self._scalar_output
+
+  @property
+  def differentiable_inputs(self):
+    """Names of the inputs with floating point values."""
+    return [name for name, spec in self._input_specs.items()
+            if spec.dtype.is_floating]
+
+  def input_dtype(self, name):
+    """Returns the NumPy dtype of an input."""
+    spec = self._input_specs[name]
+    if spec.dtype == tf.string:
+      return np.object_
+    return spec.dtype.as_numpy_dtype
+
+  def _call(self, tensors):
+    outputs = self._signature(
+        **{self._tensor_names[name]: t for name, t in tensors.items()})
+    scores = outputs[self._output_key]
+    return tf.reshape(scores, [tf.shape(scores)[0], -1])
+
+  def _to_tensors(self, inputs):
+    return {
+        name: tf.convert_to_tensor(value, dtype=self._input_specs[name].dtype)
+        for name, value in inputs.items()
+    }
+
+  def predict(self, inputs):
+    """Returns all outputs of the signature as arrays keyed by output name."""
+    outputs = self._signature(**{
+        self._tensor_names[name]: t
+        for name, t in self._to_tensors(inputs).items()
+    })
+    return {name: value.numpy() for name, value in outputs.items()}
+
+  def scores(self, inputs):
+    """Returns the explained output of a batch as an array [batch, outputs]."""
+    return self._call(self._to_tensors(inputs)).numpy().astype(np.float64)
+
+  def gradients(self, inputs, label_indices,
+                names):
+    """Returns scores of the given labels and their gradients.
+
+    Args:
+      inputs: Dictionary from input name to a batch of values.
+      label_indices: Array with the output index to differentiate per row.
+      names: Names of the inputs to take the gradients with respect to.
+
+    Returns:
+      A tuple of an array with the score of the label of each row and a
+      dictionary from input name to the gradients of those scores.
+    """
+    tensors = self._to_tensors(inputs)
+    with tf.GradientTape() as tape:
+      for name in names:
+        tape.watch(tensors[name])
+      scores = tf.gather(
+          self._call(tensors),
+          tf.convert_to_tensor(label_indices, dtype=tf.int32)[:, tf.newaxis],
+          batch_dims=1)[:, 0]
+    gradients = tape.gradient(
+        scores, [tensors[name] for name in names],
+        unconnected_gradients=tf.UnconnectedGradients.ZERO)
+    return scores.numpy().astype(np.float64), {
+        name: grad.numpy().astype(np.float64)
+        for name, grad in zip(names, gradients)
+    }
+
+
+def _read_metadata(model_path):
+  metadata_path = os.path.join(model_path, _METADATA_FILE_NAME)
+  with tf.io.gfile.GFile(metadata_path, 'r') as f:
+    return explain_metadata.ExplainMetadata.from_dict(json.load(f))
+
+
+def _get_label_indices(scores, label_indices,
+                       top_k):
+  """Returns the output indices to explain as an array [instances, labels].
+
+  Args:
+    scores: Array of shape [instances, outputs].
+    label_indices: Either a list of indices explained for all instances or a
+      list with a list of indices per instance. If None, the top_k highest
+      scores are explained.
+    top_k: Number of highest scoring outputs to explain. Defaults to 1.
+
+  Raises:
+    ValueError: If the label indices are out of range or their number differs
+      between instances.
+  """
+  if label_indices is None:
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return order[:, :top_k or 1]
+  if label_indices and not isinstance(label_indices[0], (list, tuple)):
+    label_indices = [label_indices] * len(scores)
+  if len(label_indices) != len(scores) or len(
+      set(len(indices) for indices in label_indices)) != 1:
+    raise ValueError('label_indices needs the same number of labels for each '
+                     'instance.')
+  label_indices = np.asarray(label_indices, dtype=np.int64)
+  if label_indices.min() < 0 or label_indices.max() >= scores.shape[1]:
+    raise ValueError('label_indices must be in [0, %d).' % scores.shape[1])
+  return label_indices
+
+
+class LocalModel(model.Model):
+  """Class for TF2 SavedModels explained in-process."""
+
+  def __init__(self,
+               model_path,
+               config,
+               signature_name = (
+                   tf.saved_model.DEFAULT_SERVING_SIGNATURE_DEF_KEY),
+               max_batch_bytes = constants.DEFAULT_LOCAL_MAX_BATCH_BYTES,
+               max_step_count = None,
+               antithetic_sampling = False):
+    """Loads the model and its explanation metadata.
+
+    Args:
+      model_path: Path of a SavedModel with an explanation_metadata.json file.
+        It can be a local folder or a GCS bucket.
+      config: An IntegratedGradientsConfig, SampledShapleyConfig or
+        XraiConfig with the parameters of the attribution method.
+      signature_name: Name of the signature to explain.
+      max_batch_bytes: Memory budget of the inputs and gradients of one model
+        call. Explainers evaluate all the points they need as one batch split
+        into sub-batches of this size.
+      max_step_count: If greater than the step_count of an Integrated
+        Gradients or XRAI config, the step count adapts to each instance:
+        instances whose approximation error is above
+        explanation.APPROX_ERROR_THRESHOLD are refined with up to this many
+        steps.
+      antithetic_sampling: Whether Sampled Shapley pairs every sampled feature
+        order with its reverse, which lowers the variance of attributions for
+        the same path_count.
+
+    Raises:
+      ValueError: If the config is not supported, or the metadata does not
+        describe exactly one output of the signature.
+    """
+    self._config = config
+    self._max_batch_bytes = max_batch_bytes
+    self._max_step_count = max_step_count
+    self._antithetic_sampling = antithetic_sampling
+    # Shared by the XRAI explainers of all calls, including those with params,
+    # so that an image is only segmented once.
+    self._segmentation_cache = xrai.SegmentationCache()
+    self._explain_md = _read_metadata(model_path)
+    if len(self._explain_md.outputs) != 1:
+      raise ValueError('The metadata must have exactly one output to explain.')
+    self._loaded_model = tf.saved_model.load(model_path)
+    self._model_fn = ModelFunction(
+        self._loaded_model.signatures[signature_name], self._explain_md)
+    self._modality_input_list_map = utils.get_modality_input_list_map(
+        self._explain_md)
+    self._explainer = self._create_explainer(config)
+
+  @property
+  def explanation_metadata(self):
+    return self._explain_md
+
+  def _create_explainer(self, config):
+    """Returns the local explainer of the attribution config."""
+    if isinstance(config, configs.XraiConfig):
+      image_inputs = [
+          input_md.name
+          for input_md in self._explain_md.inputs
+          if input_md.modality == explain_metadata.Modality.IMAGE
+      ]
+      if not image_inputs:
+        raise ValueError('XRAI needs an input with image modality.')
+      return xrai.Xrai(
+          config.step_count,
+          image_inputs,
+          max_batch_bytes=self._max_batch_bytes,
+          max_step_count=self._max_step_count,
+          segmentation_cache=self._segmentation_cache)
+    if isinstance(config, configs.IntegratedGradientsConfig):
+      return integrated_gradients.IntegratedGradients(
+          config.step_count,
+          max_batch_bytes=self._max_batch_bytes,
+          max_step_count=self._max_step_count)
+    if isinstance(config, configs.SampledShapleyConfig):
+      feature_inputs = [
+          input_md.name
+          for input_md in self._explain_md.inputs
+          if input_md.index_feature_mapping
+      ]
+      return sampled_shapley.SampledShapley(
+          config.path_count,
+          feature_inputs,
+          antithetic=self._antithetic_sampling,
+          max_batch_bytes=self._max_batch_bytes)
+    raise ValueError('Unsupported attribution config: %s.' %
+                     type(config).__name__)
+
+  def _get_inputs(self, instances):
+    """Columnarizes instances into arrays keyed by input name."""
+    inputs = {}
+    for name, tensor_name in self._model_fn.tensor_names.items():
+      values = []
+      for instance in instances:
+        if not isinstance(instance, dict):
+          # Models with a single input accept its bare values.
+          values.append(instance)
+        elif tensor_name in instance:
+          values.append(instance[tensor_name])
+        elif name in instance:
+          values.append(instance[name])
+        else:
+          raise ValueError('Instance is missing input %s.' % tensor_name)
+      inputs[name] = np.asarray(
+          values, dtype=self._model_fn.input_dtype(name))
+    return inputs
+
+  def _get_baselines(self, inputs,
+                     baseline_instances):
+    """Returns per-baseline dictionaries of baseline values.
+
+    Baselines come from baseline_instances if given, or else from the
+    input_baselines of the metadata. Numeric inputs without baselines use
+    zeros. Other inputs without baselines keep their instance values and are
+    not attributed.
+
+    Args:
+      inputs: Dictionary from input name to a batch of instance values.
+      baseline_instances: A list of instances to use as baselines, or None.
+
+    Returns:
+      A list of dictionaries from input name to baseline values broadcast to
+      the shape of one instance.
+
+    Raises:
+      ValueError: If inputs have different numbers of baselines, or if no
+        input has a baseline.
+    """
+    if baseline_instances is not None:
+      baseline_inputs = self._get_inputs(baseline_instances)
+      per_input = {
+          name: list(values) for name, values in baseline_inputs.items()
+      }
+    else:
+      per_input = {}
+      for input_md in self._explain_md.inputs:
+        if input_md.input_baselines is not None:
+          per_input[input_md.name] = list(input_md.input_baselines)
+        elif np.issubdtype(inputs[input_md.name].dtype, np.number):
+          per_input[input_md.name] = [0]
+    if not per_input:
+      raise ValueError('None of the inputs has a baseline. Set input_baselines '
+                       'in the explanation metadata or pass baselines in the '
+                       'AttributionParameters.')
+    baseline_count = max(len(values) for values in per_input.values())
+    baselines = [{} for _ in range(baseline_count)]
+    for name, values in per_input.items():
+      if len(values) not in (1, baseline_count):
+        raise ValueError('All inputs must have the same number of baselines '
+                         'or a single one.')
+      shape = inputs[name].shape[1:]
+      for b, baseline in enumerate(baselines):
+        value = np.asarray(values[b % len(values)], dtype=inputs[name].dtype)
+        baseline[name] = np.broadcast_to(value, shape)
+    return baselines
+
+  def _to_attrs_dict(self, attributions, i, j):
+    """Returns the attributions of instance i and label j keyed by feature.
+
+    Inputs with an index_feature_mapping are split into one entry per feature,
+    as the explanation service does.
+    """
+    attrs_dict = {}
+    for name, attrs in attributions.items():
+      input_md = self._explain_md.input_by_name(name)
+      if input_md.index_feature_mapping:
+        for idx, feature_name in enumerate(input_md.index_feature_mapping):
+          attrs_dict[feature_name] = attrs[i, j][..., idx]
+      else:
+        attrs_dict[name] = attrs[i, j]
+    return attrs_dict
+
+  def predict(self, instances):
+    """Runs the serving signature of the model on instances.
+
+    Args:
+       instances: A list of instances for getting predictions.
+
+    Returns:
+       A list with the prediction of each instance. Predictions are
+       dictionaries from output name to value, or the bare value if the
+       signature has a single output.
+    """
+    outputs = self._model_fn.predict(self._get_inputs(instances))
+    if len(outputs) == 1:
+      return next(iter(outputs.values())).tolist()
+    return common_utils.rowify(outputs)
+
+  def explain(self,
+              instances,
+              params = None,
+              timeout_ms = None,
+              deadline_ms = None):
+    """Explains instances with the configured attribution method.
+
+    Args:
+       instances: A list of instances for getting explanations.
+       params: An AttributionParameters object to override the labels,
+         baselines or attribution config of this call.
+       timeout_ms: Ignored. Accepted so that a LocalModel can be used where
+         a remote model is expected.
+       deadline_ms: Ignored, as timeout_ms.
+
+    Returns:
+       A list of Explanation objects.
+
+    Raises:
+      ValueError: If the params are invalid, e.g. their attribution config is
+        of a different method than the one the model was loaded with.
+    """
+    if not instances:
+      return []
+    params = params or configs.AttributionParameters()
+    explainer = self._explainer
+    if params.attribution_config is not None:
+      if type(params.attribution_config) is not type(self._config):  # pylint: disable=unidiomatic-typecheck
+        raise ValueError('The attribution config in params must be a %s.' %
+                         type(self._config).__name__)
+      explainer = self._create_explainer(params.attribution_config)
+
+    inputs = self._get_inputs(instances)
+    scores = self._model_fn.scores(inputs)
+    label_indices = _get_label_indices(scores, params.label_indices,
+                                       params.top_k)
+    baselines = self._get_baselines(inputs, params.baselines)
+    result = explainer.attribute(self._model_fn, inputs, baselines,
+                                 label_indices, scores)
+    example_scores = np.take_along_axis(scores, label_indices, axis=1)
+
+    output_md = self._explain_md.outputs[0]
+    explanations = []
+    for i, instance in enumerate(instances):
+      attrs = []
+      for j, label_index in enumerate(label_indices[i]):
+        label_name = None
+        if output_md.index_name_mapping:
+          label_name = output_md.index_name_mapping[label_index]
+        approx_error = None
+        if result.approx_errors is not None:
+          approx_error = float(result.approx_errors[i, j])
+        attrs.append(
+            attribution.Attribution(
+                output_name=output_md.name,
+                baseline_score=float(result.baseline_scores[i, j]),
+                example_score=float(example_scores[i, j]),
+                attrs_dict=self._to_attrs_dict(result.attributions, i, j),
+                label_index=(common_constants.SCALAR_OUTPUT_INDEX
+                             if self._model_fn.scalar_output else
+                             int(label_index)),
+                approx_error=approx_error,
+                label_name=label_name))
+      explanations.append(
+          explanation.Explanation(
+              attribution.LabelIndexToAttribution(attrs), instance,
+              self._modality_input_list_map))
+    return explanations
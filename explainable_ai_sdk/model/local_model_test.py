@@ -0,0 +1,179 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for local_model."""
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from explainable_ai_sdk.common import constants as common_constants
+from explainable_ai_sdk.model import configs
+from explainable_ai_sdk.model import local_model
+from explainable_ai_sdk.model import model_factory
+
+_WEIGHTS = np.array([[1.0, -2.0], [0.5, 3.0], [-1.0, 0.25]], dtype=np.float32)
+
+
+class _LinearModel(tf.Module):
+  """Two class scores that are linear in the three features of x."""
+
+  @tf.function(input_signature=[tf.TensorSpec([None, 3], tf.float32)])
+  def serve(self, x):
+    return {'scores': tf.matmul(x, _WEIGHTS)}
+
+
+class _QuadrantModel(tf.Module):
+  """Scores an image by the sum of its top left quadrant."""
+
+  @tf.function(input_signature=[tf.TensorSpec([None, 32, 32, 3], tf.float32)])
+  def serve(self, image):
+    return {'score': tf.reduce_sum(image[:, :16, :16, :], axis=[1, 2, 3])}
+
+
+def _save_model(module, path, metadata):
+  tf.saved_model.save(module, path, signatures={'serving_default': module.serve})
+  with open(os.path.join(path, 'explanation_metadata.json'), 'w') as f:
+    json.dump(metadata, f)
+  return path
+
+
+class LocalModelTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(LocalModelTest, self).setUp()
+    self._linear_path = _save_model(
+        _LinearModel(), os.path.join(self.get_temp_dir(), 'linear'), {
+            'inputs': {'x': {'input_tensor_name': 'x',
+                             'input_baselines': [[0.0, 1.0, 0.0]]}},
+            'outputs': {'scores': {'output_tensor_name': 'scores',
+                                   'index_name_mapping': ['cat', 'dog']}},
+            'framework': 'tensorflow2'
+        })
+    self._instances = [{'x': [1.0, 2.0, 3.0]}, {'x': [-1.0, 0.0, 2.0]}]
+
+  def _expected_attributions(self, instance, label_index):
+    return _WEIGHTS[:, label_index] * (np.array(instance['x']) -
+                                       np.array([0.0, 1.0, 0.0]))
+
+  def test_load_model_from_local_path(self):
+    model = model_factory.load_model_from_local_path(
+        self._linear_path, configs.IntegratedGradientsConfig(step_count=5))
+    self.assertIsInstance(model, local_model.LocalModel)
+
+  def test_predict(self):
+    model = local_model.LocalModel(self._linear_path,
+                                   configs.IntegratedGradientsConfig())
+    predictions = model.predict(self._instances)
+    self.assertAllClose(predictions, [[-1.0, 4.75], [-3.0, 2.5]])
+
+  def test_explain_integrated_gradients(self):
+    model = local_model.LocalModel(
+        self._linear_path, configs.IntegratedGradientsConfig(step_count=5))
+    explanations = model.explain(self._instances)
+
+    # Integrated gradients of a linear model are exact for any step count.
+    attr = explanations[0].get_attribution()
+    self.assertEqual(attr.label_index, 1)
+    self.assertEqual(attr.label_name, 'dog')
+    self.assertAlmostEqual(attr.example_score, 4.75)
+    self.assertAlmostEqual(attr.baseline_score, 3.0)
+    self.assertAllClose(attr.as_tensors()['x'],
+                        self._expected_attributions(self._instances[0], 1))
+    self.assertLess(attr.approx_error, 1e-5)
+
+  def test_explain_accepts_remote_call_arguments(self):
+    model = local_model.LocalModel(
+        self._linear_path, configs.IntegratedGradientsConfig(step_count=5))
+    explanations = model.explain(self._instances, timeout_ms=10,
+                                 deadline_ms=10)
+    self.assertLen(explanations, 2)
+
+  def test_explain_sampled_shapley(self):
+    model = local_model.LocalModel(
+        self._linear_path, configs.SampledShapleyConfig(path_count=3))
+    explanations = model.explain(
+        self._instances,
+        configs.AttributionParameters(label_indices=[0, 1],
+                                      baselines=[{'x': [1.0, 1.0, 1.0]}]))
+
+    # A single input is a single feature, credited with the whole difference.
+    for exp, instance in zip(explanations, self._instances):
+      self.assertCountEqual(exp.get_top_k_indices(None), [0, 1])
+      for label_index in (0, 1):
+        attr = exp.get_attribution(label_index)
+        self.assertAlmostEqual(
+            attr.feature_importance()['x'],
+            attr.example_score - attr.baseline_score)
+
+  def test_explain_sampled_shapley_per_feature(self):
+    path = os.path.join(self.get_temp_dir(), 'features')
+    _save_model(_LinearModel(), path, {
+        'inputs': {'x': {'input_tensor_name': 'x',
+                         'encoding': 'bag_of_features',
+                         'index_feature_mapping': ['a', 'b', 'c']}},
+        'outputs': {'scores': {'output_tensor_name': 'scores'}},
+        'framework': 'tensorflow2'
+    })
+    model = local_model.LocalModel(path,
+                                   configs.SampledShapleyConfig(path_count=2))
+    attr = model.explain(self._instances[:1])[0].get_attribution(1)
+
+    # Features of a linear model contribute the same in every order.
+    self.assertAllClose(
+        [attr.feature_importance()[name] for name in ('a', 'b', 'c')],
+        _WEIGHTS[:, 1] * np.array([1.0, 2.0, 3.0]))
+
+  def test_explain_scalar_output_with_xrai(self):
+    path = _save_model(
+        _QuadrantModel(), os.path.join(self.get_temp_dir(), 'quadrant'), {
+            'inputs': {'image': {'input_tensor_name': 'image',
+                                 'modality': 'image'}},
+            'outputs': {'score': {'output_tensor_name': 'score'}},
+            'framework': 'tensorflow2'
+        })
+    image = np.zeros((32, 32, 3), dtype=np.float32)
+    image[:16, :16] = 1.0
+    image[16:, 16:] = 0.5
+    model = local_model.LocalModel(path, configs.XraiConfig(step_count=2))
+    attr = model.explain([{'image': image.tolist()}])[0].get_attribution()
+
+    self.assertEqual(attr.label_index, common_constants.SCALAR_OUTPUT_INDEX)
+    region_attributions = attr.as_tensors()['image']
+    self.assertEqual(region_attributions.shape, (32, 32))
+    # The quadrant the score depends on is ranked above the rest.
+    self.assertGreater(region_attributions[:8, :8].min(),
+                       region_attributions[24:, 24:].max())
+
+  def test_baselines_required_for_non_numeric_inputs(self):
+    model = local_model.LocalModel(self._linear_path,
+                                   configs.IntegratedGradientsConfig())
+    model._explain_md.inputs[0].input_baselines = None
+    with self.assertRaisesRegex(ValueError, 'input_baselines'):
+      model._get_baselines({'x': np.array([['a', 'b', 'c']])}, None)
+
+  def test_explain_rejects_other_attribution_config(self):
+    model = local_model.LocalModel(self._linear_path,
+                                   configs.IntegratedGradientsConfig())
+    with self.assertRaises(ValueError):
+      model.explain(
+          self._instances,
+          configs.AttributionParameters(
+              attribution_config=configs.SampledShapleyConfig()))
+
+
+if __name__ == '__main__':
+  tf.test.main()
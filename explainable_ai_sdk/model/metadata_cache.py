@@ -0,0 +1,184 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Caches explanation metadata of AI Platform model versions.
+
+Loading a remote model takes a request to the version resource to find its
+deploymentUri and a read of explanation_metadata.json from GCS. MetadataCache
+keeps the result in memory and, optionally, on local disk so that other
+processes on the same machine can reuse it.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from absl import logging
+import tensorflow as tf
+
+from explainable_ai_sdk.common import explain_metadata
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import http_utils
+from explainable_ai_sdk.model import utils
+
+
+def _get_generation(metadata_uri):
+  """Returns a value that changes whenever the metadata file is rewritten."""
+  return tf.io.gfile.stat(metadata_uri).mtime_nsec
+
+
+def _read_file(metadata_uri):
+  with tf.io.gfile.GFile(metadata_uri, 'r') as f:
+    return f.read()
+
+
+class MetadataCache(object):
+  """Thread-safe memory and disk cache of explanation metadata.
+
+  Entries are keyed by the model endpoint (including the API endpoint it is
+  served from) and remember the metadata uri derived from the deploymentUri
+  of the version. A fresh entry (younger than ttl_secs) is returned without
+  any network call. When an entry expires and validation is enabled, the
+  version is looked up again and the metadata file is only re-read if the
+  deploymentUri or the file's generation changed.
+  """
+
+  def __init__(self,
+               cache_dir = None,
+               ttl_secs = constants.DEFAULT_METADATA_CACHE_TTL_SECS,
+               validate_generation = True):
+    """Creates a metadata cache.
+
+    Args:
+      cache_dir: Local directory to persist entries in. If None, entries are
+        only kept in memory.
+      ttl_secs: Seconds an entry is used without checking the service.
+      validate_generation: Whether expired entries are revalidated against the
+        generation of the metadata file instead of always re-reading it.
+    """
+    self._cache_dir = cache_dir
+    self._ttl_secs = ttl_secs
+    self._validate_generation = validate_generation
+    self._entries = {}
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._revalidations = 0
+    if cache_dir:
+      os.makedirs(cache_dir, exist_ok=True)
+
+  def stats(self):
+    """Returns a snapshot of the cache counters.
+
+    Returns:
+      A dict with the number of fresh hits, misses (metadata read from the
+      source) and expired entries that were revalidated without a re-read.
+    """
+    with self._lock:
+      return {
+          'hits': self._hits,
+          'misses': self._misses,
+          'revalidations': self._revalidations,
+      }
+
+  def _entry_path(self, key):
+    return os.path.join(self._cache_dir,
+                        hashlib.sha256(key.encode('utf-8')).hexdigest() +
+                        '.json')
+
+  def _load_entry(self, key):
+    """Returns the entry for the key from memory or disk, or None."""
+    with self._lock:
+      entry = self._entries.get(key)
+    if entry is not None or not self._cache_dir:
+      return entry
+    try:
+      with open(self._entry_path(key)) as f:
+        entry = json.load(f)
+    except (IOError, ValueError):
+      return None
+    if entry.get('key') != key:
+      return None
+    with self._lock:
+      self._entries[key] = entry
+    return entry
+
+  def _store_entry(self, key, entry):
+    """Stores the entry in memory and, if configured, on disk."""
+    with self._lock:
+      self._entries[key] = entry
+    if not self._cache_dir:
+      return
+    try:
+      utils.write_json_atomically(self._entry_path(key), entry)
+    except (IOError, OSError) as e:
+      logging.warning('Could not write metadata cache entry: %s', e)
+
+  def get(self, endpoint, fetch_metadata_uri_fn):
+    """Returns the explanation metadata of the given model endpoint.
+
+    Args:
+      endpoint: An AI Platform model endpoint (i.e.,
+        projects/<project_name>/models/<model_name>/versions/<version_name>).
+      fetch_metadata_uri_fn: Function without arguments that asks the service
+        for the uri of the explanation_metadata.json file of the endpoint.
+
+    Returns:
+      An ExplainMetadata object.
+    """
+    key = http_utils._get_ai_platform_uri(endpoint)  # pylint: disable=protected-access
+    entry = self._load_entry(key)
+    now = time.time()
+    if entry is not None and now - entry['fetched_at'] < self._ttl_secs:
+      with self._lock:
+        self._hits += 1
+      return explain_metadata.ExplainMetadata.from_json(entry['metadata'])
+
+    metadata_uri = fetch_metadata_uri_fn()
+    generation = None
+    if self._validate_generation:
+      generation = _get_generation(metadata_uri)
+      if (entry is not None and entry['metadata_uri'] == metadata_uri and
+          entry['generation'] == generation):
+        entry = dict(entry, fetched_at=now)
+        self._store_entry(key, entry)
+        with self._lock:
+          self._revalidations += 1
+        return explain_metadata.ExplainMetadata.from_json(entry['metadata'])
+
+    metadata = _read_file(metadata_uri)
+    self._store_entry(key, {
+        'key': key,
+        'metadata_uri': metadata_uri,
+        'metadata': metadata,
+        'generation': generation,
+        'fetched_at': now,
+    })
+    with self._lock:
+      self._misses += 1
+    return explain_metadata.ExplainMetadata.from_json(metadata)
+
+
+_default_metadata_cache = MetadataCache()
+
+
+def get_default_metadata_cache():
+  """Returns the in-memory metadata cache shared by the whole process.
+
+  Models use it unless they are given another cache. Its entries are used for
+  DEFAULT_METADATA_CACHE_TTL_SECS (10 minutes) before they are revalidated.
+  """
+  return _default_metadata_cache
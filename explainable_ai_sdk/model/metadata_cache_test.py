@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for metadata_cache."""
+import json
+import os
+
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import metadata_cache
+
+
+def _write_metadata(path, input_name):
+  with open(path, 'w') as f:
+    json.dump({
+        'inputs': {input_name: {'input_tensor_name': input_name + ':0'}},
+        'outputs': {'y': {'output_tensor_name': 'y:0'}},
+        'framework': 'tensorflow2'
+    }, f)
+
+
+class MetadataCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(MetadataCacheTest, self).setUp()
+    self._md_path = os.path.join(self.get_temp_dir(),
+                                 'explanation_metadata.json')
+    _write_metadata(self._md_path, 'x')
+    self._fetch_uri = mock.Mock(return_value=self._md_path)
+
+  def test_fresh_entry_skips_fetch(self):
+    cache = metadata_cache.MetadataCache()
+    md = cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    md_again = cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+
+    self.assertEqual(md.inputs[0].name, 'x')
+    self.assertEqual(md_again.inputs[0].name, 'x')
+    self.assertEqual(self._fetch_uri.call_count, 1)
+    self.assertEqual(cache.stats()['hits'], 1)
+    self.assertEqual(cache.stats()['misses'], 1)
+
+  def test_expired_entry_is_revalidated(self):
+    cache = metadata_cache.MetadataCache(ttl_secs=0)
+    cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    with mock.patch.object(metadata_cache, '_read_file') as mock_read:
+      md = cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    self.assertFalse(mock_read.called)
+    self.assertEqual(md.inputs[0].name, 'x')
+    self.assertEqual(cache.stats()['revalidations'], 1)
+
+  def test_changed_file_is_read_again(self):
+    cache = metadata_cache.MetadataCache(ttl_secs=0)
+    cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    _write_metadata(self._md_path, 'z')
+    stat = os.stat(self._md_path)
+    os.utime(self._md_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    md = cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    self.assertEqual(md.inputs[0].name, 'z')
+    self.assertEqual(cache.stats()['misses'], 2)
+
+  def test_disk_entries_are_shared(self):
+    cache_dir = os.path.join(self.get_temp_dir(), 'md_cache')
+    metadata_cache.MetadataCache(cache_dir=cache_dir).get(
+        'projects/p/models/m/versions/v', self._fetch_uri)
+
+    other_cache = metadata_cache.MetadataCache(cache_dir=cache_dir)
+    md = other_cache.get('projects/p/models/m/versions/v', self._fetch_uri)
+    self.assertEqual(md.inputs[0].name, 'x')
+    self.assertEqual(self._fetch_uri.call_count, 1)
+    self.assertEqual(other_cache.stats()['hits'], 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
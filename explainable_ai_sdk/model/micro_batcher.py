@@ -0,0 +1,233 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Micro-batching front end that merges concurrent explain calls.
+
+Online services often call explain() with a single instance from many threads
+at once. Each call pays the full per-request overhead. MicroBatchingModel
+collects the instances of concurrent calls for up to max_wait_ms, sends them
+as one explain request to the wrapped model and hands every caller the
+explanations of its own instances. While all batch slots are busy, calls keep
+joining the next batch, so batches grow with the load.
+"""
+from concurrent import futures
+import threading
+import time
+
+from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import model
+
+
+class _PendingCall(object):
+  """An explain call waiting to be sent as part of a batch."""
+
+  def __init__(self, instances, timeout_ms, deadline):
+    self.instances = instances
+    self.timeout_ms = timeout_ms
+    self.deadline = deadline
+    self.future = futures.Future()
+
+
+class MicroBatchingModel(model.Model):
+  """Model wrapper that batches concurrent explain calls together.
+
+  explain() keeps the signature and semantics of the wrapped model. Calls with
+  params are not merged, since batched instances share one request. predict()
+  is passed through unchanged.
+  """
+
+  def __init__(self,
+               wrapped_model,
+               max_batch_size = constants.DEFAULT_MICRO_BATCH_MAX_SIZE,
+               max_wait_ms = constants.DEFAULT_MICRO_BATCH_MAX_WAIT_MS,
+               max_concurrent_batches = (
+                   constants.DEFAULT_MAX_CONCURRENT_REQUESTS)):
+    """Creates the batching front end and starts its batching thread.
+
+    Args:
+      wrapped_model: The model to send batched explain calls to, e.g. an
+        AIPlatformModel.
+      max_batch_size: A batch is sent as soon as it holds this many instances.
+        A single call with more instances is sent on its own.
+      max_wait_ms: Maximum time the first call of a batch waits for other
+        calls to join it.
+      max_concurrent_batches: Maximum number of batches in flight at once.
+        The next batch is only taken once one of them completes.
+    """
+    self._model = wrapped_model
+    self._max_batch_size = max_batch_size
+    self._max_wait_secs = max_wait_ms / 1000.0
+    self._executor = futures.ThreadPoolExecutor(max_concurrent_batches)
+    self._batch_slots = threading.Semaphore(max_concurrent_batches)
+    self._condition = threading.Condition()
+    self._pending = []
+    self._closed = False
+    self._batches = 0
+    self._calls = 0
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stats(self):
+    """Returns the number of explain calls and of batches they were sent in."""
+    with self._condition:
+      return {'calls': self._calls, 'batches': self._batches}
+
+  def predict(self, instances, **kwargs):
+    """Calls predict of the wrapped model."""
+    return self._model.predict(instances, **kwargs)
+
+  def explain(self,
+              instances,
+              params = None,
+              timeout_ms = constants.DEFAULT_TIMEOUT,
+              deadline_ms = None):
+    """Explains instances, possibly in one request with concurrent calls.
+
+    Args:
+       instances: A list of instances for getting explanations.
+       params: Overridable parameters for the explain call. Calls with params
+         are sent on their own.
+       timeout_ms: Timeout for each service call to the api (in milliseconds).
+         A batch uses the largest timeout of the calls in it.
+       deadline_ms: Overall time budget of the call in milliseconds, including
+         the time spent waiting for a batch. A batch is sent with the latest
+         deadline of the calls in it. No deadline if None.
+
+    Returns:
+       A list of Explanation objects.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If the deadline passes before the
+        explanations of the call are available.
+      ValueError: When the explain request of the batch fails.
+    """
+    if params is not None or not instances:
+      return self._model.explain(
+          instances, params, timeout_ms=timeout_ms, deadline_ms=deadline_ms)
+    deadline = deadline_utils.Deadline.from_budget_ms(deadline_ms)
+    call = _PendingCall(instances, timeout_ms, deadline)
+    with self._condition:
+      if self._closed:
+        raise ValueError('explain() called on a closed MicroBatchingModel.')
+      self._pending.append(call)
+      self._calls += 1
+      self._condition.notify()
+    if deadline is None:
+      return call.future.result()
+    try:
+      return call.future.result(timeout=deadline.remaining_ms() / 1000.0)
+    except futures.TimeoutError:
+      deadline.check()
+      raise
+
+  def close(self):
+    """Sends the pending calls and stops the batching thread."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify()
+    self._thread.join()
+    self._executor.shutdown(wait=True)
+
+  def _take_batch(self):
+    """Waits for calls and returns the next batch, or None once closed."""
+    with self._condition:
+      while not self._pending:
+        if self._closed:
+          return None
+        self._condition.wait()
+      deadline = time.monotonic() + self._max_wait_secs
+      while not self._closed:
+        instance_count = sum(len(call.instances) for call in self._pending)
+        remaining = deadline - time.monotonic()
+        if instance_count >= self._max_batch_size or remaining <= 0:
+          break
+        self._condition.wait(remaining)
+
+      batch = []
+      instance_count = 0
+      while self._pending:
+        call = self._pending[0]
+        if batch and (instance_count + len(call.instances) >
+                      self._max_batch_size):
+          break
+        batch.append(self._pending.pop(0))
+        instance_count += len(call.instances)
+      self._batches += 1
+      return batch
+
+  def _run(self):
+    while True:
+      # Calls arriving while every slot is busy wait in _pending, where they
+      # join the next batch instead of queueing up as small batches.
+      self._batch_slots.acquire()
+      batch = self._take_batch()
+      if batch is None:
+        self._batch_slots.release()
+        return
+      self._executor.submit(self._send_batch, batch)
+
+  def _send_batch(self, batch):
+    """Sends one explain request for the batch and resolves its calls."""
+    try:
+      self._explain_batch(batch)
+    finally:
+      self._batch_slots.release()
+
+  def _explain_batch(self, batch):
+    """Explains the instances of a batch and resolves its calls."""
+    live_batch = []
+    for call in batch:
+      try:
+        if call.deadline is not None:
+          call.deadline.check()
+        live_batch.append(call)
+      except deadline_utils.DeadlineExceededError as e:
+        # The caller already gave up on it.
+        call.future.set_exception(e)
+    batch = live_batch
+    if not batch:
+      return
+    instances = []
+    for call in batch:
+      instances.extend(call.instances)
+    timeout_ms = max(call.timeout_ms for call in batch)
+    deadline_ms = None
+    if all(call.deadline is not None for call in batch):
+      deadline_ms = max(call.deadline.remaining_ms() for call in batch)
+    try:
+      explanations = self._model.explain(
+          instances, timeout_ms=timeout_ms, deadline_ms=deadline_ms)
+      error = None
+    except ai_platform_model.ChunkedExplainError as e:
+      # Callers whose instances were all explained still get their results.
+      explanations = e.explanations
+      error = e
+    except Exception as e:  # pylint: disable=broad-except
+      for call in batch:
+        call.future.set_exception(e)
+      return
+
+    start = 0
+    for call in batch:
+      end = start + len(call.instances)
+      call_explanations = explanations[start:end]
+      if error is not None and any(exp is None for exp in call_explanations):
+        call.future.set_exception(error)
+      else:
+        call.future.set_result(call_explanations)
+      start = end
@@ -0,0 +1,170 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for micro_batcher."""
+from concurrent import futures
+import threading
+import time
+
+import mock
+import tensorflow.compat.v1 as tf
+from explainable_ai_sdk.model import ai_platform_model
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import micro_batcher
+
+
+class _FakeModel(object):
+  """Explains every instance as its own 'input' value."""
+
+  def __init__(self, fail_index=None, release_event=None):
+    self.calls = []
+    self.started = threading.Event()
+    self._fail_index = fail_index
+    self._release_event = release_event
+    self._lock = threading.Lock()
+
+  def predict(self, instances, **kwargs):
+    return {'predictions': [i['input'] for i in instances]}
+
+  def explain(self, instances, params=None, timeout_ms=None, deadline_ms=None):
+    with self._lock:
+      self.calls.append((list(instances), params, timeout_ms, deadline_ms))
+    self.started.set()
+    if self._release_event is not None:
+      self._release_event.wait()
+    explanations = [i['input'] for i in instances]
+    if self._fail_index is not None:
+      explanations[self._fail_index] = None
+      raise ai_platform_model.ChunkedExplainError(
+          explanations, [(self._fail_index, self._fail_index + 1, ValueError('boom'))])
+    return explanations
+
+
+class MicroBatchingModelTest(tf.test.TestCase):
+
+  def _explain_concurrently(self, batching_model, count):
+    barrier = threading.Barrier(count)
+
+    def explain(i):
+      barrier.wait()
+      return batching_model.explain([{'input': i}])
+
+    with futures.ThreadPoolExecutor(count) as executor:
+      return list(executor.map(explain, range(count)))
+
+  def test_concurrent_calls_are_merged(self):
+    fake_model = _FakeModel()
+    batching_model = micro_batcher.MicroBatchingModel(
+        fake_model, max_batch_size=8, max_wait_ms=1000)
+
+    results = self._explain_concurrently(batching_model, 8)
+    batching_model.close()
+
+    self.assertEqual(results, [[i] for i in range(8)])
+    self.assertLen(fake_model.calls, 1)
+    self.assertLen(fake_model.calls[0][0], 8)
+    self.assertEqual(batching_model.stats(), {'calls': 8, 'batches': 1})
+
+  def test_batches_are_capped_at_max_batch_size(self):
+    fake_model = _FakeModel()
+    batching_model = micro_batcher.MicroBatchingModel(
+        fake_model, max_batch_size=3, max_wait_ms=200)
+
+    results = self._explain_concurrently(batching_model, 7)
+    batching_model.close()
+
+    self.assertEqual(results, [[i] for i in range(7)])
+    self.assertTrue(all(len(call[0]) <= 3 for call in fake_model.calls))
+    self.assertGreaterEqual(len(fake_model.calls), 3)
+
+  def test_calls_join_next_batch_while_slots_are_busy(self):
+    release_event = threading.Event()
+    fake_model = _FakeModel(release_event=release_event)
+    batching_model = micro_batcher.MicroBatchingModel(
+        fake_model, max_batch_size=8, max_wait_ms=0, max_concurrent_batches=1)
+
+    with futures.ThreadPoolExecutor(6) as executor:
+      first = executor.submit(batching_model.explain, [{'input': 0}])
+      fake_model.started.wait()
+      later = [
+          executor.submit(batching_model.explain, [{'input': i}])
+          for i in range(1, 6)
+      ]
+      while batching_model.stats()['calls'] < 6:
+        time.sleep(0.01)
+      release_event.set()
+      results = [first.result()] + [future.result() for future in later]
+    batching_model.close()
+
+    self.assertEqual(results, [[i] for i in range(6)])
+    self.assertEqual([len(call[0]) for call in fake_model.calls], [1, 5])
+
+  def test_deadline(self):
+    release_event = threading.Event()
+    fake_model = _FakeModel(release_event=release_event)
+    batching_model = micro_batcher.MicroBatchingModel(
+        fake_model, max_wait_ms=0)
+
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      batching_model.explain([{'input': 1}], deadline_ms=50)
+    release_event.set()
+    batching_model.close()
+
+    self.assertLess(fake_model.calls[0][3], 50)
+
+  def test_call_with_params_is_not_batched(self):
+    fake_model = _FakeModel()
+    batching_model = micro_batcher.MicroBatchingModel(fake_model)
+    params = mock.Mock()
+
+    result = batching_model.explain([{'input': 1}], params, timeout_ms=10)
+    batching_model.close()
+
+    self.assertEqual(result, [1])
+    self.assertEqual(fake_model.calls, [([{'input': 1}], params, 10, None)])
+    self.assertEqual(batching_model.stats(), {'calls': 0, 'batches': 0})
+
+  def test_failed_chunk_only_fails_its_callers(self):
+    fake_model = _FakeModel(fail_index=1)
+    batching_model = micro_batcher.MicroBatchingModel(
+        fake_model, max_batch_size=3, max_wait_ms=1000)
+    barrier = threading.Barrier(2)
+    instances = [[{'input': 0}], [{'input': 1}, {'input': 2}]]
+
+    def explain(call_instances):
+      barrier.wait()
+      try:
+        return batching_model.explain(call_instances)
+      except ValueError as e:
+        return e
+
+    with futures.ThreadPoolExecutor(2) as executor:
+      results = list(executor.map(explain, instances))
+    batching_model.close()
+
+    self.assertLen(fake_model.calls, 1)
+    self.assertEqual(results[0], [0])
+    self.assertIsInstance(results[1], ai_platform_model.ChunkedExplainError)
+
+  def test_closed_model_rejects_calls(self):
+    batching_model = micro_batcher.MicroBatchingModel(_FakeModel())
+    batching_model.close()
+
+    with self.assertRaisesRegex(ValueError, 'closed'):
+      batching_model.explain([{'input': 1}])
+
+
+if __name__ == '__main__':
+  tf.test.main()
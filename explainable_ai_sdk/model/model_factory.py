@@ -33,7 +33,8 @@ def load_model_from_ai_platform(
     project,
     model,
     version = None,
-    credentials = None
+    credentials = None,
+    **kwargs
 ):
   """Loads a model from Cloud AI Platform.
 
@@ -43,6 +44,8 @@ def load_model_from_ai_platform(
     version: a version of the given model. If not given, it will load the
       default version for the model.
     credentials: The OAuth2.0 credentials to use for GCP services.
+    **kwargs: Additional arguments passed to the registered remote model class
+      (e.g., metadata_cache for AIPlatformModel).
 
   Returns:
      A model object
@@ -55,16 +58,19 @@ def load_model_from_ai_platform(
   endpoint = os.path.join('projects', project, 'models', model)
   if version:
     endpoint = os.path.join(endpoint, 'versions', version)
-  return _MODEL_REGISTRY[_REMOTE_MODEL_KEY](endpoint, credentials)
+  return _MODEL_REGISTRY[_REMOTE_MODEL_KEY](endpoint, credentials, **kwargs)
 
 
 def load_model_from_local_path(
-    model_path, config):
+    model_path, config,
+    **kwargs):
   """Loads a model based on a local model's path and attribution config.
 
   Args:
     model_path: A path that contains a saved model.
     config: Configuration parameters for attribution method.
+    **kwargs: Additional arguments passed to the registered local model class
+      (e.g., max_batch_bytes for LocalModel).
 
   Returns:
      A model object.
@@ -74,7 +80,7 @@ def load_model_from_local_path(
   """
   if _LOCAL_MODEL_KEY not in _MODEL_REGISTRY:
     raise NotImplementedError('There are no implementations of local model.')
-  return _MODEL_REGISTRY[_LOCAL_MODEL_KEY](model_path, config)
+  return _MODEL_REGISTRY[_LOCAL_MODEL_KEY](model_path, config, **kwargs)
 
 
 def register_remote_model(registered_class):
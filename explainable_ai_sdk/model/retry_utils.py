@@ -0,0 +1,189 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Retry policy and retry budget for requests to AI Platform."""
+import dataclasses
+import email.utils
+import random
+import threading
+import time
+from typing import Tuple
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+  """Configuration of retries for transient request failures.
+
+  Attributes:
+    max_attempts: Maximum number of attempts per request, including the first
+      one. 1 disables retries.
+    retryable_status_codes: HTTP status codes that are retried.
+    retry_on_connection_errors: Whether connection errors and timeouts are
+      retried. Predict and explain requests have no side effects, so this is
+      safe for both GET and POST requests.
+    initial_backoff_secs: Backoff before the first retry.
+    max_backoff_secs: Upper bound of the backoff between attempts.
+    backoff_multiplier: Factor the backoff grows by after each attempt.
+    jitter: If True, sleep a uniformly random time between 0 and the backoff
+      ("full jitter") so that clients failing together don't retry together.
+    honor_retry_after: Whether to wait as long as a Retry-After response header
+      asks for, up to max_retry_after_secs, instead of the computed backoff.
+    max_retry_after_secs: Upper bound of the wait taken from Retry-After.
+  """
+  max_attempts: int = 3
+  retryable_status_codes: Tuple[int, ...] = (429, 500, 502, 503, 504)
+  retry_on_connection_errors: bool = True
+  initial_backoff_secs: float = 0.5
+  max_backoff_secs: float = 30.0
+  backoff_multiplier: float = 2.0
+  jitter: bool = True
+  honor_retry_after: bool = True
+  max_retry_after_secs: float = 60.0
+
+  def is_retryable_status(self, status_code):
+    return status_code in self.retryable_status_codes
+
+  def backoff_secs(self, retry_number,
+                   retry_after = None):
+    """Returns how long to wait before the given retry.
+
+    Args:
+      retry_number: 1 for the first retry, 2 for the second and so on.
+      retry_after: Value of the Retry-After header of the failed response, if
+        any. Both delay-seconds and HTTP-date formats are accepted.
+
+    Returns:
+      The number of seconds to sleep.
+    """
+    if self.honor_retry_after and retry_after:
+      retry_after_secs = _parse_retry_after(retry_after)
+      if retry_after_secs is not None:
+        return min(retry_after_secs, self.max_retry_after_secs)
+    backoff = min(
+        self.max_backoff_secs,
+        self.initial_backoff_secs * self.backoff_multiplier**(retry_number - 1))
+    if self.jitter:
+      backoff = random.uniform(0, backoff)
+    return backoff
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+NO_RETRY_POLICY = RetryPolicy(max_attempts=1)
+
+
+def _parse_retry_after(retry_after):
+  """Parses a Retry-After header value into seconds, or None if invalid."""
+  try:
+    return max(0.0, float(retry_after))
+  except ValueError:
+    pass
+  try:
+    retry_at = email.utils.parsedate_to_datetime(retry_after)
+  except (TypeError, ValueError):
+    return None
+  if retry_at is None:
+    return None
+  return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryBudget(object):
+  """Limits retries to a fraction of requests to avoid retry storms.
+
+  The budget is a token bucket: every request deposits retry_ratio tokens, up
+  to max_tokens, and every retry withdraws one. When a backend is down, this
+  caps retries at roughly retry_ratio times the request rate instead of
+  multiplying the load by max_attempts. The budget is thread-safe and can be
+  shared by all transports in a process.
+  """
+
+  def __init__(self, retry_ratio = 0.2, max_tokens = 20.0):
+    """Creates a retry budget.
+
+    Args:
+      retry_ratio: Number of retries earned per request.
+      max_tokens: Maximum number of retries that can be saved up. The bucket
+        starts full so that retries work right away.
+    """
+    self._retry_ratio = retry_ratio
+    self._max_tokens = max_tokens
+    self._tokens = max_tokens
+    self._lock = threading.Lock()
+    self._requests = 0
+    self._retries = 0
+    self._budget_exhausted = 0
+    self._attempts_exhausted = 0
+
+  def record_request(self):
+    """Records a new request (not a retry) and earns retry tokens."""
+    with self._lock:
+      self._requests += 1
+      self._tokens = min(self._max_tokens, self._tokens + self._retry_ratio)
+
+  def try_acquire_retry(self):
+    """Returns whether a retry is allowed, consuming a token if so."""
+    with self._lock:
+      if self._tokens < 1:
+        self._budget_exhausted += 1
+        return False
+      self._tokens -= 1
+      self._retries += 1
+      return True
+
+  def record_attempts_exhausted(self):
+    """Records a request that failed after its last allowed attempt."""
+    with self._lock:
+      self._attempts_exhausted += 1
+
+  def stats(self):
+    """Returns a snapshot of the retry counters.
+
+    Returns:
+      A dict with the number of requests, retries, retries denied because the
+      budget was empty, requests that ran out of attempts, and the tokens left.
+    """
+    with self._lock:
+      return {
+          'requests': self._requests,
+          'retries': self._retries,
+          'budget_exhausted': self._budget_exhausted,
+          'attempts_exhausted': self._attempts_exhausted,
+          'tokens': self._tokens,
+      }
+
+
+_default_retry_budget = RetryBudget()
+
+
+def get_default_retry_budget():
+  """Returns the retry budget shared by transports that don't set their own."""
+  return _default_retry_budget
+
+
+def should_retry(policy, budget, attempt):
+  """Decides whether a failed attempt is retried.
+
+  Args:
+    policy: The RetryPolicy of the request.
+    budget: The RetryBudget to draw the retry from.
+    attempt: Number of the attempt that failed, starting at 1.
+
+  Returns:
+    True if the request should be attempted again.
+  """
+  if attempt >= policy.max_attempts:
+    if policy.max_attempts > 1:
+      budget.record_attempts_exhausted()
+    return False
+  return budget.try_acquire_retry()
@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for retry_utils."""
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import retry_utils
+
+
+class RetryPolicyTest(tf.test.TestCase):
+
+  def test_backoff_grows_exponentially_up_to_max(self):
+    policy = retry_utils.RetryPolicy(
+        initial_backoff_secs=1, max_backoff_secs=5, jitter=False)
+    self.assertEqual(
+        [policy.backoff_secs(n) for n in range(1, 5)], [1, 2, 4, 5])
+
+  def test_backoff_with_jitter_stays_below_backoff(self):
+    policy = retry_utils.RetryPolicy(initial_backoff_secs=1)
+    for _ in range(20):
+      self.assertBetween(policy.backoff_secs(2), 0, 2)
+
+  def test_backoff_honors_retry_after(self):
+    policy = retry_utils.RetryPolicy(max_retry_after_secs=10)
+    self.assertEqual(policy.backoff_secs(1, '3'), 3)
+    self.assertEqual(policy.backoff_secs(1, '120'), 10)
+    self.assertEqual(
+        policy.backoff_secs(1, 'Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+  def test_backoff_ignores_invalid_retry_after(self):
+    policy = retry_utils.RetryPolicy(initial_backoff_secs=1, jitter=False)
+    self.assertEqual(policy.backoff_secs(1, 'soon'), 1)
+
+
+class RetryBudgetTest(tf.test.TestCase):
+
+  def test_budget_limits_retries(self):
+    budget = retry_utils.RetryBudget(retry_ratio=0.5, max_tokens=2)
+    self.assertTrue(budget.try_acquire_retry())
+    self.assertTrue(budget.try_acquire_retry())
+    self.assertFalse(budget.try_acquire_retry())
+
+    budget.record_request()
+    budget.record_request()
+    self.assertTrue(budget.try_acquire_retry())
+
+    stats = budget.stats()
+    self.assertEqual(stats['requests'], 2)
+    self.assertEqual(stats['retries'], 3)
+    self.assertEqual(stats['budget_exhausted'], 1)
+
+  def test_should_retry_stops_at_max_attempts(self):
+    policy = retry_utils.RetryPolicy(max_attempts=2)
+    budget = retry_utils.RetryBudget()
+    self.assertTrue(retry_utils.should_retry(policy, budget, 1))
+    self.assertFalse(retry_utils.should_retry(policy, budget, 2))
+    self.assertEqual(budget.stats()['attempts_exhausted'], 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
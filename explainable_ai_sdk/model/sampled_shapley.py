@@ -0,0 +1,291 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Sampled Shapley attributions computed in-process.
+
+Sampled Shapley approximates the Shapley values of the features by sampling
+random orders (paths) in which features are switched from their baseline to
+their instance values. The attribution of a feature is its average marginal
+contribution to the model score when it is switched. Features are whole
+inputs, except for inputs listed as feature_inputs, whose last dimension holds
+one feature per index (e.g., bag of features encodings).
+
+The prefixes of all paths of all instances and baselines are described by one
+boolean matrix with a row per evaluated point and a column per feature, set
+where the feature takes its instance value. The matrix is split into
+sub-batches that fit max_batch_bytes, and marginal contributions are
+accumulated with NumPy. The all-baseline and all-instance points shared by the
+paths of an instance and baseline are evaluated once.
+"""
+import numpy as np
+
+from explainable_ai_sdk.common import utils as common_utils
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import utils
+
+
+def get_features(inputs, baseline, feature_inputs):
+  """Returns the features that can be switched between baseline and instance.
+
+  Args:
+    inputs: Dictionary from input name to a batch of instance values.
+    baseline: Dictionary from input name to baseline values. Inputs without a
+      baseline are not attributed.
+    feature_inputs: Names of inputs with one feature per index of their last
+      dimension.
+
+  Returns:
+    A list of (input name, index) pairs, with None as the index of features
+    that are whole inputs.
+  """
+  features = []
+  for name in inputs:
+    if name not in baseline:
+      continue
+    if name in feature_inputs:
+      features.extend((name, idx) for idx in range(inputs[name].shape[-1]))
+    else:
+      features.append((name, None))
+  return features
+
+
+def get_orders(rng, shape, feature_count,
+               antithetic):
+  """Samples feature orders.
+
+  Args:
+    rng: A np.random.RandomState.
+    shape: Leading shape of the returned orders; its last dimension is the
+      number of paths.
+    feature_count: Number of features to order.
+    antithetic: Whether every second path reverses the path before it, so
+      that features early in one path are late in the other. This lowers the
+      variance of the estimate for the same number of paths.
+
+  Returns:
+    An integer array of shape shape + [feature_count] with a permutation of
+    the features per path.
+  """
+  orders = rng.rand(*shape, feature_count).argsort(axis=-1)
+  if antithetic:
+    orders[..., 1::2, :] = orders[..., :shape[-1] - 1:2, ::-1]
+  return orders
+
+
+def mask_inputs(inputs, stacked_baselines,
+                feature_columns, instance_rows,
+                baseline_rows, masks):
+  """Returns the model inputs of rows of the mask matrix.
+
+  Args:
+    inputs: Dictionary from input name to a batch of instance values.
+    stacked_baselines: Dictionary from input name to baselines [baselines,
+      ...] of the attributed inputs.
+    feature_columns: Dictionary from attributed input name to the mask column
+      of the input, or to the list of columns of its features.
+    instance_rows: Array with the instance of each row.
+    baseline_rows: Array with the baseline of each row.
+    masks: Boolean array [rows, features], set where a feature takes its
+      instance value.
+
+  Returns:
+    Dictionary from input name to a batch of values, one per row.
+  """
+  masked = {}
+  for name, value in inputs.items():
+    instance_values = value[instance_rows]
+    if name not in feature_columns:
+      masked[name] = instance_values
+      continue
+    columns = feature_columns[name]
+    if isinstance(columns, list):
+      mask = masks[:, columns].reshape(
+          (len(masks),) + (1,) * (value.ndim - 2) + (len(columns),))
+    else:
+      mask = masks[:, columns].reshape((len(masks),) + (1,) * (value.ndim - 1))
+    masked[name] = np.where(mask, instance_values,
+                            stacked_baselines[name][baseline_rows])
+  return masked
+
+
+def _to_attributions(feature_values, features, inputs, label_count):
+  """Arranges per-feature values as attributions of shape [n, labels, ...]."""
+  instance_count = feature_values.shape[0]
+  attributions = {}
+  for f, (name, idx) in enumerate(features):
+    if idx is None:
+      attributions[name] = feature_values[:, f]
+    else:
+      if name not in attributions:
+        attributions[name] = np.zeros(
+            (instance_count, label_count, inputs[name].shape[-1]))
+      attributions[name][:, :, idx] = feature_values[:, f]
+  return attributions
+
+
+class SampledShapley(object):
+  """Explains the outputs of a model function with Sampled Shapley."""
+
+  def __init__(self,
+               path_count = 10,
+               feature_inputs = (),
+               seed = 0,
+               antithetic = False,
+               max_batch_bytes = constants.DEFAULT_LOCAL_MAX_BATCH_BYTES):
+    """Creates the explainer.
+
+    Args:
+      path_count: Number of random feature orders sampled per baseline.
+      feature_inputs: Names of inputs with one feature per index of their last
+        dimension.
+      seed: Seed of the random feature orders, so that explaining the same
+        instances again gives the same attributions.
+      antithetic: Whether every second order is the reverse of the one before
+        it.
+      max_batch_bytes: Memory budget of the inputs of one model call.
+
+    Raises:
+      ValueError: If path_count is not positive.
+    """
+    if path_count <= 0:
+      raise ValueError('path_count must be positive.')
+    self._path_count = path_count
+    self._feature_inputs = frozenset(feature_inputs)
+    self._seed = seed
+    self._antithetic = antithetic
+    self._max_batch_bytes = max_batch_bytes
+
+  def _evaluate(self, model_fn, inputs,
+                stacked_baselines,
+                feature_columns, row_feed):
+    """Returns the scores of all rows of the mask matrix."""
+    row_bytes = sum(value[0].nbytes for value in inputs.values())
+    max_batch_size = max(1, int(self._max_batch_bytes // max(row_bytes, 1)))
+    scores = [
+        model_fn.scores(
+            mask_inputs(inputs, stacked_baselines, feature_columns,
+                        rows['instance'], rows['baseline'], rows['mask']))
+        for rows in common_utils.split_feeds(row_feed, [], {}, max_batch_size)
+    ]
+    return np.concatenate(scores)
+
+  def attribute(self, model_fn, inputs,
+                baselines,
+                label_indices,
+                scores = None):
+    """Computes attributions of the given labels of each instance.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      baselines: A list of dictionaries from input name to baseline values
+        without the batch dimension. Attributions are averaged over baselines.
+      label_indices: Array of shape [instances, labels] with the output
+        indices to explain for each instance.
+      scores: Unused. The scores of the instances are evaluated along with the
+        paths. Accepted so that all explainers can be called alike.
+
+    Returns:
+      A utils.AttributionResult. Whole-input features have attributions of
+      shape [instances, labels].
+
+    Raises:
+      ValueError: If no input has a baseline, so there is no feature to
+        attribute.
+    """
+    features = get_features(inputs, baselines[0], self._feature_inputs)
+    if not features:
+      raise ValueError('There are no features to attribute. Sampled Shapley '
+                       'only attributes inputs that have a baseline.')
+    feature_columns = {}
+    for f, (name, idx) in enumerate(features):
+      if idx is None:
+        feature_columns[name] = f
+      else:
+        feature_columns.setdefault(name, []).append(f)
+    stacked_baselines = {
+        name: np.stack([
+            np.asarray(baseline[name], dtype=inputs[name].dtype)
+            for baseline in baselines
+        ]) for name in feature_columns
+    }
+    instance_count, label_count = label_indices.shape
+    baseline_count = len(baselines)
+    path_count = self._path_count
+    feature_count = len(features)
+
+    orders = get_orders(
+        np.random.RandomState(self._seed),
+        (instance_count, baseline_count, path_count), feature_count,
+        self._antithetic)
+    # Row k of a path has its first k features switched. Rows 0 and
+    # feature_count are the same for all paths, so only the rows in between
+    # are evaluated per path.
+    ranks = orders.argsort(axis=-1)
+    interior_masks = (ranks[..., np.newaxis, :] < np.arange(
+        1, feature_count).reshape(-1, 1))
+    instances, baseline_ids = np.meshgrid(
+        np.arange(instance_count), np.arange(baseline_count), indexing='ij')
+    end_masks = np.zeros((instance_count, baseline_count, 2, feature_count),
+                         dtype=bool)
+    end_masks[:, :, 1] = True
+    interior_count = path_count * (feature_count - 1)
+    row_feed = {
+        'instance': np.concatenate([
+            instances.ravel().repeat(2),
+            instances.ravel().repeat(interior_count)
+        ]),
+        'baseline': np.concatenate([
+            baseline_ids.ravel().repeat(2),
+            baseline_ids.ravel().repeat(interior_count)
+        ]),
+        'mask': np.concatenate([
+            end_masks.reshape(-1, feature_count),
+            interior_masks.reshape(-1, feature_count)
+        ]),
+    }
+    scores = self._evaluate(model_fn, inputs, stacked_baselines,
+                            feature_columns, row_feed)
+
+    # Scores of the explained labels, [instances, baselines, rows, labels].
+    label_indices = label_indices[:, np.newaxis, np.newaxis]
+    output_count = scores.shape[-1]
+    end_row_count = 2 * instance_count * baseline_count
+    end_scores = np.take_along_axis(
+        scores[:end_row_count].reshape(instance_count, baseline_count, 2,
+                                       output_count),
+        label_indices, axis=3)
+    interior_scores = np.take_along_axis(
+        scores[end_row_count:].reshape(instance_count, baseline_count,
+                                       interior_count, output_count),
+        label_indices, axis=3).reshape(instance_count, baseline_count,
+                                       path_count, feature_count - 1,
+                                       label_count)
+    path_scores = np.concatenate([
+        np.broadcast_to(end_scores[:, :, np.newaxis, :1],
+                        (instance_count, baseline_count, path_count, 1,
+                         label_count)), interior_scores,
+        np.broadcast_to(end_scores[:, :, np.newaxis, 1:],
+                        (instance_count, baseline_count, path_count, 1,
+                         label_count))
+    ], axis=3)
+    # The contribution of a feature is the score change at its rank.
+    contributions = np.take_along_axis(
+        np.diff(path_scores, axis=3), ranks[..., np.newaxis], axis=3)
+    feature_values = contributions.mean(axis=(1, 2))
+    baseline_scores = end_scores[:, :, 0].mean(axis=1)
+    return utils.AttributionResult(
+        _to_attributions(feature_values, features, inputs, label_count),
+        baseline_scores, None)
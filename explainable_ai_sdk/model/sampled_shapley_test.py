@@ -0,0 +1,117 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for sampled_shapley."""
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import sampled_shapley
+
+
+class _InteractionModelFunction(object):
+  """Scores x[0] * x[1] + x[2] * sum(tags) as label 0 and -x[2] as label 1."""
+
+  def __init__(self):
+    self.batch_sizes = []
+
+  def scores(self, inputs):
+    x = inputs['x']
+    self.batch_sizes.append(len(x))
+    return np.stack([
+        x[:, 0] * x[:, 1] + x[:, 2] * inputs['tags'].sum(axis=1), -x[:, 2]
+    ], axis=1)
+
+
+class SampledShapleyTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(SampledShapleyTest, self).setUp()
+    self._inputs = {
+        'x': np.array([[2.0, 3.0, 1.0], [1.0, -1.0, 2.0]]),
+        'tags': np.array([[1.0, 1.0], [0.0, 1.0]]),
+    }
+    self._baselines = [{'x': np.zeros(3), 'tags': np.zeros(2)}]
+    self._label_indices = np.array([[0, 1], [0, 1]])
+
+  def test_get_orders(self):
+    rng = np.random.RandomState(0)
+    orders = sampled_shapley.get_orders(rng, (2, 5), 4, antithetic=True)
+    self.assertAllEqual(np.sort(orders, axis=-1),
+                        np.broadcast_to(np.arange(4), (2, 5, 4)))
+    self.assertAllEqual(orders[:, 1::2], orders[:, 0:4:2, ::-1])
+
+  def test_attribute_without_features(self):
+    explainer = sampled_shapley.SampledShapley(path_count=3)
+    with self.assertRaisesRegex(ValueError, 'no features'):
+      explainer.attribute(_InteractionModelFunction(), self._inputs, [{}],
+                          self._label_indices)
+
+  def test_attribute_is_efficient(self):
+    model_fn = _InteractionModelFunction()
+    explainer = sampled_shapley.SampledShapley(
+        path_count=3, feature_inputs=['x', 'tags'])
+    result = explainer.attribute(model_fn, self._inputs, self._baselines,
+                                 self._label_indices)
+
+    self.assertEqual(result.attributions['x'].shape, (2, 2, 3))
+    self.assertEqual(result.attributions['tags'].shape, (2, 2, 2))
+    self.assertAllClose(result.baseline_scores, np.zeros((2, 2)))
+    scores = model_fn.scores(self._inputs)
+    totals = (result.attributions['x'].sum(axis=-1) +
+              result.attributions['tags'].sum(axis=-1))
+    self.assertAllClose(totals, scores[:, [0, 1]])
+    # The tags do not change label 1.
+    self.assertAllClose(result.attributions['tags'][:, 1], np.zeros((2, 2)))
+    self.assertIsNone(result.approx_errors)
+
+  def test_antithetic_orders_are_exact_for_pairwise_interactions(self):
+    inputs = {'x': np.array([[2.0, 3.0, 0.0]]), 'tags': np.zeros((1, 2))}
+    for seed in range(3):
+      model_fn = _InteractionModelFunction()
+      explainer = sampled_shapley.SampledShapley(
+          path_count=2,
+          feature_inputs=['x', 'tags'],
+          seed=seed,
+          antithetic=True)
+      result = explainer.attribute(model_fn, inputs, self._baselines,
+                                   np.array([[0]]))
+      # Every pair of features appears in both orders, so x[0] and x[1] share
+      # their interaction equally.
+      self.assertAllClose(result.attributions['x'], [[[3.0, 3.0, 0.0]]])
+      self.assertAllClose(result.attributions['tags'], [[[0.0, 0.0]]])
+
+  def test_splits_rows_into_batches(self):
+    model_fn = _InteractionModelFunction()
+    expected = sampled_shapley.SampledShapley(
+        path_count=4, feature_inputs=['x', 'tags']).attribute(
+            model_fn, self._inputs, self._baselines, self._label_indices)
+    # 2 shared end points and 4 paths of 4 interior points per instance.
+    self.assertEqual(model_fn.batch_sizes, [36])
+
+    model_fn = _InteractionModelFunction()
+    row_bytes = 5 * 8
+    result = sampled_shapley.SampledShapley(
+        path_count=4, feature_inputs=['x', 'tags'],
+        max_batch_bytes=10 * row_bytes).attribute(model_fn, self._inputs,
+                                                  self._baselines,
+                                                  self._label_indices)
+    self.assertEqual(model_fn.batch_sizes, [10, 10, 10, 6])
+    for name in expected.attributions:
+      self.assertAllClose(result.attributions[name],
+                          expected.attributions[name])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,303 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Client-side rate limiting and adaptive concurrency for AI Platform.
+
+Both limiters are thread-safe. Share one instance between the transports of
+all workers of a process to keep their combined traffic under the quota.
+"""
+import threading
+import time
+
+from explainable_ai_sdk.model import deadline_utils
+
+_THROTTLED_STATUS_CODES = (429, 503)
+
+
+class _TokenBucket(object):
+  """A token bucket that lets callers go into debt and wait it off."""
+
+  def __init__(self, rate, capacity):
+    self._rate = rate
+    self._capacity = capacity
+    self._tokens = capacity
+    self._updated_at = time.monotonic()
+
+  def reserve(self, count, now):
+    """Takes count tokens and returns the seconds to wait before using them."""
+    self._tokens = min(self._capacity,
+                       self._tokens + (now - self._updated_at) * self._rate)
+    self._updated_at = now
+    self._tokens -= count
+    if self._tokens >= 0:
+      return 0.0
+    return -self._tokens / self._rate
+
+  def refund(self, count):
+    """Gives back tokens reserved for a request that will not be sent."""
+    self._tokens += count
+
+
+class RateLimiter(object):
+  """Limits the rate of requests and of instances sent in them.
+
+  Each limit is a token bucket that holds up to burst_secs worth of its rate,
+  so short bursts go through at once while the average rate stays under the
+  limit. A request larger than a bucket waits until the bucket has refilled
+  enough to pay for it.
+  """
+
+  def __init__(self,
+               requests_per_sec = None,
+               instances_per_sec = None,
+               burst_secs = 1.0):
+    """Creates a rate limiter.
+
+    Args:
+      requests_per_sec: Maximum average number of requests per second. No
+        limit if None.
+      instances_per_sec: Maximum average number of instances per second, over
+        all requests. No limit if None.
+      burst_secs: Seconds worth of each rate that can be sent in a burst.
+
+    Raises:
+      ValueError: If a rate or burst_secs is not positive.
+    """
+    for name, value in (('requests_per_sec', requests_per_sec),
+                        ('instances_per_sec', instances_per_sec),
+                        ('burst_secs', burst_secs)):
+      if value is not None and value <= 0:
+        raise ValueError('{} must be positive.'.format(name))
+    self._request_bucket = None
+    self._instance_bucket = None
+    if requests_per_sec is not None:
+      self._request_bucket = _TokenBucket(
+          requests_per_sec, max(1.0, requests_per_sec * burst_secs))
+    if instances_per_sec is not None:
+      self._instance_bucket = _TokenBucket(
+          instances_per_sec, max(1.0, instances_per_sec * burst_secs))
+    self._lock = threading.Lock()
+    self._requests = 0
+    self._throttled_requests = 0
+    self._throttled_secs = 0.0
+
+  def acquire(self,
+              instance_count = 0,
+              deadline = None):
+    """Blocks until a request with the given number of instances may be sent.
+
+    Args:
+      instance_count: Number of instances in the request.
+      deadline: Deadline of the call the request belongs to. If the request
+        could only be sent after it, acquire fails right away.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If the wait would end after the
+        deadline. No tokens are taken in that case.
+    """
+    wait_secs = self.reserve(instance_count, deadline)
+    if wait_secs > 0:
+      time.sleep(wait_secs)
+
+  def reserve(self,
+              instance_count = 0,
+              deadline = None):
+    """Reserves a request without waiting, for callers that wait themselves.
+
+    Args:
+      instance_count: Number of instances in the request.
+      deadline: Deadline of the call the request belongs to.
+
+    Returns:
+      The seconds the caller has to wait before sending the request.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If the wait would end after the
+        deadline. No tokens are taken in that case.
+    """
+    with self._lock:
+      now = time.monotonic()
+      wait_secs = 0.0
+      if self._request_bucket is not None:
+        wait_secs = self._request_bucket.reserve(1, now)
+      if self._instance_bucket is not None and instance_count:
+        wait_secs = max(wait_secs,
+                        self._instance_bucket.reserve(instance_count, now))
+      if (deadline is not None and
+          wait_secs * 1000 >= deadline.remaining_ms()):
+        if self._request_bucket is not None:
+          self._request_bucket.refund(1)
+        if self._instance_bucket is not None and instance_count:
+          self._instance_bucket.refund(instance_count)
+        raise deadline_utils.DeadlineExceededError(
+            'The rate limit does not allow sending the request before the '
+            'deadline of the call.')
+      self._requests += 1
+      if wait_secs > 0:
+        self._throttled_requests += 1
+        self._throttled_secs += wait_secs
+    return wait_secs
+
+  def stats(self):
+    """Returns a snapshot of the limiter counters.
+
+    Returns:
+      A dict with the number of requests, of those that had to wait, and the
+      total seconds waited.
+    """
+    with self._lock:
+      return {
+          'requests': self._requests,
+          'throttled_requests': self._throttled_requests,
+          'throttled_secs': self._throttled_secs,
+      }
+
+
+class AdaptiveConcurrencyLimiter(object):
+  """Adapts the number of requests in flight to what the service accepts.
+
+  The limit follows additive-increase/multiplicative-decrease (AIMD): each
+  successful response raises it by additive_increase / limit, so it grows by
+  about additive_increase per round of requests, and a 429 or 503 response
+  multiplies it by decrease_factor. Throttled responses to requests that were
+  sent before the last decrease do not decrease it again, so a burst of
+  rejections from one overload only halves the limit once.
+  """
+
+  def __init__(self,
+               initial_limit = 8,
+               min_limit = 1,
+               max_limit = 256,
+               additive_increase = 1.0,
+               decrease_factor = 0.5):
+    """Creates a concurrency limiter.
+
+    Args:
+      initial_limit: Number of concurrent requests allowed at first.
+      min_limit: Lower bound of the limit.
+      max_limit: Upper bound of the limit.
+      additive_increase: How much the limit grows per round of successful
+        requests.
+      decrease_factor: Factor the limit is multiplied by on throttling.
+
+    Raises:
+      ValueError: If the limits are inconsistent or decrease_factor is not in
+        (0, 1).
+    """
+    if not 1 <= min_limit <= initial_limit <= max_limit:
+      raise ValueError('Limits must satisfy 1 <= min_limit <= initial_limit '
+                       '<= max_limit.')
+    if not 0 < decrease_factor < 1:
+      raise ValueError('decrease_factor must be between 0 and 1.')
+    self._limit = float(initial_limit)
+    self._min_limit = min_limit
+    self._max_limit = max_limit
+    self._additive_increase = additive_increase
+    self._decrease_factor = decrease_factor
+    self._condition = threading.Condition()
+    self._in_flight = 0
+    self._sequence = 0
+    self._last_decrease_sequence = 0
+    self._decreases = 0
+    self._release_callbacks = []
+
+  @property
+  def limit(self):
+    """The current number of concurrent requests allowed."""
+    with self._condition:
+      return int(self._limit)
+
+  def acquire(self, deadline = None):
+    """Blocks until a request may be sent.
+
+    Args:
+      deadline: Deadline of the call the request belongs to, which bounds the
+        wait.
+
+    Returns:
+      A ticket to pass to release() once the response arrived.
+
+    Raises:
+      deadline_utils.DeadlineExceededError: If no slot frees up before the
+        deadline.
+    """
+    with self._condition:
+      while self._in_flight >= int(self._limit):
+        if deadline is None:
+          self._condition.wait()
+        else:
+          deadline.check()
+          self._condition.wait(deadline.remaining_ms() / 1000.0)
+      return self._take_slot()
+
+  def try_acquire(self, on_release = None):
+    """Takes a slot if one is free, without waiting.
+
+    This lets callers that must not block a thread, like the asyncio
+    transport, wait for a slot in their own way.
+
+    Args:
+      on_release: Callable without arguments that is called once, after the
+        next release(), if no slot is free now. It is called in the thread
+        that releases the slot, so it has to be quick and thread-safe.
+
+    Returns:
+      A ticket to pass to release(), or None if all slots are taken.
+    """
+    with self._condition:
+      if self._in_flight < int(self._limit):
+        return self._take_slot()
+      if on_release is not None:
+        self._release_callbacks.append(on_release)
+      return None
+
+  def _take_slot(self):
+    """Takes a slot. Must be called with the condition held."""
+    self._in_flight += 1
+    self._sequence += 1
+    return self._sequence
+
+  def release(self, ticket, status_code = None):
+    """Releases a slot and adapts the limit to the outcome of the request.
+
+    Args:
+      ticket: The ticket returned by acquire().
+      status_code: HTTP status of the response. None if the request failed
+        without a response, which leaves the limit unchanged.
+    """
+    with self._condition:
+      self._in_flight -= 1
+      if status_code in _THROTTLED_STATUS_CODES:
+        if ticket > self._last_decrease_sequence:
+          self._limit = max(self._min_limit,
+                            self._limit * self._decrease_factor)
+          self._last_decrease_sequence = self._sequence
+          self._decreases += 1
+      elif status_code is not None and status_code < 500:
+        self._limit = min(self._max_limit,
+                          self._limit + self._additive_increase / self._limit)
+      self._condition.notify_all()
+      callbacks, self._release_callbacks = self._release_callbacks, []
+    for callback in callbacks:
+      callback()
+
+  def stats(self):
+    """Returns the current limit, requests in flight and number of decreases."""
+    with self._condition:
+      return {
+          'limit': int(self._limit),
+          'in_flight': self._in_flight,
+          'decreases': self._decreases,
+      }
@@ -0,0 +1,129 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for throttling."""
+import threading
+
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import deadline_utils
+from explainable_ai_sdk.model import throttling
+
+
+class RateLimiterTest(tf.test.TestCase):
+
+  @mock.patch.object(throttling.time, 'sleep', autospec=True)
+  @mock.patch.object(throttling.time, 'monotonic', return_value=100.0)
+  def test_requests_beyond_burst_wait(self, unused_mock_monotonic,
+                                      mock_sleep):
+    limiter = throttling.RateLimiter(requests_per_sec=2)
+    limiter.acquire()
+    limiter.acquire()
+    self.assertFalse(mock_sleep.called)
+
+    limiter.acquire()
+    mock_sleep.assert_called_once_with(0.5)
+    self.assertEqual(limiter.stats()['throttled_requests'], 1)
+
+  @mock.patch.object(throttling.time, 'sleep', autospec=True)
+  @mock.patch.object(throttling.time, 'monotonic')
+  def test_instances_are_limited(self, mock_monotonic, mock_sleep):
+    mock_monotonic.return_value = 100.0
+    limiter = throttling.RateLimiter(instances_per_sec=10)
+    limiter.acquire(25)
+    mock_sleep.assert_called_once_with(1.5)
+
+    # The debt is paid off after the wait.
+    mock_sleep.reset_mock()
+    mock_monotonic.return_value = 101.5
+    limiter.acquire(0)
+    self.assertFalse(mock_sleep.called)
+
+  @mock.patch.object(throttling.time, 'sleep', autospec=True)
+  @mock.patch.object(throttling.time, 'monotonic', return_value=100.0)
+  def test_wait_past_deadline_fails(self, unused_mock_monotonic, mock_sleep):
+    limiter = throttling.RateLimiter(requests_per_sec=1)
+    limiter.acquire()
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      limiter.acquire(deadline=deadline_utils.Deadline.from_budget_ms(500))
+    self.assertFalse(mock_sleep.called)
+
+    # The failed call took no tokens.
+    limiter.acquire()
+    mock_sleep.assert_called_once_with(1.0)
+
+  def test_invalid_rate(self):
+    with self.assertRaises(ValueError):
+      throttling.RateLimiter(requests_per_sec=0)
+
+
+class AdaptiveConcurrencyLimiterTest(tf.test.TestCase):
+
+  def test_limit_grows_on_success(self):
+    limiter = throttling.AdaptiveConcurrencyLimiter(initial_limit=2)
+    for _ in range(4):
+      limiter.release(limiter.acquire(), 200)
+    self.assertEqual(limiter.limit, 3)
+
+  def test_concurrent_throttling_decreases_once(self):
+    limiter = throttling.AdaptiveConcurrencyLimiter(initial_limit=8)
+    tickets = [limiter.acquire() for _ in range(4)]
+    for ticket in tickets:
+      limiter.release(ticket, 429)
+    self.assertEqual(limiter.limit, 4)
+
+    limiter.release(limiter.acquire(), 503)
+    self.assertEqual(limiter.limit, 2)
+    self.assertEqual(limiter.stats()['decreases'], 2)
+
+  def test_acquire_blocks_at_limit(self):
+    limiter = throttling.AdaptiveConcurrencyLimiter(initial_limit=1)
+    ticket = limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+      limiter.acquire()
+      acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    self.assertFalse(acquired.wait(0.05))
+    limiter.release(ticket)
+    self.assertTrue(acquired.wait(5))
+    thread.join()
+
+  def test_try_acquire_calls_back_on_release(self):
+    limiter = throttling.AdaptiveConcurrencyLimiter(initial_limit=1)
+    ticket = limiter.try_acquire()
+    released = []
+    self.assertIsNone(limiter.try_acquire(lambda: released.append(None)))
+    limiter.release(ticket)
+    self.assertLen(released, 1)
+    self.assertIsNotNone(limiter.try_acquire())
+
+  def test_acquire_gives_up_at_deadline(self):
+    limiter = throttling.AdaptiveConcurrencyLimiter(initial_limit=1)
+    limiter.acquire()
+    with self.assertRaises(deadline_utils.DeadlineExceededError):
+      limiter.acquire(deadline=deadline_utils.Deadline.from_budget_ms(50))
+
+  def test_invalid_limits(self):
+    with self.assertRaises(ValueError):
+      throttling.AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,221 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Caches OAuth2.0 access tokens between requests to GCP services.
+
+Refreshing credentials is an OAuth round trip. TokenCache keeps using the
+current token until it gets close to its expiry, refreshes it once in the
+background when it enters the refresh window, and only blocks callers when the
+token is missing or about to expire.
+"""
+import datetime
+import threading
+import weakref
+
+from absl import logging
+import google.auth
+import google.auth.credentials
+import google.auth.transport.requests
+
+from explainable_ai_sdk.model import constants
+
+
+def _utcnow():
+  """Returns the current time as a naive UTC datetime like credential expiry."""
+  return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class TokenCache(object):
+  """Thread-safe cache of the access token of a single credentials object."""
+
+  def __init__(
+      self,
+      credentials = None,
+      refresh_margin_secs = constants.DEFAULT_TOKEN_REFRESH_MARGIN_SECS,
+      background_refresh_margin_secs = (
+          constants.DEFAULT_TOKEN_BACKGROUND_REFRESH_MARGIN_SECS)):
+    """Creates a token cache.
+
+    Args:
+      credentials: The OAuth2.0 credentials to cache tokens of. If not given,
+        the default credentials are loaded on first use.
+      refresh_margin_secs: Tokens expiring in less than this many seconds are
+        not used; callers wait for a synchronous refresh instead.
+      background_refresh_margin_secs: Tokens expiring in less than this many
+        seconds are still used, but a single background refresh is started.
+        Should be larger than refresh_margin_secs.
+    """
+    self._credentials = credentials
+    self._token = None
+    self._expiry = None
+    if credentials is not None:
+      self._token = credentials.token
+      self._expiry = credentials.expiry
+    self._refresh_margin = datetime.timedelta(seconds=refresh_margin_secs)
+    self._background_refresh_margin = datetime.timedelta(
+        seconds=background_refresh_margin_secs)
+    self._condition = threading.Condition()
+    self._background_refresh_in_flight = False
+    self._hits = 0
+    self._misses = 0
+    self._refreshes = 0
+    self._background_refreshes = 0
+    self._refresh_failures = 0
+
+  @property
+  def credentials(self):
+    return self._credentials
+
+  def stats(self):
+    """Returns a snapshot of the cache counters.
+
+    Returns:
+      A dict with the number of cache hits, misses, synchronous and background
+      refreshes, and failed refreshes.
+    """
+    with self._condition:
+      return {
+          'hits': self._hits,
+          'misses': self._misses,
+          'refreshes': self._refreshes,
+          'background_refreshes': self._background_refreshes,
+          'refresh_failures': self._refresh_failures,
+      }
+
+  def has_usable_token(self):
+    """Returns whether get_request_header can return without a refresh."""
+    with self._condition:
+      return self._is_usable()
+
+  def _time_to_expiry(self):
+    """Returns the time left on the current token, or None if it never expires.
+
+    Must be called with the lock held.
+    """
+    expiry = self._expiry
+    if expiry is None:
+      return None
+    if expiry.tzinfo is not None:
+      expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return expiry - _utcnow()
+
+  def _is_usable(self):
+    if self._token is None:
+      return False
+    time_to_expiry = self._time_to_expiry()
+    return time_to_expiry is None or time_to_expiry > self._refresh_margin
+
+  def _needs_background_refresh(self):
+    time_to_expiry = self._time_to_expiry()
+    return (time_to_expiry is not None and
+            time_to_expiry <= self._background_refresh_margin)
+
+  def _refresh(self):
+    """Refreshes the credentials and returns their new token and expiry."""
+    auth_req = google.auth.transport.requests.Request()
+    self._credentials.refresh(auth_req)
+    return self._credentials.token, self._credentials.expiry
+
+  def _background_refresh(self):
+    """Refreshes the token off the request path.
+
+    Callers keep reading the published token and expiry while the credentials
+    are being refreshed, so the new ones are only published once complete.
+    """
+    try:
+      token, expiry = self._refresh()
+      with self._condition:
+        self._token = token
+        self._expiry = expiry
+    except Exception as e:  # pylint: disable=broad-except
+      # The token is still valid; a later request will refresh synchronously
+      # if the background refresh keeps failing.
+      logging.warning('Background credentials refresh failed: %s', e)
+      with self._condition:
+        self._refresh_failures += 1
+    finally:
+      with self._condition:
+        self._background_refresh_in_flight = False
+        self._condition.notify_all()
+
+  def get_request_header(self):
+    """Returns auth headers for a request, refreshing the token if needed.
+
+    Returns:
+      A header dict with the authorization header applied.
+    """
+    with self._condition:
+      if self._is_usable():
+        self._hits += 1
+        if (self._needs_background_refresh() and
+            not self._background_refresh_in_flight):
+          self._background_refresh_in_flight = True
+          self._background_refreshes += 1
+          thread = threading.Thread(target=self._background_refresh)
+          thread.daemon = True
+          thread.start()
+      else:
+        # Holding the condition's lock while refreshing makes concurrent
+        # callers wait for this refresh instead of issuing their own.
+        self._misses += 1
+        if self._credentials is None:
+          self._credentials, _ = google.auth.default()
+          self._token = self._credentials.token
+          self._expiry = self._credentials.expiry
+        # A background refresh already on its way publishes the new token;
+        # waiting for it keeps refreshes single-flight.
+        while self._background_refresh_in_flight and not self._is_usable():
+          self._condition.wait()
+        if not self._is_usable():
+          try:
+            self._token, self._expiry = self._refresh()
+          except Exception:
+            self._refresh_failures += 1
+            raise
+          self._refreshes += 1
+      headers = {}
+      self._credentials.apply(headers, token=self._token)
+    return headers
+
+
+# Caches are held as long as their credentials object is alive. They reference
+# it through a proxy so that the cache does not keep its own key alive.
+_token_caches = weakref.WeakKeyDictionary()
+_default_token_cache = None
+_token_caches_lock = threading.Lock()
+
+
+def get_token_cache(
+    credentials = None):
+  """Returns the process-wide token cache for the given credentials.
+
+  Args:
+    credentials: The OAuth2.0 credentials to use for GCP services. If not given,
+      the cache for the default credentials is returned.
+
+  Returns:
+    A TokenCache shared by every caller using the same credentials object.
+  """
+  global _default_token_cache
+  with _token_caches_lock:
+    if credentials is None:
+      if _default_token_cache is None:
+        _default_token_cache = TokenCache()
+      return _default_token_cache
+    cache = _token_caches.get(credentials)
+    if cache is None:
+      cache = TokenCache(weakref.proxy(credentials))
+      _token_caches[credentials] = cache
+    return cache
@@ -0,0 +1,151 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for token_cache."""
+import datetime
+import gc
+import threading
+import time
+import weakref
+
+import google.auth.credentials
+import mock
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import token_cache
+
+
+class FakeCredentials(google.auth.credentials.Credentials):
+  """Credentials handing out numbered tokens that live for token_lifetime."""
+
+  def __init__(self, token_lifetime, refresh_delay_secs=0):
+    super(FakeCredentials, self).__init__()
+    self.token_lifetime = token_lifetime
+    self.refresh_delay_secs = refresh_delay_secs
+    self.refresh_count = 0
+
+  def refresh(self, request):
+    del request
+    time.sleep(self.refresh_delay_secs)
+    self.refresh_count += 1
+    self.token = 'token-%d' % self.refresh_count
+    self.expiry = token_cache._utcnow() + self.token_lifetime
+
+
+class TokenCacheTest(tf.test.TestCase):
+
+  def test_reuses_valid_token(self):
+    credentials = FakeCredentials(datetime.timedelta(hours=1))
+    cache = token_cache.TokenCache(credentials)
+
+    for _ in range(5):
+      headers = cache.get_request_header()
+
+    self.assertEqual(headers['authorization'], 'Bearer token-1')
+    self.assertEqual(credentials.refresh_count, 1)
+    stats = cache.stats()
+    self.assertEqual(stats['misses'], 1)
+    self.assertEqual(stats['hits'], 4)
+    self.assertEqual(stats['refreshes'], 1)
+
+  def test_refreshes_token_about_to_expire(self):
+    credentials = FakeCredentials(datetime.timedelta(seconds=30))
+    cache = token_cache.TokenCache(credentials, refresh_margin_secs=60)
+
+    cache.get_request_header()
+    headers = cache.get_request_header()
+
+    self.assertEqual(headers['authorization'], 'Bearer token-2')
+    self.assertEqual(cache.stats()['misses'], 2)
+
+  def test_refreshes_in_background_once(self):
+    credentials = FakeCredentials(
+        datetime.timedelta(seconds=120), refresh_delay_secs=0.2)
+    cache = token_cache.TokenCache(
+        credentials, refresh_margin_secs=60,
+        background_refresh_margin_secs=300)
+    cache.get_request_header()
+
+    # The token is usable but inside the background refresh window.
+    for _ in range(10):
+      headers = cache.get_request_header()
+      self.assertEqual(headers['authorization'], 'Bearer token-1')
+
+    for _ in range(100):
+      if not cache._background_refresh_in_flight:
+        break
+      time.sleep(0.05)
+    self.assertEqual(credentials.refresh_count, 2)
+    self.assertEqual(cache.stats()['background_refreshes'], 1)
+
+  def test_miss_waits_for_background_refresh(self):
+    credentials = FakeCredentials(
+        datetime.timedelta(seconds=120), refresh_delay_secs=0.2)
+    cache = token_cache.TokenCache(
+        credentials, refresh_margin_secs=60,
+        background_refresh_margin_secs=300)
+    cache.get_request_header()
+    # Starts a background refresh.
+    cache.get_request_header()
+
+    # The token expires while the background refresh is in flight.
+    later = token_cache._utcnow() + datetime.timedelta(seconds=70)
+    with mock.patch.object(token_cache, '_utcnow', return_value=later):
+      headers = cache.get_request_header()
+
+    self.assertEqual(headers['authorization'], 'Bearer token-2')
+    self.assertEqual(credentials.refresh_count, 2)
+    self.assertEqual(cache.stats()['refreshes'], 1)
+
+  def test_concurrent_misses_refresh_once(self):
+    credentials = FakeCredentials(
+        datetime.timedelta(hours=1), refresh_delay_secs=0.1)
+    cache = token_cache.TokenCache(credentials)
+
+    threads = [
+        threading.Thread(target=cache.get_request_header) for _ in range(8)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(credentials.refresh_count, 1)
+    self.assertEqual(cache.stats()['refreshes'], 1)
+
+  def test_get_token_cache_is_shared_per_credentials(self):
+    credentials = FakeCredentials(datetime.timedelta(hours=1))
+    other_credentials = FakeCredentials(datetime.timedelta(hours=1))
+
+    self.assertIs(
+        token_cache.get_token_cache(credentials),
+        token_cache.get_token_cache(credentials))
+    self.assertIsNot(
+        token_cache.get_token_cache(credentials),
+        token_cache.get_token_cache(other_credentials))
+
+  def test_get_token_cache_does_not_keep_credentials_alive(self):
+    credentials = FakeCredentials(datetime.timedelta(hours=1))
+    token_cache.get_token_cache(credentials).get_request_header()
+    credentials_ref = weakref.ref(credentials)
+
+    del credentials
+    gc.collect()
+
+    self.assertIsNone(credentials_ref())
+
+
+if __name__ == '__main__':
+  tf.test.main()
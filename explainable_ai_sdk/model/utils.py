@@ -15,10 +15,67 @@
 """Utility functions for models.
 """
 import collections
+import json
+import os
+import tempfile
+
+import numpy as np
 
 from explainable_ai_sdk.common import explain_metadata
 from explainable_ai_sdk.model import constants
 
+# Score differences below this are treated as this value when computing the
+# relative approximation error, so that it stays finite for flat outputs.
+_MIN_SCORE_DELTA = 1e-3
+
+# Attributions computed in-process by a local explainer.
+#   attributions: Dictionary from input name to attributions of shape
+#     [instances, labels, ...].
+#   baseline_scores: Array of shape [instances, labels] with the model score of
+#     the explained label at the baselines, averaged over baselines.
+#   approx_errors: Array of shape [instances, labels] with the approximation
+#     error of each attribution, or None if the method has none.
+AttributionResult = collections.namedtuple(
+    'AttributionResult', ['attributions', 'baseline_scores', 'approx_errors'])
+
+
+def _to_json_value(obj):
+  """Converts numpy values, which json cannot encode, to Python values."""
+  if isinstance(obj, np.ndarray):
+    return obj.tolist()
+  if isinstance(obj, np.generic):
+    return obj.item()
+  raise TypeError('Object of type {} is not JSON serializable'.format(
+      type(obj).__name__))
+
+
+def write_json_atomically(path, obj):
+  """Writes obj as JSON to path.
+
+  The JSON is written to a temporary file in the same directory first and
+  then moved over path, so that concurrent readers in other processes never
+  see a partially written file. Numpy arrays and scalars are written as lists
+  and numbers.
+
+  Args:
+    path: Path of the file to write.
+    obj: A JSON serializable object.
+
+  Raises:
+    IOError, OSError: If the file cannot be written.
+  """
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'w') as f:
+      json.dump(obj, f, default=_to_json_value)
+    os.replace(tmp_path, path)
+  except BaseException:
+    try:
+      os.remove(tmp_path)
+    except OSError:
+      pass
+    raise
+
 
 def get_modality_input_list_map(
     explain_md):
@@ -52,3 +109,119 @@ def get_modality_input_list_map(
         modality_input_list_map[input_modality].append(input_name)
         modality_input_list_map[constants.ALL_MODALITY].append(input_name)
   return modality_input_list_map
+
+
+def split_instances(
+    instances,
+    max_instances_per_request = None,
+    max_payload_bytes = None):
+  """Splits instances into consecutive chunks that each fit in one request.
+
+  Payload size is estimated from the JSON encoding of each instance. An
+  instance that is larger than max_payload_bytes on its own is put in a chunk
+  by itself.
+
+  Args:
+    instances: A list of instances.
+    max_instances_per_request: Maximum number of instances in a chunk. No limit
+      if None.
+    max_payload_bytes: Maximum estimated size of the instances in a chunk in
+      bytes. No limit if None.
+
+  Returns:
+    A list of (start, end) index pairs covering instances in order.
+
+  Raises:
+    ValueError: If one of the limits is not positive.
+  """
+  if max_instances_per_request is not None and max_instances_per_request <= 0:
+    raise ValueError('max_instances_per_request must be positive.')
+  if max_payload_bytes is not None and max_payload_bytes <= 0:
+    raise ValueError('max_payload_bytes must be positive.')
+
+  chunks = []
+  start = 0
+  chunk_bytes = 0
+  for idx, instance in enumerate(instances):
+    instance_bytes = 0
+    if max_payload_bytes is not None:
+      # One extra byte for the separating comma in the instances list.
+      instance_bytes = len(json.dumps(instance)) + 1
+    chunk_is_full = (
+        (max_instances_per_request is not None and
+         idx - start >= max_instances_per_request) or
+        (max_payload_bytes is not None and
+         chunk_bytes + instance_bytes > max_payload_bytes))
+    if idx > start and chunk_is_full:
+      chunks.append((start, idx))
+      start = idx
+      chunk_bytes = 0
+    chunk_bytes += instance_bytes
+  if start < len(instances):
+    chunks.append((start, len(instances)))
+  return chunks
+
+
+def canonical_json(instance):
+  """Encodes an instance so that equal instances give equal strings.
+
+  Args:
+    instance: A JSON serializable instance.
+
+  Returns:
+    The JSON encoding of the instance with sorted keys and no whitespace.
+  """
+  return json.dumps(instance, sort_keys=True, separators=(',', ':'))
+
+
+def deduplicate_instances(instances):
+  """Removes duplicate instances, keeping the first occurrence of each.
+
+  Instances are equal if their canonical JSON encodings are, regardless of the
+  order of their keys.
+
+  Args:
+    instances: A list of JSON serializable instances.
+
+  Returns:
+    A tuple of the list of unique instances and a list holding, for each
+    input instance, the index of its unique instance.
+  """
+  unique_instances = []
+  unique_indices = {}
+  inverse = []
+  for instance in instances:
+    key = canonical_json(instance)
+    idx = unique_indices.get(key)
+    if idx is None:
+      idx = len(unique_instances)
+      unique_indices[key] = idx
+      unique_instances.append(instance)
+    inverse.append(idx)
+  return unique_instances, inverse
+
+
+def get_approx_errors(attributions, example_scores,
+                      baseline_scores):
+  """Returns the completeness gap of attributions relative to the score delta.
+
+  Path methods such as Integrated Gradients attribute the whole difference
+  between the example and baseline scores, so the sum of attributions is off
+  from that difference only by the error of the approximation.
+
+  Args:
+    attributions: Dictionary from input name to attributions of shape
+      [instances, labels, ...].
+    example_scores: Array of shape [instances, labels].
+    baseline_scores: Array of shape [instances, labels].
+
+  Returns:
+    An array of shape [instances, labels] with |sum of attributions - score
+    delta| / |score delta|.
+  """
+  attribution_sums = np.zeros_like(example_scores, dtype=np.float64)
+  for attrs in attributions.values():
+    attribution_sums += attrs.reshape(attrs.shape[:2] + (-1,)).sum(axis=2)
+  deltas = example_scores - baseline_scores
+  return (np.abs(attribution_sums - deltas) /
+          np.maximum(np.abs(deltas), _MIN_SCORE_DELTA))
@@ -54,5 +54,30 @@ class UtilsTest(tf.test.TestCase):
     self.assertLen(modalities[constants.TABULAR_MODALITY], 4)
     self.assertLen(modalities[explain_metadata.Modality.IMAGE], 1)
 
+  def test_split_instances_no_limits(self):
+    self.assertEqual(utils.split_instances([{'a': 1}] * 5), [(0, 5)])
+    self.assertEqual(utils.split_instances([]), [])
+
+  def test_split_instances_by_count(self):
+    chunks = utils.split_instances([{'a': 1}] * 5, max_instances_per_request=2)
+    self.assertEqual(chunks, [(0, 2), (2, 4), (4, 5)])
+
+  def test_split_instances_by_payload_bytes(self):
+    instances = [{'a': 'x' * 10}, {'a': 'x' * 10}, {'a': 'x' * 100},
+                 {'a': 'x'}]
+    # Each small instance encodes to 18 bytes, the large one to 108.
+    chunks = utils.split_instances(instances, max_payload_bytes=50)
+    self.assertEqual(chunks, [(0, 2), (2, 3), (3, 4)])
+
+  def test_split_instances_invalid_limit(self):
+    with self.assertRaises(ValueError):
+      utils.split_instances([{'a': 1}], max_instances_per_request=0)
+
+  def test_deduplicate_instances(self):
+    instances = [{'a': 1, 'b': 2}, {'a': 2}, {'b': 2, 'a': 1}, {'a': 2}]
+    unique_instances, inverse = utils.deduplicate_instances(instances)
+    self.assertEqual(unique_instances, [{'a': 1, 'b': 2}, {'a': 2}])
+    self.assertEqual(inverse, [0, 1, 0, 1])
+
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,439 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""XRAI image attributions computed in-process.
+
+XRAI (eXplanation with Ranked Area Integrals) turns the pixel attributions of
+Integrated Gradients into region attributions. The image is over-segmented at
+several scales, and regions are added greedily in order of their attribution
+density (attribution per pixel not yet covered). Each pixel is attributed the
+density of the region that first covered it, so the most important areas of
+the image stand out as whole regions rather than scattered pixels.
+
+Segmentation uses the Felzenszwalb graph-based algorithm of scikit-image if it
+is installed. Otherwise a simplified pure-Python version of the algorithm is
+used, which is much slower and gives segments that differ from those of
+scikit-image, so attributions depend on whether scikit-image is installed.
+Segmentation is the most expensive step after the model calls and only depends
+on the image, so the segments of recently explained images are kept in a
+SegmentationCache and reused when the same image is explained for other labels
+or baselines.
+"""
+import collections
+import hashlib
+import math
+import threading
+
+import numpy as np
+
+from explainable_ai_sdk.model import constants
+from explainable_ai_sdk.model import integrated_gradients
+from explainable_ai_sdk.model import utils
+
+try:
+  from skimage import segmentation as skimage_segmentation  # pylint: disable=g-import-not-at-top
+except ImportError:
+  skimage_segmentation = None
+
+# Segmentation scales of the Felzenszwalb algorithm used by XRAI. Larger
+# scales give larger regions.
+DEFAULT_SEGMENTATION_SCALES = (50, 100, 150, 250, 500, 1200)
+_SEGMENTATION_SIGMA = 0.8
+_MIN_SEGMENT_SIZE = 150
+# Regions are grown by this many pixels so that they overlap their neighbors.
+_DILATION_RADIUS = 5
+# Regions adding fewer new pixels than this are not ranked.
+_MIN_PIXEL_DIFF = 50
+
+
+def _gaussian_blur(image, sigma):
+  """Blurs an [height, width, channels] image with a Gaussian kernel."""
+  radius = int(math.ceil(4 * sigma))
+  offsets = np.arange(-radius, radius + 1)
+  kernel = np.exp(-0.5 * (offsets / sigma)**2)
+  kernel /= kernel.sum()
+  for axis in (0, 1):
+    pad = [(0, 0)] * image.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(image, pad, mode='edge')
+    size = image.shape[axis]
+    image = sum(
+        weight * np.take(padded, np.arange(k, k + size), axis=axis)
+        for k, weight in enumerate(kernel))
+  return image
+
+
+def _find(parents, node):
+  """Returns the root of node, compressing the path to it."""
+  root = node
+  while parents[root] != root:
+    root = parents[root]
+  while parents[node] != root:
+    parents[node], node = root, parents[node]
+  return root
+
+
+def _felzenszwalb(image, scale, sigma, min_size):
+  """Segments an image with the Felzenszwalb graph-based algorithm.
+
+  Pixels are nodes of a 4-connected grid graph whose edge weights are color
+  distances. Edges are visited by increasing weight, and two components are
+  merged when the edge between them is not heavier than the heaviest edge
+  inside either component plus scale / component size. Components smaller
+  than min_size are merged into a neighbor afterwards. As in scikit-image,
+  scale is given for colors in [0, 255] and divided by 255.
+
+  scikit-image is used if it is installed. The fallback is a per-edge
+  union-find loop in Python on a 4-connected grid. It follows the same
+  merging rules but is not a port of scikit-image, whose graph and smoothing
+  differ, so the two do not give the same segments.
+
+  Args:
+    image: Array of shape [height, width, channels].
+    scale: Larger values give larger segments.
+    sigma: Width of the Gaussian blur applied before segmenting.
+    min_size: Minimum number of pixels of a segment.
+
+  Returns:
+    An integer array of shape [height, width] with a segment label per pixel.
+  """
+  if skimage_segmentation is not None:
+    return skimage_segmentation.felzenszwalb(
+        image, scale=scale, sigma=sigma, min_size=min_size)
+  height, width = image.shape[:2]
+  scale = float(scale) / 255
+  image = _gaussian_blur(image.astype(np.float64), sigma)
+  nodes = np.arange(height * width).reshape(height, width)
+  sources = np.concatenate([nodes[:, :-1].ravel(), nodes[:-1, :].ravel()])
+  targets = np.concatenate([nodes[:, 1:].ravel(), nodes[1:, :].ravel()])
+  pixels = image.reshape(height * width, -1)
+  weights = np.sqrt(((pixels[sources] - pixels[targets])**2).sum(axis=1))
+  order = np.argsort(weights, kind='stable')
+  sources = sources[order].tolist()
+  targets = targets[order].tolist()
+  weights = weights[order].tolist()
+
+  parents = list(range(height * width))
+  sizes = [1] * (height * width)
+  thresholds = [scale] * (height * width)
+  for source, target, weight in zip(sources, targets, weights):
+    a = _find(parents, source)
+    b = _find(parents, target)
+    if a != b and weight <= thresholds[a] and weight <= thresholds[b]:
+      parents[b] = a
+      sizes[a] += sizes[b]
+      thresholds[a] = weight + scale / sizes[a]
+  for source, target in zip(sources, targets):
+    a = _find(parents, source)
+    b = _find(parents, target)
+    if a != b and (sizes[a] < min_size or sizes[b] < min_size):
+      parents[b] = a
+      sizes[a] += sizes[b]
+
+  roots = np.array([_find(parents, node) for node in range(height * width)])
+  _, labels = np.unique(roots, return_inverse=True)
+  return labels.reshape(height, width)
+
+
+def _dilate(mask, radius):
+  """Grows a boolean mask by a disk of the given radius."""
+  rows, cols = np.nonzero(mask)
+  height, width = mask.shape
+  top, bottom = max(rows.min() - radius, 0), min(rows.max() + radius + 1,
+                                                 height)
+  left, right = max(cols.min() - radius, 0), min(cols.max() + radius + 1,
+                                                 width)
+  window = mask[top:bottom, left:right]
+  padded = np.pad(window, radius)
+  dilated = np.zeros_like(window)
+  for dy in range(-radius, radius + 1):
+    for dx in range(-radius, radius + 1):
+      if dy * dy + dx * dx <= radius * radius:
+        dilated |= padded[radius + dy:radius + dy + window.shape[0],
+                          radius + dx:radius + dx + window.shape[1]]
+  result = np.zeros_like(mask)
+  result[top:bottom, left:right] = dilated
+  return result
+
+
+def _normalize_image(image):
+  """Scales image values to [-1, 1], the range the scales are tuned for."""
+  low, high = image.min(), image.max()
+  if high - low < 1e-12:
+    return np.zeros_like(image, dtype=np.float64)
+  return (image - low) / (high - low) * 2 - 1
+
+
+def get_segment_masks(image,
+                      scales = DEFAULT_SEGMENTATION_SCALES):
+  """Over-segments an image at several scales.
+
+  Args:
+    image: Array of shape [height, width, channels] or [height, width].
+    scales: Felzenszwalb scales to segment the image at.
+
+  Returns:
+    A boolean array of shape [segments, height, width] with the dilated mask
+    of each segment of each scale.
+  """
+  if image.ndim == 2:
+    image = image[:, :, np.newaxis]
+  image = _normalize_image(image)
+  masks = []
+  for scale in scales:
+    labels = _felzenszwalb(image, scale, _SEGMENTATION_SIGMA,
+                           _MIN_SEGMENT_SIZE)
+    for label in range(labels.max() + 1):
+      mask = labels == label
+      if mask.any():
+        masks.append(_dilate(mask, _DILATION_RADIUS))
+  return np.stack(masks)
+
+
+def make_segmentation_key(image,
+                          scales):
+  """Returns the segmentation cache key of an image.
+
+  Args:
+    image: Array with the pixels of the image.
+    scales: Felzenszwalb scales the image is segmented at.
+
+  Returns:
+    A hex digest of the pixels, shape and dtype of the image and the scales.
+  """
+  image = np.ascontiguousarray(image)
+  digest = hashlib.sha256()
+  digest.update(repr((image.shape, image.dtype.str, tuple(scales))).encode())
+  digest.update(image.tobytes())
+  return digest.hexdigest()
+
+
+class SegmentationCache(object):
+  """Thread-safe LRU cache of the segment masks of images.
+
+  Masks of an image take a few bits per pixel and segment, so the cache is
+  bounded by its number of entries and evicts the least recently used image
+  first. Returned masks are read-only since they are shared between calls.
+  """
+
+  def __init__(
+      self,
+      max_entries = constants.DEFAULT_SEGMENTATION_CACHE_MAX_ENTRIES):
+    """Creates a segmentation cache.
+
+    Args:
+      max_entries: Maximum number of images whose masks are kept.
+    """
+    self._max_entries = max_entries
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+
+  def stats(self):
+    """Returns a snapshot of the cache counters.
+
+    Returns:
+      A dict with the number of hits, misses (images segmented), evictions
+      and the number of entries.
+    """
+    with self._lock:
+      return {
+          'hits': self._hits,
+          'misses': self._misses,
+          'evictions': self._evictions,
+          'entries': len(self._entries),
+      }
+
+  def get(self, image,
+          scales = DEFAULT_SEGMENTATION_SCALES):
+    """Returns the segment masks of an image, segmenting it on a miss.
+
+    Args:
+      image: Array of shape [height, width, channels] or [height, width].
+      scales: Felzenszwalb scales to segment the image at.
+
+    Returns:
+      A read-only boolean array of shape [segments, height, width], as
+      returned by get_segment_masks.
+    """
+    key = make_segmentation_key(image, scales)
+    with self._lock:
+      masks = self._entries.get(key)
+      if masks is not None:
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return masks
+      self._misses += 1
+    # Segment outside the lock so that other images are not held up. Two
+    # threads missing the same image both segment it.
+    masks = get_segment_masks(image, scales)
+    masks.flags.writeable = False
+    with self._lock:
+      self._entries[key] = masks
+      self._entries.move_to_end(key)
+      while len(self._entries) > self._max_entries:
+        self._entries.popitem(last=False)
+        self._evictions += 1
+    return masks
+
+
+def _rank_flat_regions(attributions, masks,
+                       sums):
+  """Ranks regions of one flattened attribution map.
+
+  Args:
+    attributions: Array of shape [pixels].
+    masks: Boolean array of shape [regions, pixels].
+    sums: Array of shape [regions] with the attribution sum of each region.
+
+  Returns:
+    An array of shape [pixels] with the density of the region that first
+    covered each pixel, or the mean attribution for uncovered pixels.
+  """
+  counts = masks.sum(axis=1)
+  output = np.full(attributions.shape, -np.inf)
+  covered = np.zeros(attributions.shape, dtype=bool)
+  active = counts >= _MIN_PIXEL_DIFF
+  while active.any():
+    gains = np.where(active, sums / np.maximum(counts, 1), -np.inf)
+    best_region = int(np.argmax(gains))
+    added = np.flatnonzero(masks[best_region] & ~covered)
+    output[added] = gains[best_region]
+    covered[added] = True
+    # Only the newly covered pixels change the counts and sums of the other
+    # regions, so all of them are updated with one product.
+    added_masks = masks[:, added]
+    counts -= added_masks.sum(axis=1)
+    sums -= added_masks.dot(attributions[added])
+    active &= counts >= _MIN_PIXEL_DIFF
+    active[best_region] = False
+  uncovered = ~covered
+  if uncovered.any():
+    output[uncovered] = attributions[uncovered].mean()
+  return output
+
+
+def rank_regions(attributions, masks):
+  """Ranks regions greedily by attribution density and returns pixel gains.
+
+  The region added next is the one with the highest attribution per pixel not
+  yet covered, among regions adding at least _MIN_PIXEL_DIFF pixels. The
+  initial region sums of all attribution maps are one matrix product, and
+  after each step only the newly covered pixels are subtracted.
+
+  Args:
+    attributions: Array of shape [..., height, width] with pixel
+      attributions, e.g. one map per label.
+    masks: Boolean array of shape [regions, height, width].
+
+  Returns:
+    An array of the shape of attributions holding, for each pixel, the
+    attribution density of the region that first covered it.
+  """
+  shape = attributions.shape
+  pixel_count = shape[-2] * shape[-1]
+  flat_attributions = attributions.reshape(-1, pixel_count).astype(np.float64)
+  flat_masks = masks.reshape(len(masks), pixel_count)
+  # Single precision halves the size of the mask matrix, which is cast once
+  # per image for all maps.
+  all_sums = flat_masks.astype(np.float32).dot(
+      flat_attributions.T.astype(np.float32)).T
+  output = np.stack([
+      _rank_flat_regions(flat, flat_masks, sums.astype(np.float64))
+      for flat, sums in zip(flat_attributions, all_sums)
+  ])
+  return output.reshape(shape)
+
+
+class Xrai(object):
+  """Explains image inputs of a model function with XRAI.
+
+  Inputs that are not images keep their Integrated Gradients attributions.
+  """
+
+  def __init__(self,
+               step_count = 50,
+               image_inputs = (),
+               scales = DEFAULT_SEGMENTATION_SCALES,
+               max_batch_bytes = constants.DEFAULT_LOCAL_MAX_BATCH_BYTES,
+               max_step_count = None,
+               segmentation_cache = None):
+    """Creates the explainer.
+
+    Args:
+      step_count: Number of Integrated Gradients steps.
+      image_inputs: Names of the image inputs, of shape [height, width,
+        channels] or [height, width] per instance.
+      scales: Felzenszwalb scales to segment images at.
+      max_batch_bytes: Memory budget of the inputs and gradients of one model
+        call of Integrated Gradients.
+      max_step_count: If greater than step_count, the Integrated Gradients
+        step count adapts to each instance up to this many steps.
+      segmentation_cache: Cache of the segments of explained images. A new
+        cache is created if None.
+    """
+    self._integrated_gradients = integrated_gradients.IntegratedGradients(
+        step_count,
+        max_batch_bytes=max_batch_bytes,
+        max_step_count=max_step_count)
+    self._image_inputs = frozenset(image_inputs)
+    self._scales = scales
+    if segmentation_cache is None:
+      segmentation_cache = SegmentationCache()
+    self._segmentation_cache = segmentation_cache
+
+  @property
+  def segmentation_cache(self):
+    return self._segmentation_cache
+
+  def attribute(self, model_fn, inputs,
+                baselines,
+                label_indices,
+                scores = None):
+    """Computes attributions of the given labels of each instance.
+
+    Args:
+      model_fn: A local_model.ModelFunction to explain.
+      inputs: Dictionary from input name to a batch of instance values.
+      baselines: A list of dictionaries from input name to baseline values
+        without the batch dimension. Attributions are averaged over baselines.
+      label_indices: Array of shape [instances, labels] with the output
+        indices to explain for each instance.
+      scores: Optional array of shape [instances, outputs] with the scores of
+        the instances, if the caller already computed them.
+
+    Returns:
+      A utils.AttributionResult. Image inputs have attributions of shape
+      [instances, labels, height, width]. Approximation errors are those of
+      the underlying Integrated Gradients attributions.
+    """
+    result = self._integrated_gradients.attribute(model_fn, inputs, baselines,
+                                                  label_indices, scores)
+    attributions = dict(result.attributions)
+    for name in self._image_inputs & set(attributions):
+      pixel_attributions = attributions[name]
+      if pixel_attributions.ndim == 5:
+        pixel_attributions = pixel_attributions.sum(axis=4)
+      attributions[name] = np.stack([
+          rank_regions(
+              image_attributions,
+              self._segmentation_cache.get(image, self._scales))
+          for image, image_attributions in zip(inputs[name],
+                                               pixel_attributions)
+      ])
+    return utils.AttributionResult(attributions, result.baseline_scores,
+                                   result.approx_errors)
@@ -0,0 +1,112 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for xrai."""
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+from explainable_ai_sdk.model import xrai
+
+
+class _ChannelModelFunction(object):
+  """Scores the sum of each channel of an image as one label."""
+
+  differentiable_inputs = ['image']
+
+  def scores(self, inputs):
+    return inputs['image'].sum(axis=(1, 2))
+
+  def gradients(self, inputs, label_indices, names):
+    del names
+    image = inputs['image']
+    gradients = np.zeros_like(image)
+    gradients[np.arange(len(image)), :, :, label_indices] = 1.0
+    return self.scores(inputs)[np.arange(len(image)), label_indices], {
+        'image': gradients
+    }
+
+
+class XraiTest(tf.test.TestCase):
+
+  def test_rank_regions(self):
+    attributions = np.zeros((20, 20))
+    attributions[:10, :10] = 3.0
+    attributions[:10, 10:] = 1.0
+    masks = np.zeros((4, 20, 20), dtype=bool)
+    masks[0, :10, :10] = True
+    masks[1, :10] = True
+    masks[2] = True
+    # Too small to be ranked.
+    masks[3, 19, :5] = True
+
+    regions = xrai.rank_regions(np.stack([attributions, -attributions]), masks)
+
+    expected = np.zeros((20, 20))
+    expected[:10, :10] = 3.0
+    expected[:10, 10:] = 1.0
+    self.assertAllClose(regions[0], expected)
+    # The whole image has the highest density of negated attributions.
+    self.assertAllClose(regions[1], np.full((20, 20), -1.0))
+
+  def test_rank_regions_fills_uncovered_pixels_with_mean(self):
+    attributions = np.arange(100.0).reshape(10, 10)
+    masks = np.zeros((1, 10, 10), dtype=bool)
+    masks[0, :6] = True
+
+    regions = xrai.rank_regions(attributions, masks)
+
+    self.assertAllClose(regions[:6], np.full((6, 10), 29.5))
+    self.assertAllClose(regions[6:], np.full((4, 10), 79.5))
+
+  def test_segmentation_cache(self):
+    image = np.random.RandomState(0).rand(24, 24, 3)
+    cache = xrai.SegmentationCache(max_entries=1)
+
+    masks = cache.get(image)
+    self.assertIs(cache.get(image.copy()), masks)
+    self.assertFalse(masks.flags.writeable)
+    self.assertAllEqual(masks, xrai.get_segment_masks(image))
+    cache.get(image, scales=(100,))
+    cache.get(image)
+    self.assertEqual(cache.stats(), {
+        'hits': 1,
+        'misses': 3,
+        'evictions': 2,
+        'entries': 1
+    })
+
+  def test_attribute_reuses_segments(self):
+    rng = np.random.RandomState(0)
+    inputs = {'image': rng.rand(2, 24, 24, 3)}
+    baselines = [{'image': np.zeros((24, 24, 3))}]
+    explainer = xrai.Xrai(step_count=2, image_inputs=['image'])
+
+    first = explainer.attribute(model_fn=_ChannelModelFunction(),
+                                inputs=inputs, baselines=baselines,
+                                label_indices=np.array([[0], [1]]))
+    second = explainer.attribute(model_fn=_ChannelModelFunction(),
+                                 inputs=inputs, baselines=baselines,
+                                 label_indices=np.array([[2, 0], [1, 2]]))
+
+    self.assertEqual(first.attributions['image'].shape, (2, 1, 24, 24))
+    self.assertEqual(second.attributions['image'].shape, (2, 2, 24, 24))
+    self.assertAllClose(second.attributions['image'][0, 1],
+                        first.attributions['image'][0, 0])
+    self.assertEqual(explainer.segmentation_cache.stats()['misses'], 2)
+    self.assertEqual(explainer.segmentation_cache.stats()['hits'], 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -44,7 +44,18 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     install_requires=required_packages,
+    extras_require={
+        'async': ['aiohttp>=3.6.2'],
+        'fast_json': ['orjson>=3.0.0'],
+        'xrai': ['scikit-image>=0.16.0'],
+    },
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': [
+            'explainable-ai-bulk-explain='
+            'explainable_ai_sdk.model.bulk_explain:main',
+        ],
+    },
     version=__version__,
     author='Google LLC',
     author_email='xai-dev@googlegroups.com',